@@ -3,6 +3,7 @@ from .omeTifReader import OmeTifReader
 from .omeTifWriter import OmeTifWriter
 from .pngReader import PngReader
 from .pngWriter import PngWriter
+from .rangeFile import RangeFile
 from .tifReader import TifReader
 
 def init():
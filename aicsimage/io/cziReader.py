@@ -1,4 +1,7 @@
+from multiprocessing.pool import ThreadPool
+
 from . import czifile
+from .lazyArray import LazyArray
 import numpy as np
 
 
@@ -26,6 +29,22 @@ class CziReader:
     This should be used when only a few select slices need to be processed
     (e.g. printing out the middle slice for a thumbnail image)
 
+    The lazy() function returns a view of the 5D image with dimensions TZCYX that supports numpy style slicing.
+    Only the subblocks that intersect the requested region are decoded, which is much cheaper than load()
+    when a few channels, z slices or a small YX region of a large file are needed.
+
+    The load_roi() function reads a YX region of interest of a scene, optionally limited to ranges of z slices,
+    channels and time points, into a 5D array with dimensions TZCYX. Only the mosaic tiles intersecting the region
+    are decoded, and the region is clipped to the scene like in OmeTifReader.load_roi().
+
+    Files with multiple scenes (positions) are read one scene at a time: scenes() lists the scene indices,
+    load(scene=s) and lazy(scene=s) read only the subblocks of scene s within the scene's bounding box,
+    and map_scenes() calls a function on the lazy views of all scenes in parallel threads.
+    Without a scene, load() and lazy() return the first scene on the canvas of all scenes.
+
+    The find_subblocks() function returns the CZI subblocks that hold a given plane.
+    It uses an index built on the first lookup, so later lookups do not scan the file directory.
+
     This class has a similar interface to OmeTifReader.
 
     In order to better understand the inner workings of this class, it is necessary to
@@ -42,12 +61,16 @@ class CziReader:
     '0' is the numbers of channels per pixel (always =zero for our data)
     """
 
-    def __init__(self, file_path):
+    def __init__(self, file_path, cache_dir=None):
         """
-        :param file_path(str): The path for the file that is to be opened.
+        :param file_path(str): The path for the file that is to be opened, or a seekable binary file-like object,
+                               e.g. a rangeFile.RangeFile reading byte ranges from object storage through a block cache.
+        :param cache_dir(str): Optional directory of sidecar index files. When the file was opened with the same
+                               cache_dir before and has not changed since, its directory, shape, dimensions and
+                               pixel sizes are read from the small sidecar file instead of being parsed again.
         """
         self.filePath = file_path
-        self.czi = czifile.CziFile(self.filePath)
+        self.czi = czifile.CziFile(self.filePath, cache=cache_dir)
         self.hasTimeDimension = b'T' in self.czi.axes
 
     def __enter__(self):
@@ -59,13 +82,87 @@ class CziReader:
     def close(self):
         self.czi.close()
 
-    def load(self):
+    def load(self, max_workers=None, memmap=False, tempdir=None, mmap_mode=None, level=0, scene=None,
+             out=None, dims="TZCYX"):
         """Retrieves an array for all z-slices and channels.
 
+        The subblocks are decoded directly into a C-contiguous array with the requested dimension order.
+
+        :param max_workers: The number of threads used to decode subblocks, None decodes them sequentially
+        :param memmap: If True, the image is stored in a temporary file on disk instead of memory,
+                       which is removed once the returned array is garbage collected.
+                       If a file path, the image is stored in (and kept at) that path.
+        :param tempdir: The directory for the temporary file when memmap is True
+        :param mmap_mode: If 'r' or 'c', uncompressed subblocks are copied straight from the memory-mapped file
+        :param level: The pyramid level, 0 is full resolution. Higher levels read the stored downsampled
+                      subblocks, see pyramid_levels()
+        :param scene: The index of the scene to read, see scenes(). Only the subblocks of the scene are decoded
+                      into an array covering the scene's bounding box.
+        :param out: An array to decode the image into, with the shape of the image in the order of dims,
+                    e.g. to reuse a buffer across files. Can not be used with memmap.
+        :param dims: The order of the dimensions of the returned array, a permutation of "TZCYX"
+        :return: 5D array with dimensions in the order of dims (TZCYX by default)
+        """
+        if sorted(dims) != sorted("TZCYX"):
+            raise ValueError("{} is not a permutation of TZCYX".format(dims))
+        czi = self.czi.pyramid_level(level)
+        axes = [czi.axes[i:i + 1].decode('ascii') for i in range(len(czi.axes))]
+        sizes = dict((ax, size) for ax, size in zip(axes, czi.shape))
+        if scene is not None:
+            (y0, y1), (x0, x1) = self._scene_region(czi, scene)
+            sizes["Y"], sizes["X"] = y1 - y0, x1 - x0
+        shape = tuple(sizes.get(d, 1) for d in dims)
+
+        if out is None:
+            if memmap:
+                out = czifile.create_memmap(shape, czi.dtype, None if memmap is True else memmap, tempdir)
+            else:
+                out = np.zeros(shape, czi.dtype)
+        elif memmap:
+            raise ValueError("out and memmap can not be used together")
+        elif out.shape != shape:
+            raise ValueError("out has shape {}, expected {} for dims {}".format(out.shape, shape, dims))
+
+        # a view of out with the axes of the CZI file, which has length 1 along the other axes of the file
+        view = out[tuple(slice(None) if d in axes else 0 for d in dims)]
+        present = [d for d in dims if d in axes]
+        view = view.transpose([present.index(ax) for ax in axes if ax in present])
+        view = view[tuple(slice(None) if ax in present else np.newaxis for ax in axes)]
+
+        if scene is not None:
+            czi.read_region(((y0, y1), (x0, x1)), S=scene if "S" in axes else None, max_workers=max_workers,
+                            mmap_mode=mmap_mode, out=view)
+        else:
+            czi.asarray(max_workers=max_workers, mmap_mode=mmap_mode, out=view)
+        if memmap:
+            out.flush()
+        return out
+
+    def load_roi(self, y, x, z=None, c=None, t=None, max_workers=None, mmap_mode=None, scene=0):
+        """Retrieves the image data within a region of interest
+
+        Only the subblocks (mosaic tiles) of the scene intersecting the region are decoded.
+        The region is clipped to the scene's bounding box, so the returned array has
+        min(end, size) - max(begin, 0) rows and columns, or none if the region is outside the scene.
+
+        :param y: The (begin, end) range of rows, relative to the scene's bounding box
+        :param x: The (begin, end) range of columns, relative to the scene's bounding box
+        :param z: The z index or (begin, end) range of z slices, None for all
+        :param c: The channel or (begin, end) range of channels, None for all
+        :param t: The time index or (begin, end) range of time points, None for all
+        :param max_workers: The number of threads used to decode subblocks, None decodes them sequentially
+        :param mmap_mode: If 'r' or 'c', uncompressed subblocks are read from the memory-mapped file
+        :param scene: The index of the scene to read, see scenes()
         :return: 5D array with dimensions TZCYX.
         """
-        image = self.czi.asarray()
+        (y0, y1), (x0, x1) = self._scene_region(self.czi, scene)
+        y = (y0 + max(0, y[0]), y0 + min(y1 - y0, y[1]))
+        x = (x0 + max(0, x[0]), x0 + min(x1 - x0, x[1]))
+        image = self.czi.read_region((y, x), S=scene if b'S' in self.czi.axes else None, T=t, C=c, Z=z,
+                                     max_workers=max_workers, mmap_mode=mmap_mode)
+        return self._transpose_to_tzcyx(image)
 
+    def _transpose_to_tzcyx(self, image):
         # TODO: Proper error checking if indices are incorrect
         axes = self.czi.axes
         assert(len(image.shape) == len(axes))
@@ -103,46 +200,159 @@ class CziReader:
 
         return transposed_image
 
-    def load_slice(self, z=0, c=0, t=0):
+    def load_slice(self, z=0, c=0, t=0, mmap_mode=None, level=0):
         """Retrieves the 2D YX slice from the image
 
         :param z: The z index that will be accessed
         :param c: The channel that will be accessed
         :param t: The time index that will be accessed
+        :param mmap_mode: If 'r' (read-only) or 'c' (copy-on-write) and the slice is a single uncompressed
+                          subblock, the slice is returned as a view of the memory-mapped file without copying
+        :param level: The pyramid level, 0 is full resolution, see load()
         :return: 2D array with dimensions YX
         """
-        if self.hasTimeDimension:
-            for directory_entry in self.czi.filtered_subblock_directory:
-                if directory_entry.start[3] == z and directory_entry.start[2] == c and directory_entry.start[1] == t:
-                    # tile is a slice with all seven dimensions (BTCZYX0) still intact
-                    tile = directory_entry.data_segment().data()
-                    image_slice = tile[0, 0, 0, 0, :, :, 0]
-                    return image_slice
-        else:
-            for directory_entry in self.czi.filtered_subblock_directory:
-                if directory_entry.start[2] == z and directory_entry.start[1] == c:
-                    # tile is a slice with all six dimensions (BCZYX0) still intact
-                    tile = directory_entry.data_segment().data()
-                    image_slice = tile[0, 0, 0, :, :, 0]
-                    return image_slice
+        czi = self.czi.pyramid_level(level)
+        if not czi.find_subblocks(T=t, C=c, Z=z):
+            return None
+        # only the subblocks (mosaic tiles) of this plane are decoded
+        return czi.read_plane(T=t, C=c, Z=z, mmap_mode=mmap_mode)[:, :, 0]
+
+    def lazy(self, mmap_mode=None, scene=None):
+        """Returns a lazy, ndarray-like view of the image with dimensions TZCYX.
+
+        Indexing the view only decodes the subblocks intersecting the request.
+
+        :param mmap_mode: If 'r' (read-only) or 'c' (copy-on-write), uncompressed subblocks are read from
+                          the memory-mapped file, and single planes are returned as views of it
+        :param scene: The index of the scene to view, see scenes(). The view covers the scene's bounding box.
+        :return: CziLazyArray
+        """
+        return CziLazyArray(self.czi, mmap_mode=mmap_mode, scene=scene)
+
+    def scenes(self):
+        """Returns the sorted indices of the scenes in the file, [0] if the file has no scene dimension"""
+        return sorted(self.czi.scene_regions)
+
+    def size_s(self):
+        return len(self.czi.scene_regions)
+
+    def map_scenes(self, func, scenes=None, max_workers=None, mmap_mode=None):
+        """Calls a function on the lazy view of each scene, using parallel threads
+
+        Example:
+            def save(scene, image):
+                with omeTifWriter.OmeTifWriter("scene{}.ome.tif".format(scene)) as writer:
+                    writer.save(np.asarray(image))
+            reader.map_scenes(save, max_workers=8)
+
+        :param func: The function called as func(scene, image), where image is the CziLazyArray of the scene
+        :param scenes: The indices of the scenes, None for all scenes in the file
+        :param max_workers: The number of threads, None calls func on the scenes sequentially
+        :param mmap_mode: None, 'r' or 'c', see lazy()
+        :return: list of the results of func in the order of the scenes
+        """
+        if scenes is None:
+            scenes = self.scenes()
+        # the views are created up front, so the subblock index is built once and shared by the threads
+        views = [(scene, self.lazy(mmap_mode=mmap_mode, scene=scene)) for scene in scenes]
+        if max_workers is None or max_workers < 2:
+            return [func(scene, view) for scene, view in views]
+        pool = ThreadPool(max_workers)
+        try:
+            return pool.map(lambda args: func(*args), views)
+        finally:
+            pool.terminate()
+
+    @staticmethod
+    def _scene_region(czi, scene):
+        try:
+            return czi.scene_regions[scene]
+        except KeyError:
+            raise ValueError("scene {} not in file with scenes {}".format(scene, sorted(czi.scene_regions)))
+
+    def find_subblocks(self, z=0, c=0, t=0, s=0, m=None):
+        """Looks up the subblocks holding a plane in the subblock index
+
+        :param z: The z index that will be accessed
+        :param c: The channel that will be accessed
+        :param t: The time index that will be accessed
+        :param s: The scene index that will be accessed
+        :param m: The mosaic tile index, or None for all tiles of the plane
+        :return: list of czifile.DirectoryEntryDV, empty if the plane does not exist
+        """
+        return self.czi.find_subblocks(S=s, T=t, C=c, Z=z, M=m)
+
+    def pyramid_levels(self):
+        """Returns the downsampling factors of the pyramid levels in the file, starting with 1 for full resolution"""
+        return list(self.czi.pyramid_levels)
 
     def get_metadata(self):
         return self.czi.metadata
 
+    def get_physical_pixel_size(self):
+        """Returns the physical size of a pixel along X, Y and Z in meters, None where it is not specified"""
+        return list(self.czi.pixel_sizes)
+
+    def _size(self, axis):
+        # files with scenes or mosaics have more axes than BTCZYX0, so the axes are looked up by name
+        position = self.czi.axes.find(axis)
+        return 1 if position == -1 else self.czi.shape[position]
+
     def size_z(self):
-        return self.czi.shape[3] if self.hasTimeDimension else self.czi.shape[2]
+        return self._size(b'Z')
 
     def size_c(self):
-        return self.czi.shape[2] if self.hasTimeDimension else self.czi.shape[1]
+        return self._size(b'C')
 
     def size_t(self):
-        return self.czi.shape[1] if self.hasTimeDimension else 1
+        return self._size(b'T')
 
     def size_x(self):
-        return self.czi.shape[5] if self.hasTimeDimension else self.czi.shape[4]
+        return self._size(b'X')
 
     def size_y(self):
-        return self.czi.shape[4] if self.hasTimeDimension else self.czi.shape[3]
+        return self._size(b'Y')
 
     def dtype(self):
         return self.czi.dtype
+
+
+class CziLazyArray(LazyArray):
+    """A LazyArray over the TZCYX image in a CZI file, see CziReader.lazy()
+
+    Chunks along Y and X follow the subblock (mosaic tile) boundaries.
+    A view of a single scene covers the bounding box of the scene's subblocks.
+    """
+
+    def __init__(self, czi, mmap_mode=None, scene=None):
+        """
+        :param czi: The open czifile.CziFile to read from
+        :param mmap_mode: None, 'r' or 'c', see CziReader.lazy()
+        :param scene: The index of the scene, or None for the first scene on the canvas of all scenes
+        """
+        self.czi = czi
+        self.mmap_mode = mmap_mode
+        self.scene = scene
+        axes = czi.axes
+        shape = [czi.shape[axes.find(ax)] if ax in axes else 1 for ax in (b'T', b'Z', b'C', b'Y', b'X')]
+        starts = czi.filtered_extents[0] - np.array(czi.start[:-1])
+        if scene is None:
+            self.origin = (0, 0)
+        else:
+            (y0, y1), (x0, x1) = CziReader._scene_region(czi, scene)
+            self.origin = (y0, x0)
+            shape[3:] = [y1 - y0, x1 - x0]
+            if b'S' in axes:
+                starts = starts[starts[:, axes.find(b'S')] == scene]
+        chunks = tuple((1,) * size for size in shape[:3])
+        for ax, size, origin in zip((b'Y', b'X'), shape[3:], self.origin):
+            starts_ax = np.unique(starts[:, axes.find(ax)] - origin)
+            starts_ax = [0] + [int(i) for i in starts_ax if 0 < i < size] + [size]
+            chunks += (tuple(j - i for i, j in zip(starts_ax[:-1], starts_ax[1:])),)
+        super(CziLazyArray, self).__init__(shape, czi.dtype, chunks)
+
+    def _read_plane(self, t, z, c, y, x):
+        oy, ox = self.origin
+        region = ((y[0] + oy, y[1] + oy), (x[0] + ox, x[1] + ox))
+        return self.czi.read_plane(S=self.scene or 0, T=t, C=c, Z=z, region=region,
+                                   mmap_mode=self.mmap_mode)[:, :, 0]
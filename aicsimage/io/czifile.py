@@ -52,6 +52,9 @@ Requirements
 * `Tifffile.py 2015.08.17 <http://www.lfd.uci.edu/~gohlke/>`_
 * `Czifle.pyx 2015.08.17  <http://www.lfd.uci.edu/~gohlke/>`_
   (for decoding JpegXrFile and JpgFile images)
+* `Imagecodecs <https://pypi.org/project/imagecodecs/>`_
+  (alternative for decoding JpegXrFile and JpgFile images in memory,
+  and for faster decoding of LZW compressed images)
 
 Revisions
 ---------
@@ -102,11 +105,19 @@ from __future__ import division, print_function
 
 import sys
 import os
+import collections
 import re
 import uuid
 import struct
 import warnings
 import tempfile
+import itertools
+import threading
+import weakref
+import atexit
+import mmap
+import hashlib
+from multiprocessing.pool import ThreadPool
 
 try:
     from lxml import etree
@@ -134,6 +145,16 @@ except ImportError:
     #     "Decoding of JXR and JPEG encoded images will not be available.\n"
     #     "Czifile.pyx can be obtained at http://www.lfd.uci.edu/~gohlke/")
 
+try:
+    import imagecodecs
+    _jpegxr_decode = getattr(imagecodecs, 'jpegxr_decode',
+                             getattr(imagecodecs, 'jxr_decode', None))
+    _jpeg_decode = getattr(imagecodecs, 'jpeg8_decode',
+                           getattr(imagecodecs, 'jpeg_decode', None))
+    _lzw_decode = getattr(imagecodecs, 'lzw_decode', None)
+except ImportError:
+    _jpegxr_decode = _jpeg_decode = _lzw_decode = None
+
 __version__ = '2015.08.17'
 __docformat__ = 'restructuredtext en'
 __all__ = 'imread', 'CziFile'
@@ -172,13 +193,17 @@ class CziFile(object):
 
     """
 
-    def __init__(self, arg, multifile=True, filesize=None, detectmosaic=True):
+    def __init__(self, arg, multifile=True, filesize=None, detectmosaic=True,
+                 cache=None):
         """Open CZI file and read header.
 
         Raise ValueError if file is not a ZISRAW file.
 
         Parameters
         ----------
+        arg : str or binary stream
+            File name or seekable binary file-like object, e.g. an open
+            file or a RangeFile reading byte ranges from remote storage.
         multifile : bool
             If True (default), the master file of a multifile CZI file
             will be opened if applicable.
@@ -188,6 +213,12 @@ class CziFile(object):
         detectmosaic : bool
             If True (default), mosaic images will be reconstructed from
             SubBlocks with a tile index.
+        cache : str
+            Directory of sidecar index files. If specified, the subblock
+            directory, shape, start, axes, dtype and pixel sizes are read
+            from the file's sidecar index if it is up to date (same path,
+            size and modification time), else computed and stored there.
+            Only used if arg is a file name.
 
         Notes
         -----
@@ -217,6 +248,19 @@ class CziFile(object):
         if self.header.update_pending:
             warnings.warn("file is pending update")
         self._filter_mosaic = detectmosaic
+        # content of attachments by content file type
+        self._attachment_data = {}
+        # views of the file at pyramid levels by downsampling factor
+        self._pyramid_views = {1: self}
+        # serializes reads of PositionalReader on streams without fileno
+        self._lock = threading.Lock()
+        # segments are read through a reader without shared file position,
+        # so instances can be used from several threads concurrently
+        self._reader = PositionalReader(self._fh, self._lock)
+
+        if cache is not None and isinstance(arg, basestring):
+            if not self._read_index_cache(cache):
+                self._write_index_cache(cache)
 
     def segments(self, kind=None):
         """Return iterator over Segment data of specified kind.
@@ -230,9 +274,9 @@ class CziFile(object):
         """
         fpos = 0
         while True:
-            self._fh.seek(fpos)
+            self._reader.seek(fpos)
             try:
-                segment = Segment(self._fh)
+                segment = Segment(self._reader)
             except SegmentNotFoundError:
                 break
             if (kind is None) or (segment.sid in kind):
@@ -247,7 +291,7 @@ class CziFile(object):
 
         """
         if self.header.metadata_position:
-            segment = Segment(self._fh, self.header.metadata_position)
+            segment = Segment(self._reader, self.header.metadata_position)
             if segment.sid == MetadataSegment.SID:
                 data = segment.data().data()
                 return etree.fromstring(data.encode('utf-8'))
@@ -259,19 +303,30 @@ class CziFile(object):
             pass
 
     @lazyattr
-    def subblock_directory(self):
-        """Return list of all DirectoryEntryDV in file.
+    def directory_array(self):
+        """Return all DirectoryEntryDV in file as numpy structured array.
 
+        See directory_entry_dtype() for the fields of the records.
         Use SubBlockDirectorySegment if exists, else find SubBlockSegments.
 
         """
         if self.header.directory_position:
-            segment = Segment(self._fh, self.header.directory_position)
+            segment = Segment(self._reader, self.header.directory_position)
             if segment.sid == SubBlockDirectorySegment.SID:
-                return segment.data().entries
+                self._reader.seek(segment.data_offset)
+                return SubBlockDirectorySegment.records(self._reader)
         warnings.warn("SubBlockDirectory segment not found")
-        return list(segment.directory_entry for segment in
-                    self.segments(SubBlockSegment.SID))
+        return directory_array([segment.directory_entry for segment in
+                                self.segments(SubBlockSegment.SID)])
+
+    @lazyattr
+    def subblock_directory(self):
+        """Return sequence of all DirectoryEntryDV in file.
+
+        The entries are created from directory_array on access.
+
+        """
+        return DirectoryEntryList(self.directory_array, self._reader)
 
     @lazyattr
     def attachment_directory(self):
@@ -281,7 +336,7 @@ class CziFile(object):
 
         """
         if self.header.attachment_directory_position:
-            segment = Segment(self._fh,
+            segment = Segment(self._reader,
                               self.header.attachment_directory_position)
             if segment.sid == AttachmentDirectorySegment.SID:
                 return segment.data().entries
@@ -289,6 +344,52 @@ class CziFile(object):
         return list(segment.attachment_entry for segment in
                     self.segments(AttachmentSegment.SID))
 
+    @lazyattr
+    def attachment_index(self):
+        """Return dict mapping content file types to AttachmentEntryA1.
+
+        The values are lists of entries in the order of the directory.
+
+        """
+        index = {}
+        for entry in self.attachment_directory:
+            index.setdefault(entry.content_file_type, []).append(entry)
+        return index
+
+    def attachment_data(self, content_file_type):
+        """Return content of first attachment of specified type or None.
+
+        The content is read according to CONTENT_FILE_TYPE and cached.
+
+        """
+        if content_file_type not in self._attachment_data:
+            entries = self.attachment_index.get(content_file_type)
+            data = entries[0].data_segment().data() if entries else None
+            self._attachment_data[content_file_type] = data
+        return self._attachment_data[content_file_type]
+
+    @property
+    def time_stamps(self):
+        """Return TimeStamps attachment as numpy array or None."""
+        data = self.attachment_data(b'CZTIMS')
+        return None if data is None else data.time_stamps
+
+    @property
+    def focus_positions(self):
+        """Return FocusPositions attachment as numpy array or None."""
+        data = self.attachment_data(b'CZFOC')
+        return None if data is None else data.positions
+
+    @property
+    def event_list(self):
+        """Return EventList attachment or None."""
+        return self.attachment_data(b'CZEVL')
+
+    @property
+    def lookup_tables(self):
+        """Return LookupTables attachment or None."""
+        return self.attachment_data(b'CZLUT')
+
     def subblocks(self):
         """Return iterator over all SubBlock segments in file."""
         for entry in self.subblock_directory:
@@ -308,59 +409,549 @@ class CziFile(object):
         for attachment in self.attachments():
             attachment.save(directory=directory)
 
+    @lazyattr
+    def filtered_directory_array(self):
+        """Return directory_array of mosaic tiles sorted by index, else all.
+
+        Only subblocks of the pyramid level of the instance are included,
+        i.e. the full resolution subblocks by default.
+
+        """
+        records = self.directory_array
+        if len(records):
+            records = records[self._pyramid_factors == self._pyramid_factor]
+        if not self._filter_mosaic or not len(records):
+            return records
+        mosaic = records['dimension'] == b'M'
+        tiled = mosaic.any(axis=1)
+        if not tiled.any():
+            return records
+        records = records[tiled]
+        mosaic_index = numpy.where(mosaic[tiled], records['start'], 0).sum(1)
+        return records[numpy.argsort(mosaic_index, kind='mergesort')]
+
     @lazyattr
     def filtered_subblock_directory(self):
-        """Return sorted list of DirectoryEntryDV if mosaic, else all."""
-        if not self._filter_mosaic:
-            return self.subblock_directory
-        filtered = [directory_entry
-                    for directory_entry in self.subblock_directory
-                    if directory_entry.mosaic_index is not None]
-        if not filtered:
-            return self.subblock_directory
-        return list(sorted(filtered, key=lambda x: x.mosaic_index))
+        """Return sorted sequence of DirectoryEntryDV if mosaic, else all."""
+        return DirectoryEntryList(self.filtered_directory_array, self._reader)
+
+    @lazyattr
+    def filtered_extents(self):
+        """Return start indices and sizes of filtered subblocks.
+
+        Two integer arrays of shape (subblocks, len(axes) - 1), i.e.
+        excluding the mosaic and sample dimensions.
+
+        """
+        records = self.filtered_directory_array
+        dimension = records['dimension'][0]
+        columns = [i for i, dim in enumerate(dimension)
+                   if dim and dim != b'M']
+        start = records['start'][:, columns].astype('i8')
+        size = records['size'][:, columns].astype('i8')
+        if self._pyramid_factor > 1:
+            # pyramid subblocks are placed at reduced resolution
+            for i, column in enumerate(columns):
+                if dimension[column] in (b'Y', b'X'):
+                    start[:, i] //= self._pyramid_factor
+                    size[:, i] = records['stored_size'][:, column]
+        return start, size
+
+    @lazyattr
+    def _filtered_mosaic_index(self):
+        """Return list of mosaic indices of filtered subblocks or None."""
+        records = self.filtered_directory_array
+        mosaic = records['dimension'] == b'M'
+        index = numpy.where(mosaic, records['start'], 0).sum(1)
+        return [int(i) if tiled else None
+                for i, tiled in zip(index, mosaic.any(axis=1))]
 
     @lazyattr
     def shape(self):
         """Return shape of image data in file."""
-        shape = [[dim.start + dim.size
-                  for dim in directory_entry.dimension_entries
-                  if dim.dimension != b'M']
-                 for directory_entry in self.filtered_subblock_directory]
-        shape = numpy.max(shape, axis=0)
+        start, size = self.filtered_extents
+        shape = (start + size).max(axis=0)
         shape = tuple(int(i-j) for i, j in zip(shape, self.start[:-1]))
-        dtype = self.filtered_subblock_directory[0].dtype
-        sampleshape = numpy.dtype(dtype).shape
+        pixel_type = self.filtered_directory_array['pixel_type'][0]
+        sampleshape = numpy.dtype(PIXEL_TYPE[int(pixel_type)]).shape
         shape = shape + (sampleshape if sampleshape else (1,))
         return shape
 
     @lazyattr
     def start(self):
         """Return minimum start indices per dimension of sub images in file."""
-        start = [[dim.start
-                  for dim in directory_entry.dimension_entries
-                  if dim.dimension != b'M']
-                 for directory_entry in self.filtered_subblock_directory]
-        start = tuple(numpy.min(start, axis=0)) + (0,)
-        return start
+        start = self.filtered_extents[0].min(axis=0)
+        return tuple(int(i) for i in start) + (0,)
 
     @lazyattr
     def axes(self):
         """Return axes of image data in file."""
-        return self.filtered_subblock_directory[0].axes
+        dimension = self.filtered_directory_array['dimension'][0]
+        return b''.join(bytes(dim) for dim in dimension
+                        if dim and dim != b'M') + b'0'
 
     @lazyattr
     def dtype(self):
         """Return dtype of image data in file."""
         # subblock data can be of different pixel type
-        dtype = self.filtered_subblock_directory[0].dtype[-2:]
-        for directory_entry in self.filtered_subblock_directory:
-            dtype = numpy.promote_types(dtype, directory_entry.dtype[-2:])
+        pixel_types = numpy.unique(self.filtered_directory_array['pixel_type'])
+        dtype = PIXEL_TYPE[int(pixel_types[0])][-2:]
+        for pixel_type in pixel_types:
+            dtype = numpy.promote_types(dtype, PIXEL_TYPE[int(pixel_type)][-2:])
         return dtype
 
-    def asarray(self, bgr2rgb=False, resize=True, order=1, memmap=False):
+    # downsampling factor of the pyramid level of the instance
+    _pyramid_factor = 1
+
+    @lazyattr
+    def _pyramid_factors(self):
+        """Return downsampling factors of subblocks in directory_array.
+
+        The factor is 1 for subblocks that are not part of a pyramid.
+
+        """
+        records = self.directory_array
+        xpos = (records['dimension'] == b'X').argmax(axis=1)
+        rows = numpy.arange(len(records))
+        size = records['size'][rows, xpos]
+        stored_size = numpy.maximum(records['stored_size'][rows, xpos], 1)
+        factors = numpy.round(size / stored_size).astype('i8')
+        return numpy.where(records['pyramid_type'] != 0, factors, 1)
+
+    @lazyattr
+    def pyramid_levels(self):
+        """Return downsampling factors of pyramid levels in file.
+
+        The first level is the full resolution image.
+
+        """
+        factors = numpy.unique(self._pyramid_factors).tolist()
+        return [1] + [int(i) for i in factors if i > 1]
+
+    def pyramid_level(self, level):
+        """Return CziFile view of image data at pyramid level.
+
+        Level 0 is the full resolution image. Other levels contain the
+        stored pyramid subblocks without upsampling, so their shapes are
+        reduced by the factors in 'pyramid_levels'.
+        The view shares the file handle with this instance.
+
+        """
+        try:
+            factor = self.pyramid_levels[level]
+        except IndexError:
+            raise ValueError("pyramid level %i not in file with %i levels"
+                             % (level, len(self.pyramid_levels)))
+        if factor not in self._pyramid_views:
+            base = self._pyramid_views[1]
+            view = object.__new__(CziFile)
+            view.__dict__.update(
+                (key, value) for key, value in base.__dict__.items()
+                if key not in _PYRAMID_LEVEL_ATTRS)
+            view._pyramid_views = base._pyramid_views
+            view._pyramid_factor = factor
+            # pixels are larger along X and Y
+            view.pixel_sizes = tuple(
+                None if size is None else size * factor if i < 2 else size
+                for i, size in enumerate(base.pixel_sizes))
+            self._pyramid_views[factor] = view
+        return self._pyramid_views[factor]
+
+    @lazyattr
+    def pixel_sizes(self):
+        """Return physical size of pixels along X, Y, Z in meters.
+
+        Sizes not specified in the metadata are None.
+
+        """
+        sizes = []
+        for ax in ('X', 'Y', 'Z'):
+            value = None
+            if self.metadata is not None:
+                element = self.metadata.find(
+                    ".//Scaling/Items/Distance[@Id='%s']/Value" % ax)
+                if element is not None and element.text:
+                    value = float(element.text)
+            sizes.append(value)
+        return tuple(sizes)
+
+    def _index_cache_name(self, cache):
+        """Return path of sidecar index file of this file in directory."""
+        name = hashlib.sha1(self._fh.path.encode('utf-8')).hexdigest()
+        return os.path.join(cache, name + '.npz')
+
+    def _read_index_cache(self, cache):
+        """Read directory and derived attributes from sidecar index file.
+
+        Return False if no up to date sidecar index exists.
+
+        """
+        filename = self._index_cache_name(cache)
+        try:
+            stat = os.stat(self._fh.path)
+            with numpy.load(filename) as npz:
+                if (int(npz['version']) != INDEX_CACHE_VERSION or
+                        npz['path'].item() != self._fh.path or
+                        int(npz['size']) != stat.st_size or
+                        float(npz['mtime']) != stat.st_mtime or
+                        bool(npz['detectmosaic']) != self._filter_mosaic):
+                    return False
+                self.directory_array = npz['directory']
+                self.shape = tuple(int(i) for i in npz['shape'])
+                self.start = tuple(int(i) for i in npz['start'])
+                self.axes = npz['axes'].item()
+                self.dtype = numpy.dtype(npz['dtype'].item())
+                self.pixel_sizes = tuple(None if numpy.isnan(i) else float(i)
+                                         for i in npz['pixel_sizes'])
+        except (IOError, OSError, KeyError, ValueError):
+            return False
+        return True
+
+    def _write_index_cache(self, cache):
+        """Write directory and derived attributes to sidecar index file."""
+        filename = self._index_cache_name(cache)
+        try:
+            stat = os.stat(self._fh.path)
+            arrays = dict(
+                version=INDEX_CACHE_VERSION,
+                path=numpy.array(self._fh.path),
+                size=stat.st_size,
+                mtime=stat.st_mtime,
+                detectmosaic=self._filter_mosaic,
+                directory=self.directory_array,
+                shape=numpy.array(self.shape, 'i8'),
+                start=numpy.array(self.start, 'i8'),
+                axes=numpy.array(self.axes),
+                dtype=numpy.array(numpy.dtype(self.dtype).str),
+                pixel_sizes=numpy.array([numpy.nan if i is None else i
+                                         for i in self.pixel_sizes], 'f8'))
+            if not os.path.exists(cache):
+                os.makedirs(cache)
+            # write to temporary file first, so readers never see partial files
+            fd, tempname = tempfile.mkstemp(suffix='.npz', dir=cache)
+            with os.fdopen(fd, 'wb') as fh:
+                numpy.savez(fh, **arrays)
+            # atomic on POSIX, and replaces an existing file on Windows
+            os.replace(tempname, filename)
+        except (IOError, OSError, IndexError) as e:
+            warnings.warn("failed to write sidecar index: %s" % e)
+
+    @lazyattr
+    def subblock_index(self):
+        """Return dict mapping plane indices to lists of DirectoryEntryDV.
+
+        Keys are (scene, time, channel, slice, mosaic) tuples. Indices are
+        relative to 'start' and 0 for dimensions missing from the file.
+        The mosaic index is None for subblocks without a tile index.
+        Subblocks extending over several planes are listed for each plane.
+
+        """
+        entries = self.filtered_subblock_directory
+        return dict((key, [entries[row] for row in rows])
+                    for key, rows in self._subblock_rows.items())
+
+    @lazyattr
+    def _subblock_rows(self):
+        """Return subblock_index with rows of filtered_directory_array."""
+        start, size = self.filtered_extents
+        count = len(start)
+        starts, sizes = [], []
+        for ax in (b'S', b'T', b'C', b'Z'):
+            pos = self.axes.find(ax)
+            if pos < 0:
+                starts.append([0] * count)
+                sizes.append([1] * count)
+            else:
+                starts.append((start[:, pos] - self.start[pos]).tolist())
+                sizes.append(size[:, pos].tolist())
+        index = {}
+        rows = zip(zip(*starts), zip(*sizes), self._filtered_mosaic_index)
+        for row, (key, shape, mosaic_index) in enumerate(rows):
+            if shape == (1, 1, 1, 1):
+                index.setdefault(key + (mosaic_index,), []).append(row)
+                continue
+            ranges = [range(i, i + j) for i, j in zip(key, shape)]
+            for key in itertools.product(*ranges):
+                index.setdefault(key + (mosaic_index,), []).append(row)
+        return index
+
+    @lazyattr
+    def _plane_rows(self):
+        """Return dict mapping (S, T, C, Z) to rows of all tiles."""
+        index = {}
+        for key in sorted(self._subblock_rows,
+                          key=lambda k: k[:4] + (k[4] or 0,)):
+            index.setdefault(key[:4], []).extend(self._subblock_rows[key])
+        return index
+
+    def find_subblocks(self, S=0, T=0, C=0, Z=0, M=None):
+        """Return list of DirectoryEntryDV containing the specified plane.
+
+        Parameters
+        ----------
+        S, T, C, Z : int
+            Scene, time, channel, and slice indices relative to 'start'.
+        M : int
+            Mosaic tile index. If None (default), the entries of all tiles
+            of the plane are returned, sorted by mosaic index.
+
+        An empty list is returned if no subblock matches.
+
+        """
+        if M is None:
+            rows = self._plane_rows.get((S, T, C, Z), ())
+        else:
+            rows = self._subblock_rows.get((S, T, C, Z, M), ())
+        entries = self.filtered_subblock_directory
+        return [entries[row] for row in rows]
+
+    def read_plane(self, S=0, T=0, C=0, Z=0, region=None, bgr2rgb=False,
+                   resize=True, order=1, mmap_mode=None):
+        """Return image data of a single plane as YX0 numpy array.
+
+        Only the subblocks intersecting the region are read and decoded,
+        in the order of their position in the file.
+        Parts of the region not covered by any subblock are zero.
+
+        Parameters
+        ----------
+        S, T, C, Z : int
+            Scene, time, channel, and slice indices relative to 'start'.
+        region : ((int, int), (int, int))
+            Half-open (begin, end) ranges along Y and X relative to 'start'.
+            If None (default), the whole plane is returned.
+        bgr2rgb, resize, order, mmap_mode :
+            Passed to SubBlockSegment.data(). If 'mmap_mode' is specified
+            and the region lies within a single uncompressed subblock,
+            a view of the memory-mapped file is returned without copying.
+
+        """
+        axes = self.axes
+        ypos, xpos = axes.find(b'Y'), axes.find(b'X')
+        if region is None:
+            region = ((0, self.shape[ypos]), (0, self.shape[xpos]))
+        (y0, y1), (x0, x1) = region
+        key = dict(zip((b'S', b'T', b'C', b'Z'), (S, T, C, Z)))
+        tiles = self._region_tiles((S, T, C, Z), region)
+        data = dict(self._read_subblocks(
+            [row for row, ty, tx in tiles], bgr2rgb=bgr2rgb, resize=resize,
+            order=order, mmap_mode=mmap_mode))
+        out = None
+        for row, ty, tx in tiles:
+            directory_entry = self.filtered_subblock_directory[row]
+            tile = data.pop(row)[self._tile_plane_index(directory_entry, key)]
+            # intersect tile with region
+            ry0, ry1 = max(ty, y0), min(ty + tile.shape[0], y1)
+            rx0, rx1 = max(tx, x0), min(tx + tile.shape[1], x1)
+            if (len(tiles) == 1 and (ry0, ry1, rx0, rx1) == (y0, y1, x0, x1)
+                    and tile.dtype == self.dtype):
+                # region within single subblock: return data without copy
+                return tile[ry0-ty:ry1-ty, rx0-tx:rx1-tx]
+            if out is None:
+                out = numpy.zeros((y1 - y0, x1 - x0, self.shape[-1]),
+                                  self.dtype)
+            if ry0 >= ry1 or rx0 >= rx1:
+                continue
+            out[ry0-y0:ry1-y0, rx0-x0:rx1-x0] = tile[ry0-ty:ry1-ty,
+                                                     rx0-tx:rx1-tx]
+        if out is None:
+            out = numpy.zeros((y1 - y0, x1 - x0, self.shape[-1]), self.dtype)
+        return out
+
+    def read_region(self, region, S=None, T=None, C=None, Z=None,
+                    bgr2rgb=False, resize=True, order=1, max_workers=None,
+                    mmap_mode=None, memmap=False, tempdir=None, out=None):
+        """Return image data within region of interest as numpy array.
+
+        Only the subblocks intersecting the region are read and decoded.
+        Parts of the region not covered by any subblock are zero.
+
+        Parameters
+        ----------
+        region : ((int, int), (int, int))
+            Half-open (begin, end) ranges along Y and X relative to 'start'.
+        S, T, C, Z : int or (int, int)
+            Index or half-open (begin, end) range of indices relative to
+            'start' along the scene, time, channel, and slice dimensions.
+            If None (default), the whole dimension is read.
+        bgr2rgb, resize, order, mmap_mode :
+            Passed to SubBlockSegment.data().
+        max_workers : int
+            Number of threads used to read and decode subblocks.
+        memmap, tempdir :
+            Store the returned array in a file on disk, see asarray().
+        out : numpy.ndarray
+            Array of the returned shape to write the image data to.
+
+        Returns
+        -------
+        numpy.ndarray
+            Array with the same axes as the file. The S, T, C, Z, Y, and X
+            dimensions are cropped to the requested ranges. Other dimensions
+            except samples are reduced to their first index.
+
+        """
+        axes = self.axes
+        ranges = {}
+        for ax, value in zip((b'S', b'T', b'C', b'Z'), (S, T, C, Z)):
+            pos = axes.find(ax)
+            if value is None:
+                value = (0, self.shape[pos] if pos >= 0 else 1)
+            elif numpy.ndim(value) == 0:
+                value = (value, value + 1)
+            ranges[ax] = tuple(value)
+        ranges[b'Y'], ranges[b'X'] = (tuple(i) for i in region)
+        shape = []
+        for i in range(len(axes) - 1):
+            begin, end = ranges.get(axes[i:i+1], (0, 1))
+            shape.append(max(end - begin, 0))
+        shape.append(self.shape[-1])
+        if out is not None:
+            if memmap:
+                raise ValueError("can not use out and memmap together")
+            if tuple(out.shape) != tuple(shape):
+                raise ValueError("out has shape %s, expected %s" %
+                                 (out.shape, tuple(shape)))
+            out[...] = 0
+        elif memmap:
+            filename = None if memmap is True else memmap
+            out = create_memmap(shape, self.dtype, filename, tempdir)
+        else:
+            out = numpy.zeros(shape, self.dtype)
+        if not out.size:
+            return out
+
+        planes = list(itertools.product(*[
+            range(*ranges[ax]) for ax in (b'S', b'T', b'C', b'Z')]))
+        # tiles of each subblock, as (plane, rank of tile in plane, y, x)
+        tiles = {}
+        for plane in planes:
+            for rank, (row, ty, tx) in enumerate(
+                    self._region_tiles(plane, region)):
+                tiles.setdefault(row, []).append((plane, rank, ty, tx))
+        rows = sorted(tiles)
+        # overlapping tiles of a plane are composited in mosaic order while
+        # each subblock is written as soon as it is decoded
+        positions = self.filtered_directory_array['file_position']
+        reordered = _reordered_planes(
+            sorted(rows, key=lambda row: positions[row]),
+            dict((row, [(plane, rank) for plane, rank, ty, tx in tiles[row]])
+                 for row in rows))
+        pasted = {}
+
+        (y0, y1), (x0, x1) = region
+        subblocks = self._read_subblocks(
+            rows, max_workers=max_workers, bgr2rgb=bgr2rgb, resize=resize,
+            order=order, mmap_mode=mmap_mode)
+        for row, data in subblocks:
+            directory_entry = self.filtered_subblock_directory[row]
+            for plane, rank, ty, tx in tiles[row]:
+                key = dict(zip((b'S', b'T', b'C', b'Z'), plane))
+                # index of plane in output
+                index = []
+                for i in range(len(axes) - 1):
+                    ax = axes[i:i+1]
+                    if ax in key:
+                        index.append(key[ax] - ranges[ax][0])
+                    elif ax not in (b'Y', b'X'):
+                        index.append(0)
+                tile = data[self._tile_plane_index(directory_entry, key)]
+                ry0, ry1 = max(ty, y0), min(ty + tile.shape[0], y1)
+                rx0, rx1 = max(tx, x0), min(tx + tile.shape[1], x1)
+                if ry0 >= ry1 or rx0 >= rx1:
+                    continue
+                box = slice(ry0-y0, ry1-y0), slice(rx0-x0, rx1-x0)
+                where = True
+                if plane in reordered:
+                    boxes = pasted.setdefault(plane, [])
+                    where = _uncovered(box, [b for r, b in boxes if r > rank],
+                                       3, 0, 1)
+                    boxes.append((rank, box))
+                numpy.copyto(out[tuple(index)][box],
+                             tile[ry0-ty:ry1-ty, rx0-tx:rx1-tx],
+                             casting='unsafe', where=where)
+        if memmap:
+            out.flush()
+        return out
+
+    @lazyattr
+    def scene_regions(self):
+        """Return dict mapping scene indices to regions of scenes.
+
+        Scene indices and the half-open ((y0, y1), (x0, x1)) bounding boxes
+        of the scenes' subblocks are relative to 'start'.
+        Files without scene dimension contain a single scene 0.
+
+        """
+        axes = self.axes
+        ypos, xpos, spos = axes.find(b'Y'), axes.find(b'X'), axes.find(b'S')
+        start, size = self.filtered_extents
+        start = start - numpy.array(self.start[:-1])
+        end = start + size
+        if spos < 0:
+            scene = numpy.zeros(len(start), 'i8')
+        else:
+            scene = start[:, spos]
+        order = numpy.argsort(scene, kind='mergesort')
+        scene = scene[order]
+        index = numpy.flatnonzero(numpy.diff(scene)) + 1
+        index = numpy.concatenate(([0], index))
+        y0 = numpy.minimum.reduceat(start[order, ypos], index)
+        y1 = numpy.maximum.reduceat(end[order, ypos], index)
+        x0 = numpy.minimum.reduceat(start[order, xpos], index)
+        x1 = numpy.maximum.reduceat(end[order, xpos], index)
+        return dict((int(s), ((int(a), int(b)), (int(c), int(d))))
+                    for s, a, b, c, d in zip(scene[index], y0, y1, x0, x1))
+
+    def _region_tiles(self, plane, region):
+        """Return (row, y, x) of subblocks of plane intersecting region.
+
+        'plane' is a (S, T, C, Z) tuple and 'region' a pair of half-open
+        ranges along Y and X. Rows are in mosaic order, positions relative
+        to 'start'.
+
+        """
+        ypos, xpos = self.axes.find(b'Y'), self.axes.find(b'X')
+        (y0, y1), (x0, x1) = region
+        start, size = self.filtered_extents
+        tiles = []
+        for row in self._plane_rows.get(plane, ()):
+            ty = int(start[row, ypos]) - self.start[ypos]
+            tx = int(start[row, xpos]) - self.start[xpos]
+            if (ty >= y1 or tx >= x1 or
+                    ty + size[row, ypos] <= y0 or
+                    tx + size[row, xpos] <= x0):
+                continue
+            tiles.append((row, ty, tx))
+        return tiles
+
+    def _tile_plane_index(self, directory_entry, key):
+        """Return index of YX0 plane in decoded subblock data.
+
+        'key' maps dimension characters to indices relative to 'start'.
+
+        """
+        index = []
+        axes = directory_entry.axes
+        for i in range(len(axes)):
+            ax = axes[i:i+1]
+            if ax in (b'Y', b'X', b'0'):
+                index.append(slice(None))
+            elif ax in key:
+                index.append(key[ax] -
+                             (directory_entry.start[i] - self.start[i]))
+            else:
+                index.append(0)
+        return tuple(index)
+
+    def asarray(self, bgr2rgb=False, resize=True, order=1, memmap=False,
+                max_workers=None, tempdir=None, mmap_mode=None, level=0,
+                out=None):
         """Return image data from file(s) as numpy array.
 
+        Subblocks are read in the order of their position in the file,
+        coalescing reads of adjacent subblocks.
+
         Parameters
         ----------
         bgr2rgb : bool
@@ -370,27 +961,170 @@ class CziFile(object):
         order : int
             The order of spline interpolation used to resize sub/supersampled
             subblock data. Default is 1 (bilinear).
-        memmap : bool
-            If True, return an array stored in a binary file on disk.
+        memmap : bool or str
+            If True, return an array stored in a temporary binary file on
+            disk, which is removed when the array is garbage collected.
+            If a file name, return an array stored in this file, which is
+            created or overwritten and kept.
+        max_workers : int
+            Number of threads used to read and decode subblocks.
+            If None (default) or 1, subblocks are decoded sequentially.
+        tempdir : str
+            Directory in which to create the temporary file if memmap is
+            True. By default, the system's temporary directory is used.
+        mmap_mode : str
+            If 'r' or 'c', copy uncompressed subblocks into the output
+            directly from the memory-mapped file instead of reading them
+            into intermediate buffers. See SubBlockSegment.data().
+        level : int
+            Pyramid level to read, see pyramid_level(). By default, the
+            full resolution image is returned.
+        out : numpy.ndarray
+            Array to write the image data to and return, e.g. a view
+            of a buffer in another dimension order. Its shape must match
+            'shape', except for dimensions of length 1, which receive the
+            first index of the dimension only. Subblocks outside 'out'
+            are not read. Can not be used with memmap.
 
         """
-        if memmap:
-            with tempfile.NamedTemporaryFile() as fh:
-                image = numpy.memmap(fh, dtype=self.dtype, shape=self.shape)
+        if level:
+            return self.pyramid_level(level).asarray(
+                bgr2rgb=bgr2rgb, resize=resize, order=order, memmap=memmap,
+                max_workers=max_workers, tempdir=tempdir, mmap_mode=mmap_mode,
+                out=out)
+        if out is not None:
+            if memmap:
+                raise ValueError("can not use out and memmap together")
+            if (out.ndim != len(self.shape) or
+                    any(j not in (i, 1) for i, j in zip(self.shape,
+                                                        out.shape))):
+                raise ValueError("out has shape %s, expected %s" %
+                                 (out.shape, self.shape))
+            image = out
+            image[...] = 0
+        elif memmap:
+            filename = None if memmap is True else memmap
+            image = create_memmap(self.shape, self.dtype, filename, tempdir)
         else:
             image = numpy.zeros(self.shape, self.dtype)
 
-        for directory_entry in self.filtered_subblock_directory:
-            subblock = directory_entry.data_segment()
-            tile = subblock.data(bgr2rgb=bgr2rgb, resize=resize, order=order)
-            index = [slice(i-j, i-j+k) for i, j, k in
-                     zip(directory_entry.start, self.start, tile.shape)]
+        axes = self.axes
+        ypos, xpos = axes.find(b'Y'), axes.find(b'X')
+        starts = (self.filtered_extents[0] -
+                  numpy.array(self.start[:-1])).tolist()
+        rows = [row for row, start in enumerate(starts)
+                if all(i < n for i, n in zip(start, image.shape))]
+        planes = [tuple(start[i] for i in range(len(start))
+                        if axes[i:i+1] not in (b'Y', b'X'))
+                  for start in starts]
+        # overlapping mosaic tiles of a plane are composited in directory
+        # order while each tile is written as soon as it is decoded
+        positions = self.filtered_directory_array['file_position']
+        reordered = _reordered_planes(
+            sorted(rows, key=lambda row: positions[row]),
+            dict((row, [(planes[row], row)]) for row in rows))
+        pasted = {}
+
+        subblocks = self._read_subblocks(
+            rows, max_workers=max_workers, bgr2rgb=bgr2rgb,
+            resize=resize, order=order, mmap_mode=mmap_mode)
+        for row, tile in subblocks:
+            # crop tiles extending beyond dimensions of 'out'
+            index = tuple(slice(i, min(i+k, n)) for i, k, n in
+                          zip(starts[row] + [0], tile.shape, image.shape))
+            crop = tuple(slice(0, j.stop - j.start) for j in index)
+            where = True
+            if planes[row] in reordered:
+                box = index[ypos], index[xpos]
+                boxes = pasted.setdefault(planes[row], [])
+                where = _uncovered(box, [b for r, b in boxes if r > row],
+                                   image.ndim, ypos, xpos)
+                boxes.append((row, box))
             try:
-                image[index] = tile
+                numpy.copyto(image[index], tile[crop], casting='unsafe',
+                             where=where)
             except ValueError as e:
                 warnings.warn(str(e))
+        if memmap:
+            image.flush()
         return image
 
+    @lazyattr
+    def _subblock_ends(self):
+        """Return upper bounds of the file extents of filtered subblocks.
+
+        A subblock segment ends at or before the next segment in the file
+        known from the directory and header, or at the end of the file.
+
+        """
+        header = self.header
+        known = numpy.unique(numpy.concatenate((
+            self.directory_array['file_position'],
+            [pos for pos in (header.directory_position,
+                             header.metadata_position,
+                             header.attachment_directory_position) if pos],
+            [self._fh.size])))
+        positions = self.filtered_directory_array['file_position']
+        index = numpy.searchsorted(known, positions, side='right')
+        return known[numpy.minimum(index, len(known) - 1)]
+
+    def _read_subblocks(self, rows, max_workers=None, mmap_mode=None,
+                        **kwargs):
+        """Read and decode subblocks in the order of their file position.
+
+        Yield (row, data) tuples for rows of filtered_directory_array.
+        Adjacent subblocks are fetched with single reads of up to
+        COALESCED_READ_SIZE bytes, see plan_reads(). If 'mmap_mode' is
+        specified, subblocks are read individually such that uncompressed
+        data can be memory-mapped.
+        Other keyword arguments are passed to SubBlockSegment.data().
+        Pyramid subblocks are returned at their stored size.
+
+        """
+        if self._pyramid_factor > 1:
+            kwargs['resize'] = False
+        rows = numpy.asarray(rows, 'intp')
+        if not len(rows):
+            return
+        positions = self.filtered_directory_array['file_position'][rows]
+        reads = plan_reads(positions, self._subblock_ends[rows],
+                           0 if mmap_mode else COALESCED_READ_SIZE)
+        parallel = max_workers is not None and max_workers > 1
+
+        def decode(read):
+            offset, size, indices = read
+            fh = self._reader
+            if size is not None:
+                fh.seek(offset)
+                fh = BufferReader(fh.read(size), offset)
+            result = []
+            for i in indices:
+                subblock = Segment(fh, int(positions[i])).data()
+                result.append((int(rows[i]), subblock.data(
+                    mmap_mode=mmap_mode, **kwargs)))
+            return result
+
+        if not parallel:
+            for read in reads:
+                for item in decode(read):
+                    yield item
+            return
+        # at most two reads per thread are pending, so decoded subblocks
+        # do not pile up when the consumer is slower than the threads
+        pool = ThreadPool(max_workers)
+        try:
+            pending = collections.deque()
+            for read in reads:
+                if len(pending) >= 2 * max_workers:
+                    for item in pending.popleft().get():
+                        yield item
+                pending.append(pool.apply_async(decode, (read,)))
+            while pending:
+                for item in pending.popleft().get():
+                    yield item
+        finally:
+            pool.terminate()
+
     def close(self):
         self._fh.close()
 
@@ -546,27 +1280,47 @@ class SubBlockSegment(object):
         self._fh.seek(self.data_offset - self.metadata_size)
         return unicode(self._fh.read(self.metadata_size), 'utf-8')
 
-    def data(self, raw=False, bgr2rgb=True, resize=True, order=1):
-        """Read image data from file and return as numpy array."""
+    def data(self, raw=False, bgr2rgb=True, resize=True, order=1,
+             mmap_mode=None):
+        """Read image data from file and return as numpy array.
+
+        If 'mmap_mode' is 'r' (read-only) or 'c' (copy-on-write) and the
+        data are uncompressed, return a view of the memory-mapped file
+        instead of reading a copy, if possible.
+
+        """
         self._fh.seek(self.data_offset)
         if raw:
             return self._fh.read(self.data_size)
         elif self.compression and self.compression < RAW_COMPRESSION_VALUE:
             if self.compression not in DECOMPRESS:
-                raise ValueError("compression unknown or not supported")
+                raise ValueError(
+                    "compression %s unknown or not supported, decoding JPEG "
+                    "and JPEG-XR requires the imagecodecs package or the "
+                    "_czifile extension module" %
+                    COMPRESSION.get(self.compression, self.compression))
             # TODO: iotest this
             data = self._fh.read(self.data_size)
-            data = DECOMPRESS[self.compression](data)
             if self.compression == 2:
                 # LZW
-                data = numpy.fromstring(data, self.dtype)
+                data = decode_lzw_array(data, self.dtype, self.stored_shape)
+            else:
+                data = DECOMPRESS[self.compression](data)
         else:
             dtype = numpy.dtype(self.dtype)
-            data = self._fh.read_array(dtype, self.data_size // dtype.itemsize)
+            count = self.data_size // dtype.itemsize
+            data = None
+            if mmap_mode:
+                data = map_array(self._fh, self.data_offset, dtype, count,
+                                 mmap_mode)
+            if data is None:
+                data = self._fh.read_array(dtype, count)
 
         data = data.reshape(self.stored_shape)
         if self.stored_shape == self.shape or not resize:
             if bgr2rgb and self.stored_shape[-1] in (3, 4):
+                if not data.flags.writeable:
+                    data = data.copy()
                 tmp = data[..., 0].copy()
                 data[..., 0] = data[..., 2]
                 data[..., 2] = tmp
@@ -651,6 +1405,23 @@ class DirectoryEntryDV(object):
             [DimensionEntryDV1(fh) for _ in range(dimensions_count)]))
         self._fh = fh
 
+    @classmethod
+    def from_record(cls, record, fh):
+        """Return DirectoryEntryDV from record of directory_array()."""
+        self = cls.__new__(cls)
+        self.file_position = int(record['file_position'])
+        self.file_part = int(record['file_part'])
+        self.compression = int(record['compression'])
+        self.pyramid_type = int(record['pyramid_type'])
+        self.dtype = PIXEL_TYPE[int(record['pixel_type'])]
+        self.dimension_entries = [
+            DimensionEntryDV1.from_values(*values) for values in zip(
+                record['dimension'], record['start'], record['size'],
+                record['start_coordinate'], record['stored_size'])
+            if values[0]]
+        self._fh = fh
+        return self
+
     @lazyattr
     def storage_size(self):
         return 32 + len(self.dimension_entries) * 20
@@ -691,9 +1462,13 @@ class DirectoryEntryDV(object):
             if dim.dimension == b'M':
                 return dim.start
 
-    def data_segment(self):
-        """Read and return SubBlockSegment at file_position."""
-        return Segment(self._fh, self.file_position).data()
+    def data_segment(self, fh=None):
+        """Read and return SubBlockSegment at file_position.
+
+        Use 'fh' instead of the directory's file handle if specified.
+
+        """
+        return Segment(fh or self._fh, self.file_position).data()
 
     def __str__(self):
         return "DirectoryEntryDV\n  %s %s %s %s\n  %s" % (
@@ -702,6 +1477,34 @@ class DirectoryEntryDV(object):
             "\n  ".join(str(d) for d in self.dimension_entries))
 
 
+class DirectoryEntryList(object):
+    """Sequence of DirectoryEntryDV backed by directory_array() records.
+
+    DirectoryEntryDV instances are created on access and not kept.
+
+    """
+    __slots__ = 'records', '_fh'
+
+    def __init__(self, records, fh):
+        self.records = records
+        self._fh = fh
+
+    def __len__(self):
+        return len(self.records)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return DirectoryEntryList(self.records[key], self._fh)
+        return DirectoryEntryDV.from_record(self.records[key], self._fh)
+
+    def __iter__(self):
+        for record in self.records:
+            yield DirectoryEntryDV.from_record(record, self._fh)
+
+    def __str__(self):
+        return "\n ".join(str(e) for e in self)
+
+
 class DimensionEntryDV1(object):
     """Dimension Entry - Schema DV."""
 
@@ -717,6 +1520,18 @@ class DimensionEntryDV1(object):
         self.dimension = stripnull(self.dimension)
         self.stored_size = stored_size if stored_size else self.size
 
+    @classmethod
+    def from_values(cls, dimension, start, size, start_coordinate,
+                    stored_size):
+        """Return DimensionEntryDV1 from decoded values."""
+        self = cls.__new__(cls)
+        self.dimension = bytes(dimension)
+        self.start = int(start)
+        self.size = int(size)
+        self.start_coordinate = float(start_coordinate)
+        self.stored_size = int(stored_size)
+        return self
+
     def __str__(self):
         return "DimensionEntryDV1 %s %i %i %f %i" % (
             self.dimension, self.start, self.size,
@@ -741,6 +1556,52 @@ class SubBlockDirectorySegment(object):
         return tuple(DirectoryEntryDV.read_file_position(fh)
                      for _ in range(entry_count))
 
+    @staticmethod
+    def records(fh):
+        """Return entries as numpy structured array, see directory_array()."""
+        entry_count = struct.unpack('<i', fh.read(4))[0]
+        fh.seek(124, 1)  # reserved
+        if entry_count < 1:
+            return directory_array(())
+        fpos = fh.tell()
+        ndim = struct.unpack('<i', fh.read(32)[28:])[0]
+        # decode all entries at once if they have the same dimensions
+        dtype = numpy.dtype([
+            ('schema_type', 'S2'),
+            ('pixel_type', '<i4'),
+            ('file_position', '<i8'),
+            ('file_part', '<i4'),
+            ('compression', '<i4'),
+            ('pyramid_type', 'u1'),
+            ('reserved', 'V5'),
+            ('dimensions_count', '<i4'),
+            ('dimensions', [('dimension', 'S4'),
+                            ('start', '<i4'),
+                            ('size', '<i4'),
+                            ('start_coordinate', '<f4'),
+                            ('stored_size', '<i4')], (ndim,))])
+        fh.seek(fpos)
+        data = fh.read(entry_count * dtype.itemsize)
+        raw = numpy.frombuffer(data, dtype, len(data) // dtype.itemsize)
+        if (len(raw) != entry_count or
+                not (raw['schema_type'] == b'DV').all() or
+                not (raw['dimensions_count'] == ndim).all()):
+            fh.seek(fpos)
+            return directory_array(
+                [DirectoryEntryDV(fh) for _ in range(entry_count)])
+        result = numpy.zeros(entry_count, directory_entry_dtype(ndim))
+        for name in ('file_position', 'file_part', 'compression',
+                     'pixel_type', 'pyramid_type'):
+            result[name] = raw[name]
+        # reverse dimension entries to match C contiguous data
+        dimensions = raw['dimensions'][:, ::-1]
+        for name in ('dimension', 'start', 'size', 'start_coordinate'):
+            result[name] = dimensions[name]
+        stored_size = dimensions['stored_size']
+        result['stored_size'] = numpy.where(stored_size, stored_size,
+                                            dimensions['size'])
+        return result
+
     def __init__(self, fh):
         entry_count = struct.unpack('<i', fh.read(4))[0]
         fh.seek(124, 1)  # reserved
@@ -916,14 +1777,14 @@ class TimeStamps(object):
     """CZTIMS TimeStamps content schema.
 
     Contains sequence of floting point numbers, i.e. seconds relative
-    to start time of acquisition.
+    to start time of acquisition, as numpy array.
 
     """
     __slots__ = 'time_stamps',
 
     def __init__(self, fh, filesize=None):
         size, number = struct.unpack('<ii', fh.read(8))
-        self.time_stamps = struct.unpack('<%id' % number, fh.read(8 * number))
+        self.time_stamps = fh.read_array('<f8', number)
 
     def __len__(self):
         return len(self.time_stamps)
@@ -942,14 +1803,14 @@ class FocusPositions(object):
     """CZFOC FocusPositions content schema.
 
     Contains sequence of floting point numbers, i.e. micrometers relative
-    to Z start position of acquisition.
+    to Z start position of acquisition, as numpy array.
 
     """
     __slots__ = 'positions',
 
     def __init__(self, fh, filesize=None):
         size, number = struct.unpack('<ii', fh.read(8))
-        self.positions = struct.unpack('<%id' % number, fh.read(8 * number))
+        self.positions = fh.read_array('<f8', number)
 
     def __len__(self):
         return len(self.positions)
@@ -965,13 +1826,23 @@ class FocusPositions(object):
 
 
 class EventList(object):
-    """CZEVL EventList content schema. Sequence of EventListEntry."""
+    """CZEVL EventList content schema. Sequence of EventListEntry.
+
+    The times and types of the events are also available as numpy arrays.
 
-    __slots__ = 'events',
+    """
+    __slots__ = 'events', 'times', 'event_types'
 
     def __init__(self, fh, filesize=None):
         size, number = struct.unpack('<ii', fh.read(8))
+        if filesize is not None:
+            # parse entries from single read
+            offset = fh.tell()
+            fh = BufferReader(fh.read(filesize - 8), offset)
         self.events = [EventListEntry(fh) for _ in range(number)]
+        self.times = numpy.array([e.time for e in self.events], '<f8')
+        self.event_types = numpy.array([e.event_type for e in self.events],
+                                       '<i4')
 
     def __len__(self):
         return len(self.events)
@@ -1015,6 +1886,10 @@ class LookupTables(object):
 
     def __init__(self, fh, filesize=None):
         size, number = struct.unpack('<ii', fh.read(8))
+        if filesize is not None:
+            # parse entries from single read
+            offset = fh.tell()
+            fh = BufferReader(fh.read(filesize - 8), offset)
         self.lookup_tables = [LookupTableEntry(fh) for _ in range(number)]
 
     def __len__(self):
@@ -1063,7 +1938,7 @@ class ComponentEntry(object):
 
     def __init__(self, fh):
         size, self.component_type, number = struct.unpack('<iii', fh.read(12))
-        self.intensity = fh.fromfile(dtype='<i2', count=number//2)
+        self.intensity = fh.read_array('<i2', number//2)
         if self.component_type == -1:
             self.intensity = self.intensity.reshape(-1, 3)
 
@@ -1073,6 +1948,343 @@ class ComponentEntry(object):
             str(self.intensity.shape))
 
 
+class PositionalReader(object):
+    """Thread-safe, read-only access to a FileHandle.
+
+    Data is read with os.pread if the file has a file descriptor, so
+    readers do not use or change the seek state of the open file.
+    Streams with a 'read_at(offset, size)' method, e.g. RangeFile, are read
+    with that method. Other streams are accessed under 'lock', which must
+    be shared by all readers of the stream.
+
+    The file position of the reader is local to the calling thread, such
+    that several threads can seek and read through one reader, e.g. by
+    reading segments concurrently.
+
+    Implements the subset of the FileHandle interface used by Segment
+    and the *Segment classes.
+
+    """
+    __slots__ = '_parent', '_lock', '_local', '_fd', '_read_at'
+
+    def __init__(self, fh, lock=None):
+        self._parent = fh
+        self._lock = lock if lock is not None else threading.Lock()
+        self._local = threading.local()
+        self._fd = None
+        self._read_at = None
+        if hasattr(os, 'pread') and fh.is_file:
+            self._fd = fh._fh.fileno()
+        elif hasattr(fh._fh, 'read_at'):
+            self._read_at = fh._fh.read_at
+
+    @property
+    def _pos(self):
+        return getattr(self._local, 'pos', 0)
+
+    @_pos.setter
+    def _pos(self, value):
+        self._local.pos = value
+
+    @property
+    def size(self):
+        return self._parent.size
+
+    @property
+    def is_file(self):
+        return self._parent.is_file
+
+    @property
+    def name(self):
+        return self._parent.name
+
+    @property
+    def path(self):
+        return self._parent.path
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=0):
+        if whence == 0:
+            self._pos = offset
+        elif whence == 1:
+            self._pos += offset
+        else:
+            self._pos = self.size + offset
+
+    def read(self, size=-1):
+        if size < 0:
+            size = max(self.size - self._pos, 0)
+        offset = self._parent._offset + self._pos
+        if self._fd is not None:
+            data = os.pread(self._fd, size, offset)
+        elif self._read_at is not None:
+            data = self._read_at(offset, size)
+        else:
+            with self._lock:
+                fh = self._parent._fh
+                fh.seek(offset)
+                data = fh.read(size)
+        self._pos += len(data)
+        return data
+
+    def read_array(self, dtype, count=-1):
+        """Return numpy array of 'count' items from file."""
+        dtype = numpy.dtype(dtype)
+        if count < 0:
+            count = max(self.size - self._pos, 0) // dtype.itemsize
+        data = self.read(count * dtype.itemsize)
+        return numpy.frombuffer(data, dtype, len(data) // dtype.itemsize).copy()
+
+
+class BufferReader(object):
+    """Read-only access to part of a file that was read into memory.
+
+    Offsets are file positions, i.e. the first byte of 'data' is at file
+    position 'offset'. Used to parse segments from coalesced reads.
+
+    Implements the subset of the FileHandle interface used by Segment
+    and the *Segment classes.
+
+    """
+    __slots__ = '_data', '_offset', '_pos'
+
+    def __init__(self, data, offset=0):
+        self._data = data
+        self._offset = offset
+        self._pos = offset
+
+    @property
+    def size(self):
+        return self._offset + len(self._data)
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=0):
+        if whence == 0:
+            self._pos = offset
+        elif whence == 1:
+            self._pos += offset
+        else:
+            self._pos = self.size + offset
+
+    def read(self, size=-1):
+        start = self._pos - self._offset
+        if start < 0:
+            raise IOError("file position %i not in buffer" % self._pos)
+        if size < 0:
+            size = max(len(self._data) - start, 0)
+        data = self._data[start:start+size]
+        self._pos += len(data)
+        return data
+
+    def read_array(self, dtype, count=-1):
+        """Return numpy array of 'count' items from buffer."""
+        dtype = numpy.dtype(dtype)
+        if count < 0:
+            count = max(self.size - self._pos, 0) // dtype.itemsize
+        data = self.read(count * dtype.itemsize)
+        return numpy.frombuffer(data, dtype, len(data) // dtype.itemsize).copy()
+
+
+def plan_reads(offsets, ends, max_size=None, max_gap=0):
+    """Return list of coalesced reads of segments in file order.
+
+    Parameters
+    ----------
+    offsets : sequence of int
+        File positions of the segments to read.
+    ends : sequence of int
+        Upper bounds of the file positions at which the segments end.
+    max_size : int
+        Maximum number of bytes in a coalesced read. Segments extending
+        over more bytes are read individually.
+        If None (default), the size of reads is not limited.
+    max_gap : int
+        Maximum number of bytes between consecutive segments to read over
+        in order to coalesce them. By default, only segments that are
+        adjacent in the file are coalesced.
+
+    Returns
+    -------
+    list of (offset, size, indices) tuples
+        'indices' are indices into 'offsets', sorted by file position.
+        'size' is None for segments that should be read individually.
+
+    """
+    reads = []
+    for i in numpy.argsort(offsets, kind='mergesort').tolist():
+        offset, end = int(offsets[i]), int(ends[i])
+        if max_size is not None and end - offset > max_size:
+            reads.append((offset, None, [i]))
+            continue
+        if reads and reads[-1][1] is not None:
+            start, size, indices = reads[-1]
+            if (0 <= offset - (start + size) <= max_gap and
+                    (max_size is None or end - start <= max_size)):
+                reads[-1] = start, end - start, indices + [i]
+                continue
+        reads.append((offset, end - offset, [i]))
+    return reads
+
+
+def _reordered_planes(rows, tiles):
+    """Return set of planes whose tiles are not read in compositing order.
+
+    'rows' are subblock rows in the order they are read. 'tiles' maps
+    rows to lists of (plane, rank) tuples, where tiles of higher rank
+    are composited over tiles of lower rank in the same plane.
+
+    """
+    last, reordered = {}, set()
+    for row in rows:
+        for plane, rank in tiles[row]:
+            if last.get(plane, rank) > rank:
+                reordered.add(plane)
+            last[plane] = max(last.get(plane, rank), rank)
+    return reordered
+
+
+def _uncovered(box, boxes, ndim, ypos, xpos):
+    """Return mask of YX box excluding the other boxes.
+
+    Boxes are pairs of slices along Y and X. The mask has 'ndim'
+    dimensions, of length 1 except along 'ypos' and 'xpos'.
+
+    """
+    y, x = box
+    mask = numpy.ones((y.stop - y.start, x.stop - x.start), 'bool')
+    for by, bx in boxes:
+        mask[max(by.start - y.start, 0):max(by.stop - y.start, 0),
+             max(bx.start - x.start, 0):max(bx.stop - x.start, 0)] = False
+    shape = [1] * ndim
+    shape[ypos], shape[xpos] = mask.shape
+    return mask.reshape(shape)
+
+
+def directory_entry_dtype(ndim):
+    """Return numpy dtype of directory_array() records with ndim dimensions.
+
+    Per-dimension fields are in the order of
+    DirectoryEntryDV.dimension_entries. Unused dimensions are empty.
+
+    """
+    return numpy.dtype([
+        ('file_position', '<i8'),
+        ('file_part', '<i4'),
+        ('compression', '<i4'),
+        ('pixel_type', '<i4'),
+        ('pyramid_type', 'u1'),
+        ('dimension', 'S4', (ndim,)),
+        ('start', '<i4', (ndim,)),
+        ('size', '<i4', (ndim,)),
+        ('start_coordinate', '<f4', (ndim,)),
+        ('stored_size', '<i4', (ndim,)),
+    ])
+
+
+def directory_array(directory_entries):
+    """Return sequence of DirectoryEntryDV as numpy structured array."""
+    ndim = max([len(e.dimension_entries) for e in directory_entries] or [0])
+    result = numpy.zeros(len(directory_entries), directory_entry_dtype(ndim))
+    for record, directory_entry in zip(result, directory_entries):
+        record['file_position'] = directory_entry.file_position
+        record['file_part'] = directory_entry.file_part
+        record['compression'] = directory_entry.compression
+        record['pixel_type'] = PIXEL_TYPE_CODE[directory_entry.dtype]
+        record['pyramid_type'] = directory_entry.pyramid_type
+        for i, dim in enumerate(directory_entry.dimension_entries):
+            record['dimension'][i] = dim.dimension
+            record['start'][i] = dim.start
+            record['size'][i] = dim.size
+            record['start_coordinate'][i] = dim.start_coordinate
+            record['stored_size'][i] = dim.stored_size
+    return result
+
+
+def map_array(fh, offset, dtype, count, mode='r'):
+    """Return numpy array view of data in memory-mapped file.
+
+    Parameters
+    ----------
+    fh : FileHandle or PositionalReader
+        File containing the data at 'offset'.
+    mode : str
+        'r' maps the data read-only, 'c' copy-on-write, i.e. the array is
+        writable but changes are not written to the file.
+
+    Each call maps a separate region of the file, so copy-on-write views
+    do not share modifications. Return None if 'fh' can not be mapped.
+
+    """
+    if isinstance(fh, BufferReader):
+        return None
+    if isinstance(fh, PositionalReader):
+        fh = fh._parent
+    if not fh.is_file:
+        return None
+    access = {'r': mmap.ACCESS_READ, 'c': mmap.ACCESS_COPY}[mode]
+    dtype = numpy.dtype(dtype)
+    offset += fh._offset
+    start = offset - offset % mmap.ALLOCATIONGRANULARITY
+    size = offset - start + count * dtype.itemsize
+    if size == 0:
+        return numpy.empty(0, dtype)
+    mapped = mmap.mmap(fh._fh.fileno(), size, access=access, offset=start)
+    return numpy.frombuffer(mapped, dtype, count, offset - start)
+
+
+def create_memmap(shape, dtype, filename=None, tempdir=None):
+    """Return zero initialized numpy.memmap stored in a file on disk.
+
+    If 'filename' is None, the array is stored in a new temporary file in
+    'tempdir', which is removed once the array and all views of it are
+    garbage collected, or at the latest when the interpreter exits.
+
+    """
+    if filename is not None:
+        return numpy.memmap(filename, dtype=dtype, mode='w+', shape=shape)
+    fd, filename = tempfile.mkstemp(suffix='.memmap', dir=tempdir)
+    os.close(fd)
+    try:
+        image = numpy.memmap(filename, dtype=dtype, mode='w+', shape=shape)
+    except Exception:
+        os.remove(filename)
+        raise
+    # views of a memmap keep a reference to it, so the file outlives them
+    ref = weakref.ref(image, _remove_memmap_file)
+    _TEMPORARY_MEMMAPS[id(ref)] = ref, filename
+    return image
+
+
+def _remove_memmap_file(ref):
+    """Remove file of garbage collected temporary memmap."""
+    _, filename = _TEMPORARY_MEMMAPS.pop(id(ref), (None, None))
+    if filename is not None:
+        try:
+            os.remove(filename)
+        except OSError:
+            # still mapped on Windows; retry at exit
+            _TEMPORARY_MEMMAPS[filename] = None, filename
+
+
+@atexit.register
+def _remove_memmap_files():
+    """Remove files of temporary memmaps that are still alive at exit."""
+    for _, filename in list(_TEMPORARY_MEMMAPS.values()):
+        try:
+            os.remove(filename)
+        except OSError:
+            pass
+    _TEMPORARY_MEMMAPS.clear()
+
+
+# map ids of weak references to temporary memmaps to (reference, file name)
+_TEMPORARY_MEMMAPS = {}
+
+
 def xml_reader(fh, filesize):
     """Read XML from file and return as xml.ElementTree root Element."""
     xml = unicode(stripnull(fh.read(filesize)), 'utf-8')
@@ -1089,7 +2301,15 @@ def match_filename(filename):
 
 
 def decode_jxr(data):
-    """Decode JXR data stream into ndarray via temporary file."""
+    """Decode JXR data stream into ndarray.
+
+    The data are decoded in memory if the imagecodecs package is available,
+    else via temporary file using the _czifile extension module.
+    Both paths can be used from multiple threads concurrently.
+
+    """
+    if _jpegxr_decode is not None:
+        return _jpegxr_decode(data)
     fd, filename = tempfile.mkstemp(suffix='.jxr')
     with os.fdopen(fd, 'wb') as fh:
         fh.write(data)
@@ -1102,11 +2322,46 @@ def decode_jxr(data):
     return out
 
 
+def decode_lzw_array(data, dtype, shape):
+    """Decode LZW data stream into new numpy array of dtype and shape.
+
+    If the imagecodecs package is available, the data are decoded directly
+    into the array without holding the GIL, else via tifffile.decode_lzw.
+    Missing data are zero.
+
+    """
+    dtype = numpy.dtype(dtype).base
+    out = numpy.zeros(shape, dtype)
+    if _lzw_decode is not None:
+        _lzw_decode(data, out=out.reshape(-1).view('u1'))
+        return out
+    data = decode_lzw(data)
+    count = min(out.size, len(data) // dtype.itemsize)
+    out.reshape(-1)[:count] = numpy.frombuffer(data, dtype, count)
+    return out
+
+
 def decode_jpeg(data):
     """Decode JPEG data stream into ndarray."""
+    if _jpeg_decode is not None:
+        return _jpeg_decode(data)
     return _czifile.decode_jpeg(data)
 
 
+# maximum number of bytes fetched by one coalesced read of subblocks
+COALESCED_READ_SIZE = 2**23
+
+# version of the sidecar index file format written by CziFile
+INDEX_CACHE_VERSION = 2
+
+# CziFile attributes that depend on the pyramid level
+_PYRAMID_LEVEL_ATTRS = (
+    '_pyramid_views', '_pyramid_factor', 'filtered_directory_array',
+    'filtered_subblock_directory', 'filtered_extents',
+    '_filtered_mosaic_index', 'shape', 'start', 'axes', 'dtype',
+    'pixel_sizes', 'subblock_index', '_subblock_rows', '_plane_rows',
+    '_subblock_ends', 'scene_regions')
+
 # map Segment.sid to data reader
 SEGMENT_ID = {
     FileHeaderSegment.SID: FileHeaderSegment,
@@ -1149,6 +2404,10 @@ PIXEL_TYPE = {
     13: '<i8', 'Gray64': '<i8', '<i8': 'Gray64',
 }
 
+# map numpy dtypes to DirectoryEntryDV.pixeltype
+PIXEL_TYPE_CODE = dict((v, k) for k, v in PIXEL_TYPE.items()
+                       if isinstance(k, int))
+
 
 # map dimension character to description
 DIMENSIONS = {
@@ -1183,8 +2442,9 @@ DECOMPRESS = {
     2: decode_lzw,  # LZW
 }
 
-if _have_czifile:
+if _have_czifile or _jpeg_decode is not None:
     DECOMPRESS[1] = decode_jpeg
+if _have_czifile or _jpegxr_decode is not None:
     DECOMPRESS[4] = decode_jxr
 
 if sys.version_info[0] > 2:
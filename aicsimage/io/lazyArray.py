@@ -0,0 +1,152 @@
+import numbers
+
+import numpy as np
+
+
+class LazyArray(object):
+    """This class is a read-only, ndarray-like view of a 5D TZCYX image that only reads data when it is indexed
+
+    Example:
+        reader = cziReader.CziReader("file.czi")
+        lazy = reader.lazy()
+        print(lazy.shape, lazy.dtype, lazy.chunks)
+        # only the planes of channel 2 in the first 3 z slices are decoded
+        zyx = lazy[0, 0:3, 2]
+        # regions are supported in YX as well
+        crop = lazy[0, :, :, 100:200, 300:400]
+        # the whole image can still be materialized
+        image = numpy.asarray(lazy)
+
+    Indexing follows numpy basic indexing: integers, slices (with steps) and Ellipsis.
+    Integer sequences are also accepted on any axis; each of them selects along its own axis
+    independently (outer indexing), unlike numpy advanced indexing.
+
+    Subclasses implement _read_plane(t, z, c, y, x), which returns the YX region
+    [y[0]:y[1], x[0]:x[1]] of a single plane as a 2D array.
+    """
+
+    dims = "TZCYX"
+
+    def __init__(self, shape, dtype, chunks=None):
+        """
+        :param shape: The 5D TZCYX shape of the image
+        :param dtype: The numpy dtype of the image
+        :param chunks: The sizes of the independently readable blocks along each axis,
+                       as a tuple of tuples (e.g. ((1, 1), (1,)*10, (1, 1, 1), (512, 512), (512, 512)))
+        """
+        assert len(shape) == len(self.dims)
+        self.shape = tuple(int(i) for i in shape)
+        self.dtype = np.dtype(dtype)
+        if chunks is None:
+            chunks = tuple((1,) * size for size in self.shape[:3]) + ((self.shape[3],), (self.shape[4],))
+        self.chunks = tuple(tuple(int(i) for i in c) for c in chunks)
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def size(self):
+        return int(np.prod(self.shape))
+
+    @property
+    def nbytes(self):
+        return self.size * self.dtype.itemsize
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __array__(self, dtype=None, copy=None):
+        data = self[...]
+        return data if dtype is None else data.astype(dtype)
+
+    def __repr__(self):
+        return "<{} shape={} dtype={} dims={}>".format(type(self).__name__, self.shape, self.dtype, self.dims)
+
+    def chunk_boundaries(self, axis):
+        """Returns the start offsets of the chunks along an axis, followed by the axis size
+
+        :param axis: The index of the axis, or its name in dims
+        :return: list of ints
+        """
+        if not isinstance(axis, numbers.Integral):
+            axis = self.dims.index(axis)
+        return [int(i) for i in np.cumsum((0,) + self.chunks[axis])]
+
+    def __getitem__(self, key):
+        selections, squeeze = self._normalize_key(key)
+        out_shape = tuple(len(s) for s in selections)
+        if 0 in out_shape:
+            return np.zeros(out_shape, dtype=self.dtype)[squeeze]
+
+        # read the bounding YX region once per plane, then pick the requested rows and columns
+        y_sel, x_sel = selections[3], selections[4]
+        y = (int(y_sel.min()), int(y_sel.max()) + 1)
+        x = (int(x_sel.min()), int(x_sel.max()) + 1)
+        y_local = self._local_selector(y_sel, y[0])
+        x_local = self._local_selector(x_sel, x[0])
+
+        if out_shape[:3] == (1, 1, 1):
+            # a single plane is returned as is, which avoids a copy if the reader returns a view
+            plane = self._read_plane(int(selections[0][0]), int(selections[1][0]), int(selections[2][0]), y, x)
+            data = plane[y_local][:, x_local].astype(self.dtype, copy=False)
+            return data.reshape(out_shape)[squeeze]
+
+        out = np.zeros(out_shape, dtype=self.dtype)
+        for i, t in enumerate(selections[0]):
+            for j, z in enumerate(selections[1]):
+                for k, c in enumerate(selections[2]):
+                    plane = self._read_plane(int(t), int(z), int(c), y, x)
+                    out[i, j, k] = plane[y_local][:, x_local]
+        return out[squeeze]
+
+    def _read_plane(self, t, z, c, y, x):
+        raise NotImplementedError
+
+    def _normalize_key(self, key):
+        """Converts a numpy style index into one array of indices per axis plus the index removing integer axes"""
+        if not isinstance(key, tuple):
+            key = (key,)
+        if any(k is None for k in key):
+            raise IndexError("{} does not support adding new axes".format(type(self).__name__))
+        ellipsis = [i for i, k in enumerate(key) if k is Ellipsis]
+        if len(ellipsis) > 1:
+            raise IndexError("an index can only have a single ellipsis ('...')")
+        if ellipsis:
+            i = ellipsis[0]
+            key = key[:i] + (slice(None),) * (self.ndim - len(key) + 1) + key[i+1:]
+        if len(key) > self.ndim:
+            raise IndexError("too many indices for array with dimensions {}".format(self.dims))
+        key = key + (slice(None),) * (self.ndim - len(key))
+
+        selections, squeeze = [], []
+        for axis, (k, size) in enumerate(zip(key, self.shape)):
+            if isinstance(k, slice):
+                selections.append(np.arange(*k.indices(size)))
+                squeeze.append(slice(None))
+            elif isinstance(k, numbers.Integral):
+                index = int(k)
+                if index < -size or index >= size:
+                    raise IndexError("index {} is out of bounds for axis {} with size {}".format(k, self.dims[axis], size))
+                selections.append(np.array([index % size]))
+                squeeze.append(0)
+            else:
+                index = np.asarray(k)
+                if index.ndim != 1 or (index.size and not np.issubdtype(index.dtype, np.integer)):
+                    raise IndexError("only integers, slices, ellipsis and 1D integer sequences are valid indices")
+                if index.size and (index.min() < -size or index.max() >= size):
+                    raise IndexError("index out of bounds for axis {} with size {}".format(self.dims[axis], size))
+                selections.append(index.astype(np.intp) % size if size else index.astype(np.intp))
+                squeeze.append(slice(None))
+        return selections, tuple(squeeze)
+
+    @staticmethod
+    def _local_selector(indices, start):
+        """Returns a slice if the indices are evenly spaced and increasing, else an index array, relative to start"""
+        local = indices - start
+        if len(local) == 1:
+            return slice(int(local[0]), int(local[0]) + 1)
+        step = local[1] - local[0]
+        if step > 0 and np.all(np.diff(local) == step):
+            return slice(int(local[0]), int(local[-1]) + 1, int(step))
+        return local
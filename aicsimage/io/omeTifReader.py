@@ -1,7 +1,14 @@
+import numbers
+import os
+import struct
+import warnings
+
 import numpy as np
 import tifffile
+from tifffile.tifffile import TIFF_DECOMPESSORS, TiffPage
 
-from . import omexml
+from . import czifile, omexml
+from .lazyArray import LazyArray
 
 
 class OmeTifReader:
@@ -23,6 +30,27 @@ class OmeTifReader:
     This should be used when only a few select slices need to be processed
     (e.g. printing out the middle slice for a thumbnail image)
 
+    Planes are located through plane_index, a TZC array of IFD numbers built on open from the
+    TiffData elements of the OME metadata (FirstT/FirstZ/FirstC, IFD and PlaneCount), falling back
+    to the DimensionOrder of the Pixels element. Files written in any dimension order are therefore
+    read correctly, and subsets can be loaded without reading the other planes:
+        channel_2 = reader.load(c=2)
+        first_stacks = reader.load(t=slice(0, 3), c=[0, 4])
+
+    The lazy() function returns a view of the 5D image with dimensions TZCYX that supports numpy style slicing.
+    Only the pages holding the requested planes are read: uncompressed pages are memory-mapped, and compressed
+    pages are decoded one at a time.
+        channel_2 = reader.lazy()[:, :, 2]
+
+    The load_roi() function reads a YX region of interest, optionally limited to ranges of z slices, channels
+    and time points, into a 5D array with dimensions TZCYX. For files written with tiles (see OmeTifWriter's
+    tile_size), only the tiles intersecting the region are decoded; lazy views read regions the same way.
+
+    Pyramidal files store downsampled copies of each plane as reduced resolution SubIFDs of its page.
+    pyramid_levels() lists their downsampling factors, and the level argument of load(), load_roi(),
+    load_slice() and lazy() reads a level directly, without touching the full resolution data:
+        preview = reader.load(c=0, level=3)
+
     This class has a similar interface to CziReader.
     """
 
@@ -41,6 +69,9 @@ class OmeTifReader:
             d = self.tif.pages[0].tags['image_description'].value.strip()
             assert d.startswith(b'<?xml version=') and d.endswith(b'</OME>')
             self.omeMetadata = omexml.OMEXML(d)
+        self.plane_index = self._build_plane_index()
+        self._mmap = None
+        self._level_pages = {}
 
     def __enter__(self):
         return self
@@ -49,35 +80,251 @@ class OmeTifReader:
         self.close()
 
     def close(self):
+        self._mmap = None
+        self._level_pages = {}
         self.tif.close()
 
-    def load(self):
-        """Retrieves an array for all z-slices and channels.
+    def _build_plane_index(self):
+        """Maps every (t, z, c) plane to the IFD holding it
+
+        :return: 3D int array with dimensions TZC, -1 for planes that are not stored in this file
+        """
+        page_count = len(self.tif.pages)
+        if not hasattr(self, "omeMetadata"):
+            # without OME metadata the pages are assumed to be a z stack, as in a plain tiff
+            return np.arange(page_count).reshape(1, page_count, 1)
+
+        pixels = self.omeMetadata.image().Pixels
+        order = (pixels.DimensionOrder or omexml.DO_XYZCT)[2:]
+        sizes = {"T": self.size_t(), "Z": self.size_z(), "C": self.size_c()}
+        # plane numbers run through the dimension order, with its first letter varying fastest
+        order_shape = tuple(sizes[dim] for dim in reversed(order))
+        total = sizes["T"] * sizes["Z"] * sizes["C"]
+        planes = np.full(total, -1, dtype=np.int64)
+
+        tiffdatas = pixels.TiffDatas()
+        if not tiffdatas:
+            planes[:] = np.arange(total)
+        is_local = self._local_tiffdata(tiffdatas)
+        firsts, ifds, counts = [], [], []
+        for tiffdata in tiffdatas:
+            if not is_local(tiffdata):
+                # planes stored in another file of a multi-file set are not supported
+                continue
+            first = {"T": tiffdata.FirstT or 0, "Z": tiffdata.FirstZ or 0, "C": tiffdata.FirstC or 0}
+            if any(first[dim] >= sizes[dim] for dim in first):
+                continue
+            firsts.append(tuple(first[dim] for dim in reversed(order)))
+            ifds.append(tiffdata.IFD)
+            counts.append(tiffdata.PlaneCount)
+        if firsts:
+            starts = np.ravel_multi_index(tuple(np.array(firsts).T), order_shape)
+            # a TiffData without IFD and PlaneCount covers all remaining planes, else a single plane
+            counts = np.array([(total - start if ifd is None else 1) if count is None else count
+                               for start, ifd, count in zip(starts, ifds, counts)], dtype=np.int64)
+            ifds = np.array([ifd or 0 for ifd in ifds], dtype=np.int64)
+            counts = np.maximum(0, np.minimum(counts, np.minimum(total - starts, page_count - ifds)))
+            # files with one TiffData per plane can have hundreds of thousands of them, so those are set at once
+            runs = np.flatnonzero(counts > 1)
+            single = counts == 1
+            planes[starts[single]] = ifds[single]
+            for i in runs:
+                planes[starts[i]:starts[i] + counts[i]] = np.arange(ifds[i], ifds[i] + counts[i])
+
+        planes[planes >= page_count] = -1
+        missing = np.count_nonzero(planes < 0)
+        if missing:
+            warnings.warn("{} of {} planes are not stored in {} and are read as zeros".format(
+                missing, total, self.file_path))
+        transposer = ["".join(reversed(order)).index(dim) for dim in "TZC"]
+        return np.ascontiguousarray(planes.reshape(order_shape).transpose(transposer))
+
+    def _local_tiffdata(self, tiffdatas):
+        """Returns a function telling whether the planes of a TiffData are stored in this file
+
+        TiffData elements name the file holding their planes with a UUID, which is matched against the UUID of
+        the OME element of this file, so renamed files are still read. If no TiffData refers to this file's UUID,
+        all planes are taken to be in this file if the TiffData elements name a single file, else the file name
+        is compared with the name of this file.
+        """
+        uuid = self.omeMetadata.uuidStr
+        if any(tiffdata.UUID == uuid for tiffdata in tiffdatas):
+            return lambda tiffdata: tiffdata.UUID is None or tiffdata.UUID == uuid
+        if len(set(tiffdata.FileName for tiffdata in tiffdatas if tiffdata.FileName is not None)) <= 1:
+            return lambda tiffdata: True
+        file_name = os.path.basename(self.file_path) if self.file_path else None
+        return lambda tiffdata: tiffdata.FileName is None or tiffdata.FileName == file_name
+
+    def _get_ifd(self, t, z, c):
+        ifd = int(self.plane_index[t, z, c])
+        if ifd < 0:
+            raise ValueError("Plane t={}, z={}, c={} is not stored in {}".format(t, z, c, self.file_path))
+        return ifd
+
+    @staticmethod
+    def _selection(key, size):
+        """Converts an int, slice, sequence of ints or None into an array of indices along an axis of the given size"""
+        if key is None:
+            return np.arange(size)
+        if isinstance(key, (numbers.Integral, slice)):
+            return np.atleast_1d(np.arange(size)[key])
+        return np.arange(size)[np.asarray(key, dtype=np.intp)]
+
+    def load(self, t=None, z=None, c=None, level=0):
+        """Retrieves an array for all z-slices and channels, or a subset of them.
+
+        :param t: The time indices to load: an int, a slice, a sequence of ints, or None for all of them
+        :param z: The z indices to load, like t
+        :param c: The channel indices to load, like t
+        :param level: The pyramid level, 0 is full resolution, see pyramid_levels()
+        :return: 5D array with dimensions TZCYX. Planes that are not stored in the file are zero.
+        """
+        selections = [self._selection(key, size) for key, size in zip((t, z, c), self.plane_index.shape)]
+        return self._load(selections, level=level)
+
+    def load_roi(self, y, x, z=None, c=None, t=None, mmap_mode=None, level=0):
+        """Retrieves the image data within a region of interest
+
+        Only the tiles intersecting the region are decoded if the planes are tiled.
+        The region is clipped to the image, so the returned array has min(end, size) - max(begin, 0)
+        rows and columns, or none if the region is outside the image, like in CziReader.load_roi().
 
+        :param y: The (begin, end) range of rows
+        :param x: The (begin, end) range of columns
+        :param z: The z index or (begin, end) range of z slices, None for all
+        :param c: The channel or (begin, end) range of channels, None for all
+        :param t: The time index or (begin, end) range of time points, None for all
+        :param mmap_mode: If 'r' or 'c', uncompressed pages are read from the memory-mapped file
+        :param level: The pyramid level, 0 is full resolution. y and x are coordinates of the level.
         :return: 5D array with dimensions TZCYX.
         """
-        data = self.tif.asarray()
-        # if data is 3d, then assume it is ZYX and convert to TZCYX
-        if len(data.shape) == 3:
-            data = np.expand_dims(data, axis=1)
-            data = np.expand_dims(data, axis=0)
-        # if data is 4d, then assume it is ZCYX and convert to TZCYX
-        elif len(data.shape) == 4:
-            data = np.expand_dims(data, axis=0)
+        selections = [self._selection(key if key is None or isinstance(key, numbers.Integral) else slice(*key), size)
+                      for key, size in zip((t, z, c), self.plane_index.shape)]
+        return self._load(selections, y, x, mmap_mode=mmap_mode, level=level)
+
+    def _load(self, selections, y=None, x=None, mmap_mode=None, level=0):
+        """Reads the YX region of the planes selected along T, Z and C into a TZCYX array"""
+        ifds = self.plane_index[np.ix_(*selections)]
+        size_y, size_x = self._page(0, level).shape[-2:]
+        y = (0, size_y) if y is None else (max(0, y[0]), min(size_y, y[1]))
+        x = (0, size_x) if x is None else (max(0, x[0]), min(size_x, x[1]))
+        data = np.zeros(ifds.shape + (max(0, y[1] - y[0]), max(0, x[1] - x[0])), dtype=self.dtype())
+        if not data.size:
+            return data
+        planes = data.reshape((-1,) + data.shape[3:])
+        # read the pages in file order
+        for i in np.argsort(ifds, axis=None, kind="mergesort"):
+            ifd = int(ifds.flat[i])
+            if ifd >= 0:
+                planes[i] = self._read_page_region(ifd, y, x, mmap_mode, level)
         return data
 
-    def load_slice(self, z=0, c=0, t=0):
+    def load_slice(self, z=0, c=0, t=0, level=0):
         """Retrieves the 2D YX slice from the image
 
         :param z: The z index that will be accessed
         :param c: The channel that will be accessed
         :param t: The time index that will be accessed
+        :param level: The pyramid level, 0 is full resolution, see pyramid_levels()
         :return: 2D array with dimensions YX
         """
-        index = c + (self.size_c() * z) + (self.size_c() * self.size_z() * t)
-        data = self.tif.asarray(key=index)
+        data = self._page(self._get_ifd(t, z, c), level).asarray()
         return data
 
+    def pyramid_levels(self):
+        """Returns the downsampling factors of the pyramid levels in the file, starting with 1 for full resolution"""
+        page = self.tif.pages[0]
+        count = page.tags['sub_ifds'].count if 'sub_ifds' in page.tags else 0
+        return [1] + [int(round(float(page.image_width) / self._page(0, level).image_width))
+                      for level in range(1, count + 1)]
+
+    def _page(self, ifd, level=0):
+        """Returns the TiffPage of a pyramid level of a page, level 0 being the page itself"""
+        page = self.tif.pages[ifd]
+        if not level:
+            return page
+        if (ifd, level) not in self._level_pages:
+            tag = page.tags['sub_ifds'] if 'sub_ifds' in page.tags else None
+            if tag is None or not 0 < level <= tag.count:
+                raise ValueError("Page {} of {} has no pyramid level {}".format(ifd, self.file_path, level))
+            if struct.calcsize(tag.dtype[-1]) != self.tif.offset_size:
+                raise ValueError("Unsupported SubIFDs type in {}".format(self.file_path))
+            # tifffile reads the offset of the directory at the file position, which is in the SubIFDs values
+            self.tif.filehandle.seek(tag.value_offset + (level - 1) * self.tif.offset_size)
+            self._level_pages[ifd, level] = TiffPage(self.tif)
+        return self._level_pages[ifd, level]
+
+    def lazy(self, mmap_mode="r", level=0):
+        """Returns a lazy, ndarray-like view of the image with dimensions TZCYX.
+
+        Indexing the view only reads the pages holding the requested planes.
+
+        :param mmap_mode: If 'r' (read-only) or 'c' (copy-on-write), uncompressed pages are read from the
+                          memory-mapped file, and single planes are returned as views of it.
+                          If None, every page is read through tifffile.
+        :param level: The pyramid level, 0 is full resolution, see pyramid_levels()
+        :return: OmeTifLazyArray
+        """
+        return OmeTifLazyArray(self, mmap_mode=mmap_mode, level=level)
+
+    def _read_page(self, ifd, mmap_mode=None, level=0):
+        """Returns the YX array of a page, as a view of the memory-mapped file if possible"""
+        page = self._page(ifd, level)
+        contiguous = page.is_contiguous if mmap_mode else None
+        if contiguous and len(page.shape) == 2:
+            if self._mmap is None or self._mmap.mode != mmap_mode:
+                self._mmap = np.memmap(self.file_path, dtype=np.uint8, mode=mmap_mode)
+            offset, size = contiguous
+            dtype = np.dtype(page.dtype).newbyteorder(self.tif.byteorder)
+            return self._mmap[offset:offset + size].view(dtype).reshape(page.shape)
+        return page.asarray()
+
+    def _read_page_region(self, ifd, y, x, mmap_mode=None, level=0):
+        """Returns the [y[0]:y[1], x[0]:x[1]] region of a page, decoding only the tiles it intersects"""
+        page = self._page(ifd, level)
+        if not page.is_tiled or len(page.shape) != 2:
+            return self._read_page(ifd, mmap_mode, level)[y[0]:y[1], x[0]:x[1]]
+
+        length, width = page.tile_length, page.tile_width
+        columns = -(-page.image_width // width)
+        offsets = np.atleast_1d(page.tile_offsets)
+        byte_counts = np.atleast_1d(page.tile_byte_counts)
+        out = np.empty((y[1] - y[0], x[1] - x[0]), dtype=np.dtype(page.dtype))
+        for row in range(y[0] // length, -(-y[1] // length)):
+            for column in range(x[0] // width, -(-x[1] // width)):
+                index = row * columns + column
+                tile = self._read_tile(page, int(offsets[index]), int(byte_counts[index]), mmap_mode)
+                # the intersection of the tile and the region, in page coordinates
+                y0, y1 = max(y[0], row * length), min(y[1], (row + 1) * length)
+                x0, x1 = max(x[0], column * width), min(x[1], (column + 1) * width)
+                out[y0 - y[0]:y1 - y[0], x0 - x[0]:x1 - x[0]] = \
+                    tile[y0 - row * length:y1 - row * length, x0 - column * width:x1 - column * width]
+        return out
+
+    def _read_tile(self, page, offset, byte_count, mmap_mode=None):
+        """Reads and decodes a single tile of a grayscale page"""
+        if mmap_mode:
+            if self._mmap is None or self._mmap.mode != mmap_mode:
+                self._mmap = np.memmap(self.file_path, dtype=np.uint8, mode=mmap_mode)
+            data = self._mmap[offset:offset + byte_count]
+        else:
+            fh = self.tif.filehandle
+            fh.seek(offset)
+            data = fh.read(byte_count)
+        dtype = np.dtype(page.dtype).newbyteorder(self.tif.byteorder)
+        shape = (page.tile_length, page.tile_width)
+        if page.compression == 'lzw':
+            tile = czifile.decode_lzw_array(bytes(data), dtype, shape)
+        elif page.compression in TIFF_DECOMPESSORS:
+            tile = np.frombuffer(TIFF_DECOMPESSORS[page.compression](data), dtype, shape[0] * shape[1]).reshape(shape)
+        else:
+            raise ValueError("Cannot decompress {} tiles of {}".format(page.compression, self.file_path))
+        if page.predictor == 'horizontal':
+            tile = np.cumsum(tile, axis=1, dtype=dtype)
+        elif page.predictor:
+            raise ValueError("Cannot decode {} predictor tiles of {}".format(page.predictor, self.file_path))
+        return tile
+
     def get_metadata(self):
         return self.omeMetadata
 
@@ -108,3 +355,35 @@ class OmeTifReader:
         :return: True if file is OMETiff, False otherwise.
         """
         return self.file_path[-7:] == 'ome.tif' or self.file_path[-8:] == 'ome.tiff'
+
+
+class OmeTifLazyArray(LazyArray):
+    """A LazyArray over the TZCYX image in an OME-TIFF file, see OmeTifReader.lazy()
+
+    Planes that are not stored in the file read as zeros.
+    """
+
+    def __init__(self, reader, mmap_mode="r", level=0):
+        """
+        :param reader: The open OmeTifReader to read from
+        :param mmap_mode: None, 'r' or 'c', see OmeTifReader.lazy()
+        :param level: The pyramid level, 0 is full resolution
+        """
+        self.reader = reader
+        self.mmap_mode = mmap_mode
+        self.level = level
+        page = reader._page(0, level)
+        shape = reader.plane_index.shape + tuple(page.shape[-2:])
+        chunks = None
+        if page.is_tiled:
+            # chunks along Y and X follow the tiles of the first page
+            chunks = tuple((1,) * size for size in shape[:3])
+            for size, tile in zip(shape[3:], (page.tile_length, page.tile_width)):
+                chunks += ((tile,) * (size // tile) + ((size % tile,) if size % tile else ()),)
+        super(OmeTifLazyArray, self).__init__(shape, reader.dtype(), chunks)
+
+    def _read_plane(self, t, z, c, y, x):
+        ifd = int(self.reader.plane_index[t, z, c])
+        if ifd < 0:
+            return np.zeros((y[1] - y[0], x[1] - x[0]), dtype=self.dtype)
+        return self.reader._read_page_region(ifd, y, x, self.mmap_mode, self.level)
@@ -2,9 +2,9 @@ from __future__ import print_function
 
 import numpy as np
 import os
-import tifffile
 
 from . import omexml
+from .tifWriter import TifWriter, estimate_size
 
 
 class OmeTifWriter:
@@ -27,9 +27,39 @@ class OmeTifWriter:
         writer = omeTifWriter.OmeTifWriter("file3.ome.tif")
         writer.save(reader.load())
 
+        # Write an image larger than memory plane by plane, in TZC order.
+        with omeTifWriter.OmeTifWriter("file4.ome.tif") as writer:
+            writer.begin((100, 70, 3, 1024, 1024), numpy.uint16, channel_names=["DNA", "Membrane", "Bright"])
+            for t in range(100):
+                writer.save_stack(process(reader.lazy()[t]))
+
+    begin() takes the final shape and metadata up front. save_slice() then appends a single YX plane,
+    and save_stack() appends all ZCYX planes of a time point, each page being written to the file as it arrives.
+    The OME-XML is finalized when the writer is closed. Planes that were never written read as zeros,
+    and a file without any written plane is removed.
+    save() writes a whole array in one call through the same path.
+
+    The compression of the pages is set when the writer is created. The default, deflate at level 9,
+    gives small files but is slow; level 1 is several times faster, and the horizontal predictor
+    usually makes 16-bit microscopy images noticeably smaller at any level:
+        writer = omeTifWriter.OmeTifWriter("file5.ome.tif", compression_level=1, predictor=True, max_workers=8)
+    See benchmarks/omeTifCompression.py for a comparison of the settings.
+
+    With tile_size, planes are written as tiles instead of a single strip, so OmeTifReader.load_roi()
+    and lazy views only decode the tiles covering a region of a large plane:
+        writer = omeTifWriter.OmeTifWriter("mosaic.ome.tif", tile_size=256)
+
+    With pyramid_levels, each plane also gets downsampled copies as reduced resolution SubIFDs, each level
+    binned by 2 from the previous one while the plane is written. Previews can then be read from a small level
+    with OmeTifReader.load(level=n) or AICSImage(path, level=n):
+        writer = omeTifWriter.OmeTifWriter("mosaic.ome.tif", tile_size=256, pyramid_levels=4)
+
+    Files that may exceed the 4 GB limit of classic TIFF are written as BigTIFF. begin() and save() estimate the
+    uncompressed size of the output from the declared shape, and the bigtiff argument overrides the choice.
     """
 
-    def __init__(self, file_path, overwrite_file=None):
+    def __init__(self, file_path, overwrite_file=None, compression="deflate", compression_level=9, predictor=False,
+                 tile_size=None, pyramid_levels=0, pyramid_downsample="mean", max_workers=None, bigtiff=None):
         """
         Class initializer
         :param file_path: path to image output location
@@ -37,10 +67,29 @@ class OmeTifWriter:
             None : (default) throw IOError if file exists
             True : overwrite existing file if file exists
             False: silently perform no write actions if file exists
+        :param compression: The compression of the pages: None (or "none"), "deflate" (zlib) or "lzw".
+                            LZW requires the imagecodecs package.
+        :param compression_level: The deflate compression level from 1 (fastest) to 9 (smallest)
+        :param predictor: Apply the horizontal differencing predictor before compression. Only valid for integer data.
+        :param tile_size: The size of the tiles as an int or a (y, x) pair of multiples of 16, None writes untiled planes
+        :param pyramid_levels: The number of reduced resolution levels written with each plane
+        :param pyramid_downsample: How the levels are binned: "mean" averages 2x2 blocks, "nearest" takes every second pixel
+        :param max_workers: The number of threads used to compress planes, None compresses them sequentially
+        :param bigtiff: Write a BigTIFF file if True, a classic TIFF file if False, which fails beyond 4 GB.
+                        None (default) writes BigTIFF if the uncompressed image could exceed 4 GB.
         """
         self.file_path = file_path
         self.omeMetadata = omexml.OMEXML()
         self.silent_pass = False
+        self.bigtiff = bigtiff
+        self._tif = None
+        self._shape = None
+        self._dtype = None
+        if tile_size is not None and np.ndim(tile_size) == 0:
+            tile_size = (tile_size, tile_size)
+        self._tif_options = dict(compression=compression, level=compression_level, predictor=predictor,
+                                 tile=tile_size, pyramid_levels=pyramid_levels, downsample=pyramid_downsample,
+                                 max_workers=max_workers)
         if os.path.isfile(self.file_path):
             if overwrite_file:
                 os.remove(self.file_path)
@@ -56,12 +105,52 @@ class OmeTifWriter:
         self.close()
 
     def close(self):
-        pass
+        """Finalizes the OME-XML of an image written with begin() and closes the file
 
-    def save(self, data, omexml=None, channel_names=None, image_name="IMAGE0", pixels_physical_size=None, channel_colors=None):
-        """Save an image with the proper OME xml metadata.
+        If begin() was called but no plane was written, the file holds no image and is removed.
+        """
+        if self._tif is None:
+            return
+        if not self._tif.page_count:
+            # nothing was written, so there is no page to hold the OME-XML and no reader could open the file
+            self._tif.close()
+            self._tif = None
+            os.remove(self.file_path)
+            return
+        try:
+            # drop the TiffData of planes that were never written, and shorten the run that was cut off
+            pixels = self.omeMetadata.image().Pixels
+            page_count = self._tif.page_count
+            for tiffdata in pixels.TiffDatas():
+                if tiffdata.IFD >= page_count:
+                    pixels.node.remove(tiffdata.node)
+                elif tiffdata.IFD + tiffdata.PlaneCount > page_count:
+                    tiffdata.PlaneCount = page_count - tiffdata.IFD
+            self._tif.set_description(self.omeMetadata.to_xml())
+        finally:
+            self._tif.close()
+            self._tif = None
+
+    @staticmethod
+    def _as_tzcyx_shape(shape):
+        """Expands a ZYX or ZCYX shape to TZCYX"""
+        shape = tuple(int(i) for i in shape)
+        assert (len(shape) == 5 or len(shape) == 4 or len(shape) == 3)
+        # if this is 3d data, then assume it's ZYX and transform it to the expected TZCYX
+        if len(shape) == 3:
+            shape = (1, shape[0], 1) + shape[1:]
+        # if this is 4d data, then assume it's ZCYX and transform it to the expected TZCYX
+        elif len(shape) == 4:
+            shape = (1,) + shape
+        return shape
 
-        :param data: An array of dimensions TZCYX, ZCYX, or ZYX to be written out to a file.
+    def begin(self, shape, dtype, omexml=None, channel_names=None, image_name="IMAGE0", pixels_physical_size=None,
+              channel_colors=None):
+        """Starts writing an image incrementally with save_slice() or save_stack().
+
+        :param shape: The final shape of the image: TZCYX, ZCYX, or ZYX
+        :param dtype: The numpy dtype of the image
+        :param omexml: OME metadata to use instead of generating it from the other arguments
         :param channel_names: The names for each channel to be put into the OME metadata
         :param image_name: The name of the image to be put into the OME metadata
         :param pixels_physical_size: The physical size of each pixel in the image
@@ -69,60 +158,98 @@ class OmeTifWriter:
         """
         if self.silent_pass:
             return
+        if self._tif is not None:
+            raise ValueError("An image is already being written to {}".format(self.file_path))
 
-        tif = tifffile.TiffWriter(self.file_path)
-
-        shape = data.shape
-        assert (len(shape) == 5 or len(shape) == 4 or len(shape) == 3)
-
-        # if this is 3d data, then assume it's ZYX and transform it to the expected TZCYX
-        if len(shape) == 3:
-            data = np.expand_dims(data, axis=1)
-            data = np.expand_dims(data, axis=0)
-        # if this is 4d data, then assume it's ZCYX and transform it to the expected TZCYX
-        elif len(shape) == 4:
-            data = np.expand_dims(data, axis=0)
-
+        self._shape = self._as_tzcyx_shape(shape)
+        self._dtype = np.dtype(dtype)
+        if self._tif_options["predictor"] and self._dtype.kind not in "ui":
+            raise ValueError("The predictor requires integer data, got {}".format(self._dtype))
         if omexml is None:
-            self._make_meta(data, channel_names=channel_names, image_name=image_name,
+            self._make_meta(self._shape, self._dtype, channel_names=channel_names, image_name=image_name,
                             pixels_physical_size=pixels_physical_size, channel_colors=channel_colors)
         else:
             pixels = omexml.image().Pixels
-            pixels.populate_TiffData()
+            pixels.populate_TiffData(compact=True)
             self.omeMetadata = omexml
-        xml = self.omeMetadata.to_xml()
+        bigtiff = self.bigtiff
+        if bigtiff is None:
+            options = self._tif_options
+            size = estimate_size(self._shape[3:], self._dtype, page_count=int(np.prod(self._shape[:3])),
+                                 tile=options["tile"], pyramid_levels=options["pyramid_levels"])
+            bigtiff = size >= 2**32
+        self._tif = TifWriter(self.file_path, bigtiff=bigtiff, **self._tif_options)
+
+    def _next_plane(self):
+        """Returns the (t, z, c) index of the next plane to be written, in TZC order"""
+        size_t, size_z, size_c = self._shape[:3]
+        index = self._tif.page_count
+        if index >= size_t * size_z * size_c:
+            raise ValueError("All {} planes of the image have been written".format(size_t * size_z * size_c))
+        return index // (size_z * size_c), index // size_c % size_z, index % size_c
 
-        # check data shape for TZCYX or ZCYX or ZYX
-        dims = len(shape)
-        if dims == 5 or dims == 4 or dims == 3:
-            # minisblack instructs TiffWriter to not try to infer rgb color within the data array
-            # metadata param fixes the double image description bug
-            tif.save(data, compress=9, description=xml, photometric='minisblack', metadata=None)
+    def save(self, data, omexml=None, channel_names=None, image_name="IMAGE0", pixels_physical_size=None, channel_colors=None):
+        """Save an image with the proper OME xml metadata.
 
-        tif.close()
+        :param data: An array of dimensions TZCYX, ZCYX, or ZYX to be written out to a file.
+        :param channel_names: The names for each channel to be put into the OME metadata
+        :param image_name: The name of the image to be put into the OME metadata
+        :param pixels_physical_size: The physical size of each pixel in the image
+        :param channel_colors: The channel colors to be put into the OME metadata
+        """
+        if self.silent_pass:
+            return
 
-    def save_slice(self, data, z=0, c=0, t=0):
-        """ this doesn't do the necessary functionality at this point
+        self.begin(data.shape, data.dtype, omexml=omexml, channel_names=channel_names, image_name=image_name,
+                   pixels_physical_size=pixels_physical_size, channel_colors=channel_colors)
+        try:
+            data = data.reshape(self._shape)
+            for t in range(self._shape[0]):
+                self.save_stack(data[t])
+        finally:
+            self.close()
 
-        TODO:
-            * make this insert a YX slice in between two other slices inside a full image
-            * data should be a 5 dim array
+    def save_stack(self, data):
+        """Appends all planes of the next time point of an image started with begin().
 
-        :param data:
-        :param z:
-        :param c:
-        :param t:
-        :return:
+        :param data: An array of dimensions ZCYX, or ZYX if the image has a single channel
         """
         if self.silent_pass:
             return
+        if self._tif is None:
+            raise ValueError("begin() must be called before save_stack()")
+        if self._tif.page_count % (self._shape[1] * self._shape[2]):
+            raise ValueError("save_stack() can only be called at the start of a time point")
+
+        data = data.reshape(self._shape[1:])
+        for z in range(self._shape[1]):
+            for c in range(self._shape[2]):
+                self.save_slice(data[z, c])
+
+    def save_slice(self, data, z=None, c=None, t=None):
+        """Appends the next YX plane of an image started with begin().
+
+        Planes are written in TZC order, with the channel varying fastest.
+
+        :param data: A 2D array with dimensions YX
+        :param z: The z index of the plane. If given, it is checked against the next plane to be written.
+        :param c: The channel of the plane, like z
+        :param t: The time index of the plane, like z
+        """
+        if self.silent_pass:
+            return
+        if self._tif is None:
+            raise ValueError("begin() must be called before save_slice()")
 
         assert len(data.shape) == 2
         assert data.shape[0] == self.size_y()
         assert data.shape[1] == self.size_x()
-        tif = tifffile.TiffWriter(self.file_path)
-        tif.save(data, compress=9)
-        tif.close()
+        expected = self._next_plane()
+        for index, value in zip(expected, (t, z, c)):
+            if value is not None and value != index:
+                raise ValueError("Planes must be written in TZC order, the next plane is t={}, z={}, c={}".format(
+                                 *expected))
+        self._tif.write_page(data.astype(self._dtype, copy=False))
 
     def set_metadata(self, ome_metadata):
         self.omeMetadata = ome_metadata
@@ -143,10 +270,12 @@ class OmeTifWriter:
         return self.omeMetadata.image().Pixels.SizeY
 
     # set up some sensible defaults from provided info
-    def _make_meta(self, data, channel_names=None, image_name="IMAGE0", pixels_physical_size=None, channel_colors=None):
+    def _make_meta(self, shape, dtype, channel_names=None, image_name="IMAGE0", pixels_physical_size=None,
+                   channel_colors=None):
         """Creates the necessary metadata for an OME tiff image
 
-        :param data: An array of dimensions TZCYX, ZCYX, or ZYX to be written out to a file.
+        :param shape: The shape of the image, TZCYX, ZCYX, or ZYX
+        :param dtype: The numpy dtype of the image
         :param channel_names: The names for each channel to be put into the OME metadata
         :param image_name: The name of the image to be put into the OME metadata
         :param pixels_physical_size: The physical size of each pixel in the image
@@ -163,7 +292,6 @@ class OmeTifWriter:
             pixels.set_PhysicalSizeX(pixels_physical_size[0])
             pixels.set_PhysicalSizeY(pixels_physical_size[1])
             pixels.set_PhysicalSizeZ(pixels_physical_size[2])
-        shape = data.shape
         if len(shape) == 5:
             pixels.channel_count = shape[2]
             pixels.set_SizeT(shape[0])
@@ -188,7 +316,7 @@ class OmeTifWriter:
 
         # this must be set to the *reverse* of what dimensionality the ome tif file is saved as
         pixels.set_DimensionOrder('XYCZT')
-        pixels.set_PixelType(data.dtype.name)
+        pixels.set_PixelType(np.dtype(dtype).name)
 
         if channel_names is None:
             for i in range(pixels.SizeC):
@@ -209,7 +337,7 @@ class OmeTifWriter:
         for i in range(pixels.SizeC):
             pixels.Channel(i).set_SamplesPerPixel(1)
 
-        # many assumptions in here: one file per image, one plane per tiffdata, etc.
-        pixels.populate_TiffData()
+        # many assumptions in here: one file per image, planes stored in TZC order, etc.
+        pixels.populate_TiffData(compact=True)
 
         return ox
@@ -233,8 +233,10 @@ def split_qn(qn):
 def get_namespaces(node):
     '''Get top-level XML namespaces from a node.'''
     ns_lib = {'ome': None, 'sa': None, 'spw': None}
-    for child in node.iter():
-        ns = split_qn(child.tag)[0]
+    # documents repeat a handful of tags many times, e.g. one TiffData and Plane per image plane
+    tags = set(child.tag for child in node.iter())
+    for tag in tags:
+        ns = split_qn(tag)[0]
         match = re.match(NS_RE, ns)
         if match:
             ns_key = match.group('ns_key').lower()
@@ -508,11 +510,12 @@ class OMEXML(object):
         <TiffData FirstC="0" FirstT="0" FirstZ="0" IFD="0" PlaneCount="1">
             <UUID FileName="img40_1.ome.tif">urn:uuid:ef8af211-b6c1-44d4-97de-daca46f16346</UUID>
         </TiffData>
-        For our purposes, there will be one TiffData per 2-dimensional image plane.
+        A TiffData describes PlaneCount planes, starting at IFD in the tiff file and at FirstT/FirstZ/FirstC
+        in the DimensionOrder of the Pixels element.
         '''
-        def __init__(self, node):
+        def __init__(self, node, ns=None):
             self.node = node
-            self.ns = get_namespaces(self.node)
+            self.ns = get_namespaces(self.node) if ns is None else ns
 
         def get_FirstZ(self):
             '''The Z index of the plane'''
@@ -551,7 +554,7 @@ class OMEXML(object):
         IFD = property(get_IFD, set_IFD)
 
         def get_PlaneCount(self):
-            '''How many planes in this TiffData. Should always be 1'''
+            '''How many planes in this TiffData, 1 unless written by populate_TiffData(compact=True)'''
             return get_int_attr(self.node, "PlaneCount")
 
         def set_PlaneCount(self, value):
@@ -559,6 +562,20 @@ class OMEXML(object):
 
         PlaneCount = property(get_PlaneCount, set_PlaneCount)
 
+        def get_FileName(self):
+            '''The file holding the planes, or None if they are in the file containing the OME-XML'''
+            uuid_node = self.node.find(qn(self.ns['ome'], "UUID"))
+            return None if uuid_node is None else uuid_node.get("FileName")
+
+        FileName = property(get_FileName)
+
+        def get_UUID(self):
+            '''The UUID of the file holding the planes, or None if they are in the file containing the OME-XML'''
+            uuid_node = self.node.find(qn(self.ns['ome'], "UUID"))
+            return None if uuid_node is None or not uuid_node.text else uuid_node.text.strip()
+
+        UUID = property(get_UUID)
+
     class Plane(object):
         '''The OME/Image/Pixels/Plane element
 
@@ -818,6 +835,16 @@ class OMEXML(object):
             tiffData = self.node.findall(qn(self.ns['ome'], "TiffData"))[index]
             return OMEXML.TiffData(tiffData)
 
+        def get_tiffdata_count(self):
+            '''The number of TiffData elements in the Pixels element'''
+            return len(self.node.findall(qn(self.ns['ome'], "TiffData")))
+
+        tiffdata_count = property(get_tiffdata_count)
+
+        def TiffDatas(self):
+            '''Get all TiffData elements of the Pixels element, in document order'''
+            return [OMEXML.TiffData(node, self.ns) for node in self.node.findall(qn(self.ns['ome'], "TiffData"))]
+
         def get_planes_of_channel(self, index):
             planes = self.node.findall(qn(self.ns['ome'], "Plane[@TheC='"+str(index)+"']"))
             return planes
@@ -849,8 +876,14 @@ class OMEXML(object):
             self.set_SizeC(self.get_SizeC() + 1)
 
         # can be done as a single step just prior to final output
-        def populate_TiffData(self):
-            ''' assuming Pixels has its sizes, set up tiffdata elements'''
+        def populate_TiffData(self, compact=False):
+            ''' assuming Pixels has its sizes, set up tiffdata elements
+
+            The planes are assumed to be stored in the tiff file with C varying fastest, then Z, then T.
+            compact - describe each run of planes that are consecutive both in the DimensionOrder and in the
+                      file with a single TiffData and its PlaneCount, instead of one TiffData per plane.
+                      When the DimensionOrder is XYCZT, the whole image is a single TiffData.
+            '''
             assert self.SizeC is not None
             assert self.SizeZ is not None
             assert self.SizeT is not None
@@ -860,6 +893,10 @@ class OMEXML(object):
             for td in tiffdatas:
                 self.node.remove(td)
 
+            if compact:
+                self._populate_compact_TiffData()
+                return
+
             # assumes xyczt
             ifd = 0
             for i in range(self.SizeT):
@@ -879,6 +916,39 @@ class OMEXML(object):
                         # uuidelem.text = self.ome_uuid
                         ifd = ifd + 1
 
+        def _populate_compact_TiffData(self):
+            '''Add one TiffData per run of planes that follow each other in both the DimensionOrder and the file'''
+            sizes = {"T": self.SizeT, "Z": self.SizeZ, "C": self.SizeC}
+            # the planes are stored with C varying fastest, then Z, then T
+            strides = {"T": self.SizeZ * self.SizeC, "Z": self.SizeC, "C": 1}
+            # the DimensionOrder lists the fastest varying dimension first
+            order = (self.DimensionOrder or DO_XYZCT)[2:]
+            fast, middle, slow = order
+
+            runs = []
+            for i in range(sizes[slow]):
+                for j in range(sizes[middle]):
+                    first = {slow: i, middle: j, fast: 0}
+                    ifd = sum(first[dim] * strides[dim] for dim in first)
+                    if strides[fast] == 1:
+                        # the whole row along the fastest dimension is contiguous in the file
+                        row = [(first, ifd, sizes[fast])]
+                    else:
+                        row = [(dict(first, **{fast: k}), ifd + k * strides[fast], 1) for k in range(sizes[fast])]
+                    for plane_first, plane_ifd, count in row:
+                        if runs and runs[-1][1] + runs[-1][2] == plane_ifd:
+                            runs[-1][2] += count
+                        else:
+                            runs.append([plane_first, plane_ifd, count])
+
+            for first, ifd, count in runs:
+                new_tiffdata = OMEXML.TiffData(ElementTree.SubElement(self.node, qn(self.ns['ome'], "TiffData")))
+                new_tiffdata.set_FirstC(first["C"])
+                new_tiffdata.set_FirstZ(first["Z"])
+                new_tiffdata.set_FirstT(first["T"])
+                new_tiffdata.set_IFD(ifd)
+                new_tiffdata.set_PlaneCount(count)
+
     class StructuredAnnotations(dict):
         '''The OME/StructuredAnnotations element
 
@@ -0,0 +1,215 @@
+import collections
+import os
+import threading
+
+try:
+    from urllib.request import Request, urlopen
+except ImportError:
+    from urllib2 import Request, urlopen
+
+
+class RangeFile(object):
+    """This class is a read-only, seekable binary file over a function that reads byte ranges
+
+    Reads are served from an LRU cache of fixed size blocks, so the many small header and directory
+    reads of a CZI file become a few block sized range requests. Missing blocks that are adjacent
+    are fetched with a single request.
+
+    Example:
+        # any function returning the bytes [offset, offset + size) of the data works
+        def read_range(offset, size):
+            return gateway.get_object(bucket, key, Range="bytes={}-{}".format(offset, offset + size - 1))
+
+        source = rangeFile.RangeFile(read_range, size=object_size, cache_size=64 * 2**20)
+        reader = cziReader.CziReader(source)
+
+        # seekable file-like objects and HTTP servers supporting range requests are wrapped similarly
+        source = rangeFile.RangeFile.from_fileobj(open("file.czi", "rb"))
+        source = rangeFile.RangeFile.from_url("http://host/file.czi")
+
+    The read_at() function reads without changing the file position and can be called from several threads.
+    CziFile uses it for its positional reads, so concurrent plane reads fetch ranges in parallel.
+    """
+
+    def __init__(self, read_range, size, name=None, block_size=2**18, cache_size=2**26):
+        """
+        :param read_range: Function called as read_range(offset, size), returning the bytes of the range.
+                           It must be safe to call from several threads if the file is read concurrently.
+        :param size: The size of the data in bytes
+        :param name: The name of the data, e.g. a file name or URL
+        :param block_size: The size of the cached blocks in bytes
+        :param cache_size: The maximum number of bytes held in the cache. Reads larger than half
+                           the cache bypass it.
+        """
+        if block_size < 1:
+            raise ValueError("block_size must be positive")
+        self._read_range = read_range
+        self.size = int(size)
+        self.name = name if name is not None else "Unnamed range source"
+        self.mode = "rb"
+        self.block_size = int(block_size)
+        self.cache_size = int(cache_size)
+        self.closed = False
+        self.requests = 0
+        self.hits = 0
+        self.misses = 0
+        self._blocks = collections.OrderedDict()
+        self._cached_bytes = 0
+        self._lock = threading.Lock()
+        self._pos = 0
+
+    @classmethod
+    def from_fileobj(cls, fileobj, **kwargs):
+        """Returns a RangeFile reading from a seekable binary file-like object
+
+        :param fileobj: The open file-like object, which is accessed under a lock
+        :param kwargs: Passed to RangeFile, e.g. block_size and cache_size
+        """
+        lock = threading.Lock()
+
+        def read_range(offset, size):
+            with lock:
+                fileobj.seek(offset)
+                return fileobj.read(size)
+
+        with lock:
+            fileobj.seek(0, os.SEEK_END)
+            size = fileobj.tell()
+        kwargs.setdefault("name", getattr(fileobj, "name", None))
+        return cls(read_range, size, **kwargs)
+
+    @classmethod
+    def from_url(cls, url, headers=None, size=None, **kwargs):
+        """Returns a RangeFile reading from a URL with HTTP range requests
+
+        :param url: The URL of the data. The server must support range requests.
+        :param headers: Additional HTTP headers sent with every request, e.g. for authorization
+        :param size: The size of the data in bytes, if known. Else it is requested with a HEAD request.
+        :param kwargs: Passed to RangeFile, e.g. block_size and cache_size
+        """
+        headers = dict(headers or {})
+
+        def read_range(offset, size):
+            request = Request(url, headers=dict(headers, Range="bytes={}-{}".format(offset, offset + size - 1)))
+            response = urlopen(request)
+            try:
+                if response.getcode() != 206:
+                    raise IOError("{} does not support range requests".format(url))
+                return response.read()
+            finally:
+                response.close()
+
+        if size is None:
+            request = Request(url, headers=headers)
+            request.get_method = lambda: "HEAD"
+            response = urlopen(request)
+            try:
+                size = int(response.info().get("Content-Length"))
+            finally:
+                response.close()
+        kwargs.setdefault("name", url)
+        return cls(read_range, size, **kwargs)
+
+    def read_at(self, offset, size=-1):
+        """Returns up to size bytes at offset, without changing the file position"""
+        if self.closed:
+            raise ValueError("I/O operation on closed file")
+        if offset < 0:
+            raise ValueError("negative offset")
+        end = self.size if size < 0 else min(offset + size, self.size)
+        if end <= offset:
+            return b""
+        if end - offset > self.cache_size // 2:
+            with self._lock:
+                self.requests += 1
+            return self._read_range(offset, end - offset)
+
+        first, last = offset // self.block_size, (end - 1) // self.block_size
+        blocks = {}
+        missing = []
+        with self._lock:
+            for index in range(first, last + 1):
+                block = self._blocks.pop(index, None)
+                if block is None:
+                    missing.append(index)
+                else:
+                    # reinsert to mark the block as most recently used
+                    self._blocks[index] = blocks[index] = block
+            self.hits += last + 1 - first - len(missing)
+            self.misses += len(missing)
+
+        # fetch runs of adjacent missing blocks with single requests
+        runs = []
+        for index in missing:
+            if runs and runs[-1][1] == index:
+                runs[-1][1] = index + 1
+            else:
+                runs.append([index, index + 1])
+        for begin, stop in runs:
+            data = self._read_range(begin * self.block_size, min(stop * self.block_size, self.size) -
+                                    begin * self.block_size)
+            with self._lock:
+                self.requests += 1
+                for index in range(begin, stop):
+                    block = data[(index - begin) * self.block_size:(index + 1 - begin) * self.block_size]
+                    blocks[index] = block
+                    self._store(index, block)
+
+        data = b"".join(blocks[index] for index in range(first, last + 1))
+        start = offset - first * self.block_size
+        return data[start:start + end - offset]
+
+    def _store(self, index, block):
+        if index in self._blocks:
+            self._cached_bytes -= len(self._blocks.pop(index))
+        self._blocks[index] = block
+        self._cached_bytes += len(block)
+        while self._cached_bytes > self.cache_size and self._blocks:
+            self._cached_bytes -= len(self._blocks.popitem(last=False)[1])
+
+    def clear_cache(self):
+        with self._lock:
+            self._blocks.clear()
+            self._cached_bytes = 0
+
+    def read(self, size=-1):
+        data = self.read_at(self._pos, size)
+        self._pos += len(data)
+        return data
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_SET:
+            self._pos = offset
+        elif whence == os.SEEK_CUR:
+            self._pos += offset
+        elif whence == os.SEEK_END:
+            self._pos = self.size + offset
+        else:
+            raise ValueError("invalid whence {}".format(whence))
+        return self._pos
+
+    def tell(self):
+        return self._pos
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def writable(self):
+        return False
+
+    def close(self):
+        self.closed = True
+        self.clear_cache()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __repr__(self):
+        return "<RangeFile {} size={} block_size={} cache_size={}>".format(
+            self.name, self.size, self.block_size, self.cache_size)
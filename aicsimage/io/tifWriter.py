@@ -0,0 +1,435 @@
+import collections
+import struct
+import zlib
+from multiprocessing.pool import ThreadPool
+
+import numpy as np
+
+try:
+    from imagecodecs import lzw_encode as _lzw_encode
+except ImportError:
+    _lzw_encode = None
+
+# TIFF tag codes
+NEW_SUBFILE_TYPE = 254
+IMAGE_WIDTH = 256
+IMAGE_LENGTH = 257
+BITS_PER_SAMPLE = 258
+COMPRESSION = 259
+PHOTOMETRIC = 262
+IMAGE_DESCRIPTION = 270
+STRIP_OFFSETS = 273
+SAMPLES_PER_PIXEL = 277
+ROWS_PER_STRIP = 278
+STRIP_BYTE_COUNTS = 279
+PLANAR_CONFIGURATION = 284
+SOFTWARE = 305
+PREDICTOR = 317
+TILE_WIDTH = 322
+TILE_LENGTH = 323
+TILE_OFFSETS = 324
+TILE_BYTE_COUNTS = 325
+SUB_IFDS = 330
+SAMPLE_FORMAT = 339
+
+# TIFF field types
+ASCII = 2
+SHORT = 3
+LONG = 4
+IFD = 13
+LONG8 = 16
+IFD8 = 18
+
+FIELD_DTYPES = {ASCII: '<u1', SHORT: '<u2', LONG: '<u4', IFD: '<u4', LONG8: '<u8', IFD8: '<u8'}
+SAMPLE_FORMATS = {'u': 1, 'i': 2, 'f': 3}
+
+COMPRESSION_NONE = 1
+COMPRESSION_LZW = 5
+COMPRESSION_DEFLATE = 8
+COMPRESSIONS = {None: COMPRESSION_NONE, 'none': COMPRESSION_NONE, 'lzw': COMPRESSION_LZW,
+                'deflate': COMPRESSION_DEFLATE}
+
+PREDICTOR_HORIZONTAL = 2
+
+# NewSubfileType of the reduced resolution pages of a pyramid
+SUBFILE_REDUCED_IMAGE = 1
+
+
+def horizontal_predictor(data):
+    """Returns the differences between horizontally adjacent pixels of an integer YX array (TIFF predictor 2)"""
+    if data.dtype.kind not in 'ui':
+        raise ValueError("The horizontal predictor requires integer data, got {}".format(data.dtype))
+    out = data.copy()
+    # integer subtraction wraps around, as the predictor requires
+    np.subtract(data[:, 1:], data[:, :-1], out=out[:, 1:])
+    return out
+
+
+def downsample(data, method='mean'):
+    """Returns a YX array binned by 2 along Y and X
+
+    :param data: 2D YX array
+    :param method: 'mean' averages 2x2 blocks, rounding integers to the nearest value,
+                   'nearest' takes every second pixel. Odd sizes are rounded up.
+    :return: 2D array of the same dtype
+    """
+    if method == 'nearest':
+        return data[::2, ::2]
+    if method != 'mean':
+        raise ValueError("The downsampling method must be 'mean' or 'nearest', got {}".format(method))
+    if data.shape[0] % 2 or data.shape[1] % 2:
+        # repeat the last row or column, so it is averaged with itself
+        data = np.pad(data, ((0, data.shape[0] % 2), (0, data.shape[1] % 2)), mode='edge')
+    blocks = data.reshape(data.shape[0] // 2, 2, data.shape[1] // 2, 2)
+    if data.dtype.kind in 'ui':
+        total = blocks.sum(axis=(1, 3), dtype=np.int64 if data.dtype.kind == 'i' else np.uint64)
+        return ((total + 2) // 4).astype(data.dtype)
+    return blocks.mean(axis=(1, 3)).astype(data.dtype)
+
+
+def tiles(data, tile):
+    """Returns the tiles of a YX array in TIFF order (row by row), padding the edge tiles with zeros
+
+    :param data: 2D YX array
+    :param tile: The (length, width) of the tiles
+    :return: list of 2D arrays
+    """
+    length, width = tile
+    rows, cols = -(-data.shape[0] // length), -(-data.shape[1] // width)
+    if data.shape != (rows * length, cols * width):
+        padded = np.zeros((rows * length, cols * width), dtype=data.dtype)
+        padded[:data.shape[0], :data.shape[1]] = data
+        data = padded
+    return [data[i:i + length, j:j + width] for i in range(0, data.shape[0], length)
+            for j in range(0, data.shape[1], width)]
+
+
+def encode(data, compression=None, level=None, predictor=False, tile=None):
+    """Returns the TIFF segments of a YX array: a single strip, or its tiles
+
+    :param data: 2D YX array in little-endian byte order
+    :param compression: None or 'none', 'deflate' or 'lzw'
+    :param level: The deflate compression level from 1 (fastest) to 9 (smallest), 6 if None
+    :param predictor: Apply the horizontal predictor before compression, for integer data
+    :param tile: The (length, width) of the tiles, None for a single strip
+    :return: list of bytes
+    """
+    segments = [data] if tile is None else tiles(data, tile)
+    if predictor:
+        segments = [horizontal_predictor(segment) for segment in segments]
+    segments = [np.ascontiguousarray(segment).tobytes() for segment in segments]
+    if compression == 'deflate':
+        # zlib releases the GIL while compressing, so pages can be encoded in parallel threads
+        return [zlib.compress(segment, 6 if level is None else level) for segment in segments]
+    if compression == 'lzw':
+        return [_lzw_encode(segment) for segment in segments]
+    return segments
+
+
+def encode_levels(data, levels=0, method='mean', **kwargs):
+    """Returns the shapes and TIFF segments of a YX array and of its pyramid levels
+
+    :param data: 2D YX array in little-endian byte order
+    :param levels: The number of reduced resolution levels, each binned by 2 from the previous one
+    :param method: The downsampling method, see downsample()
+    :param kwargs: Passed to encode()
+    :return: list of (shape, segments) tuples, starting with the full resolution
+    """
+    result = [(data.shape, encode(data, **kwargs))]
+    for _ in range(levels):
+        data = downsample(data, method)
+        result.append((data.shape, encode(data, **kwargs)))
+    return result
+
+
+def estimate_size(shape, dtype, page_count=1, tile=None, pyramid_levels=0):
+    """Returns an upper bound of the size of a TIFF file with pages of a shape, before compression
+
+    Compressed pages are usually smaller. Incompressible data grows slightly when compressed,
+    which the estimate allows for, together with the directories and a description.
+
+    :param shape: The (length, width) of the pages
+    :param dtype: The numpy dtype of the pages
+    :param page_count: The number of pages
+    :param tile: The (length, width) of the tiles, None for pages written as strips
+    :param pyramid_levels: The number of reduced resolution levels of each page
+    :return: The size in bytes
+    """
+    itemsize = np.dtype(dtype).itemsize
+    size = 0
+    length, width = shape
+    for _ in range(int(pyramid_levels or 0) + 1):
+        if tile is None:
+            size += length * width * itemsize
+        else:
+            size += -(-length // tile[0]) * tile[0] * -(-width // tile[1]) * tile[1] * itemsize
+        length, width = -(-length // 2), -(-width // 2)
+    # deflate and LZW can expand incompressible data by a small fraction, and each page has a directory
+    return int(page_count * (size * 1.01 + 1024 * (int(pyramid_levels or 0) + 1))) + 2**24
+
+
+class TifWriter(object):
+    """This class writes 2D pages to a little-endian TIFF or BigTIFF file one at a time
+
+    Example:
+        with tifWriter.TifWriter("file.tif", compression="deflate", level=1, max_workers=8) as writer:
+            for plane in planes:
+                writer.write_page(plane)
+            writer.set_description(xml)
+
+    Page data is appended to the file as it is written, so files much larger than memory can be
+    written plane by plane. The first page always holds an ImageDescription tag: set_description()
+    can be called at any time, typically at the end, and points that tag to the new text.
+
+    With tile, pages are split into tiles that are compressed separately, so readers can decode
+    a small region of a large plane without decoding all of it.
+
+    With pyramid_levels, every page gets downsampled copies, each binned by 2 from the previous one,
+    stored as reduced resolution SubIFDs of the page. They do not count as pages.
+
+    With max_workers, pages are compressed in a thread pool while earlier pages are written,
+    keeping at most twice max_workers pages in memory. They are still written in the order of the
+    write_page() calls.
+    """
+
+    def __init__(self, file_path, bigtiff=False, software="aicsimage", compression=None, level=None,
+                 predictor=False, tile=None, pyramid_levels=0, downsample='mean', max_workers=None):
+        """
+        :param file_path: The path of the file to create. An existing file is overwritten.
+        :param bigtiff: Write a BigTIFF file, which has 64 bit offsets and can exceed 4 GB
+        :param software: The value of the Software tag of the first page
+        :param compression: None or 'none', 'deflate' (zlib) or 'lzw'. LZW requires the imagecodecs package.
+        :param level: The deflate compression level from 1 (fastest) to 9 (smallest), 6 if None
+        :param predictor: Apply the horizontal differencing predictor before compression, which usually
+                          makes smooth integer images compress better. Only valid for integer data.
+        :param tile: The (length, width) of the tiles, both multiples of 16, or None to write each page as one strip
+        :param pyramid_levels: The number of reduced resolution levels written with every page
+        :param downsample: The downsampling method of the pyramid levels, 'mean' or 'nearest'
+        :param max_workers: The number of threads used to compress pages, None compresses them sequentially
+        """
+        if downsample not in ('mean', 'nearest'):
+            raise ValueError("The downsampling method must be 'mean' or 'nearest', got {}".format(downsample))
+        if compression not in COMPRESSIONS:
+            raise ValueError("compression must be one of {}".format(sorted(str(c) for c in COMPRESSIONS)))
+        if compression == 'lzw' and _lzw_encode is None:
+            raise ValueError("LZW compression requires the imagecodecs package")
+        if compression == 'none':
+            compression = None
+        if predictor and compression is None:
+            raise ValueError("The predictor can only be used with compression")
+        if tile is not None:
+            tile = tuple(int(i) for i in tile)
+            if len(tile) != 2 or any(i <= 0 or i % 16 for i in tile):
+                raise ValueError("The tile length and width must be positive multiples of 16, got {}".format(tile))
+        self.file_path = file_path
+        self.bigtiff = bigtiff
+        self.software = software
+        self.compression = compression
+        self.level = level
+        self.predictor = predictor
+        self.tile = tile
+        self.pyramid_levels = int(pyramid_levels or 0)
+        self.downsample = downsample
+        self.page_count = 0
+        self._description_entry = None
+        self._pool = ThreadPool(max_workers) if max_workers is not None and max_workers > 1 else None
+        self._max_pending = 2 * max_workers if self._pool is not None else 0
+        self._pending = collections.deque()
+        self._fh = open(file_path, 'wb')
+        if bigtiff:
+            self._offset_format, self._offset_size, self._offset_type = '<Q', 8, LONG8
+            self._fh.write(b'II' + struct.pack('<HHH', 43, 8, 0))
+        else:
+            self._offset_format, self._offset_size, self._offset_type = '<I', 4, LONG
+            self._fh.write(b'II' + struct.pack('<H', 42))
+        # position of the offset field pointing to the next IFD, patched when a page is added
+        self._next_ifd_field = self._fh.tell()
+        self._fh.write(b'\0' * self._offset_size)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def closed(self):
+        return self._fh.closed
+
+    def close(self):
+        if self._fh.closed:
+            return
+        try:
+            self.flush()
+        finally:
+            if self._pool is not None:
+                self._pool.terminate()
+            self._fh.close()
+
+    def write_page(self, data):
+        """Appends a grayscale page
+
+        :param data: 2D YX array. It is written in little-endian byte order.
+                     With max_workers, a copy is compressed in the background.
+        :return: The index of the page
+        """
+        data = np.asarray(data)
+        if data.ndim != 2:
+            raise ValueError("Pages must be 2D YX arrays, got shape {}".format(data.shape))
+        if data.dtype.kind not in SAMPLE_FORMATS:
+            raise ValueError("Data type {} can not be written to a TIFF file".format(data.dtype))
+        if self.predictor and data.dtype.kind not in 'ui':
+            raise ValueError("The horizontal predictor requires integer data, got {}".format(data.dtype))
+        kwargs = dict(levels=self.pyramid_levels, method=self.downsample, compression=self.compression,
+                      level=self.level, predictor=self.predictor, tile=self.tile)
+        if self._pool is None:
+            data = np.ascontiguousarray(data, dtype=data.dtype.newbyteorder('<'))
+            self._write_page(data.dtype, encode_levels(data, **kwargs))
+        else:
+            # copy, so the caller may reuse its array while the page is compressed
+            data = np.array(data, dtype=data.dtype.newbyteorder('<'), order='C')
+            self._pending.append((data.dtype, self._pool.apply_async(encode_levels, (data,), kwargs)))
+            while len(self._pending) > self._max_pending:
+                self._write_pending()
+        self.page_count += 1
+        return self.page_count - 1
+
+    def flush(self):
+        """Writes the pages that are being compressed in the background"""
+        while self._pending:
+            self._write_pending()
+        self._fh.flush()
+
+    def _write_pending(self):
+        dtype, result = self._pending.popleft()
+        self._write_page(dtype, result.get())
+
+    def _write_page(self, dtype, levels):
+        """Writes the (shape, segments) of a page and of its pyramid levels, see encode_levels()"""
+        first = self._description_entry is None
+        # the reduced resolution images are written first, so the page can point to them
+        sub_ifds = [self._write_ifd(self._image_tags(shape, dtype, segments, SUBFILE_REDUCED_IMAGE), link=False)
+                    for shape, segments in levels[1:]]
+        tags = self._image_tags(levels[0][0], dtype, levels[0][1])
+        if sub_ifds:
+            tags.append((SUB_IFDS, IFD8 if self.bigtiff else IFD, sub_ifds))
+        if first:
+            tags.append((IMAGE_DESCRIPTION, ASCII, b'\0'))
+            if self.software:
+                tags.append((SOFTWARE, ASCII, self.software.encode('ascii') + b'\0'))
+        self._write_ifd(tags)
+
+    def _image_tags(self, shape, dtype, segments, subfile_type=0):
+        """Writes the segments of an image and returns the tags describing it"""
+        offset = self._append(b''.join(segments))
+        byte_counts = [len(segment) for segment in segments]
+        offsets = [offset + i for i in np.cumsum([0] + byte_counts[:-1])]
+        tags = [
+            (NEW_SUBFILE_TYPE, LONG, [subfile_type]),
+            (IMAGE_WIDTH, LONG, [shape[1]]),
+            (IMAGE_LENGTH, LONG, [shape[0]]),
+            (BITS_PER_SAMPLE, SHORT, [dtype.itemsize * 8]),
+            (COMPRESSION, SHORT, [COMPRESSIONS[self.compression]]),
+            # min-is-black
+            (PHOTOMETRIC, SHORT, [1]),
+            (SAMPLES_PER_PIXEL, SHORT, [1]),
+            (PLANAR_CONFIGURATION, SHORT, [1]),
+            (SAMPLE_FORMAT, SHORT, [SAMPLE_FORMATS[dtype.kind]]),
+        ]
+        if self.tile is None:
+            tags += [
+                (STRIP_OFFSETS, self._offset_type, offsets),
+                (ROWS_PER_STRIP, LONG, [shape[0]]),
+                (STRIP_BYTE_COUNTS, self._offset_type, byte_counts),
+            ]
+        else:
+            tags += [
+                (TILE_WIDTH, LONG, [self.tile[1]]),
+                (TILE_LENGTH, LONG, [self.tile[0]]),
+                (TILE_OFFSETS, self._offset_type, offsets),
+                (TILE_BYTE_COUNTS, self._offset_type, byte_counts),
+            ]
+        if self.predictor:
+            tags.append((PREDICTOR, SHORT, [PREDICTOR_HORIZONTAL]))
+        return tags
+
+    def set_description(self, description):
+        """Sets the ImageDescription tag of the first page
+
+        :param description: The text, e.g. OME-XML, as str or utf-8 encoded bytes
+        """
+        self.flush()
+        if self._description_entry is None:
+            raise ValueError("The description can only be set after the first page is written")
+        if not isinstance(description, bytes):
+            description = description.encode('utf-8')
+        value = description + b'\0'
+        if len(value) > self._offset_size:
+            value = struct.pack(self._offset_format, self._append(value))
+            count = len(description) + 1
+        else:
+            count = len(value)
+        self._patch(self._description_entry + 4, struct.pack(self._offset_format, count) +
+                    value.ljust(self._offset_size, b'\0'))
+
+    def _append(self, data):
+        """Writes data at the end of the file, aligned to 16 bytes, and returns its offset"""
+        fh = self._fh
+        fh.seek(0, 2)
+        offset = fh.tell()
+        if offset % 16:
+            fh.write(b'\0' * (16 - offset % 16))
+            offset += 16 - offset % 16
+        self._check_offset(offset + len(data))
+        fh.write(data)
+        return offset
+
+    def _patch(self, offset, data):
+        self._fh.seek(offset)
+        self._fh.write(data)
+        self._fh.seek(0, 2)
+
+    def _check_offset(self, offset):
+        if not self.bigtiff and offset >= 2**32:
+            raise ValueError("{} exceeds the 4 GB size limit of TIFF files, write it as BigTIFF".format(self.file_path))
+
+    def _write_ifd(self, tags, link=True):
+        """Appends an image file directory with the given (code, type, values) tags and returns its offset
+
+        If link, the directory is linked to the previous one, else it is only reachable through
+        other tags, like the SubIFDs of a page.
+        """
+        tags = sorted(tags, key=lambda tag: tag[0])
+        count_format, entry_format = ('<Q', '<HHQ') if self.bigtiff else ('<H', '<HHI')
+        entry_size = struct.calcsize(entry_format) + self._offset_size
+        ifd_size = struct.calcsize(count_format) + len(tags) * entry_size + self._offset_size
+
+        fh = self._fh
+        fh.seek(0, 2)
+        ifd_offset = fh.tell() + fh.tell() % 2
+        entries, extra = [], []
+        extra_offset = ifd_offset + ifd_size
+        for i, (code, field_type, values) in enumerate(tags):
+            if field_type == ASCII:
+                value = bytes(values)
+            else:
+                value = np.asarray(values, dtype=FIELD_DTYPES[field_type]).tobytes()
+            count = len(value) // np.dtype(FIELD_DTYPES[field_type]).itemsize
+            if len(value) > self._offset_size:
+                extra.append(value + b'\0' * (len(value) % 2))
+                value = struct.pack(self._offset_format, extra_offset)
+                extra_offset += len(extra[-1])
+            entries.append(struct.pack(entry_format, code, field_type, count) + value.ljust(self._offset_size, b'\0'))
+            if code == IMAGE_DESCRIPTION:
+                self._description_entry = ifd_offset + struct.calcsize(count_format) + i * entry_size
+
+        self._check_offset(extra_offset)
+        fh.write(b'\0' * (ifd_offset - fh.tell()))
+        fh.write(struct.pack(count_format, len(tags)))
+        fh.write(b''.join(entries))
+        fh.write(b'\0' * self._offset_size)
+        fh.write(b''.join(extra))
+        if link:
+            self._patch(self._next_ifd_field, struct.pack(self._offset_format, ifd_offset))
+            self._next_ifd_field = ifd_offset + ifd_size - self._offset_size
+        return ifd_offset
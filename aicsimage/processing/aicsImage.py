@@ -36,10 +36,16 @@ class AICSImage:
     def __init__(self, data, **kwargs):
         """
         Constructor for AICSImage class
-        :param data: String with path to ometif/czi file, or ndarray with up to 5 dimensions
+        :param data: String with path to ometif/czi file, seekable binary file-like object with CZI data
+                     (e.g. an aicsimage.io.RangeFile), or ndarray with up to 5 dimensions
         :param kwargs: If ndarray is used for data, then you can specify the dim ordering
                        with dims arg (ie dims="TZCYX"). type arg will only be used if data
                        is a file name without an extension. Must be one of .czi, .ome.tif, or .tif
+                       For CZI files, memmap=True keeps the image data in a temporary file on disk
+                       (in the directory given by the tempdir arg) instead of memory, and
+                       memmap="path" stores it in that file.
+                       For pyramidal CZI and OME-TIFF files, level=n loads the nth pyramid level
+                       instead of the full resolution image.
         """
         self.dims = AICSImage.default_dims
         if isinstance(data, str):
@@ -63,12 +69,13 @@ class AICSImage:
                     self.reader = type_to_reader_map[type](self.file_path)
                 else:
                     raise ValueError("CellImage can only accept OME-TIFF, TIFF, and CZI file formats!")
-            self.data = self.reader.load()
-            # TODO remove this transpose call once reader output is changed
-            # this line assumes that all the above readers return TZCYX order, and converts to TCZYX
-            self.data = self.data.transpose(0, 2, 1, 3, 4)
-            self.metadata = self.reader.get_metadata()
-            self.shape = self.data.shape
+            self._load_from_reader(**kwargs)
+
+        elif hasattr(data, "read") and hasattr(data, "seek"):
+            # input is a file-like object, which is supported for CZI data
+            self.file_path = getattr(data, "name", None)
+            self.reader = cziReader.CziReader(data)
+            self._load_from_reader(**kwargs)
 
         elif isinstance(data, np.ndarray):
             # input is a data array
@@ -82,6 +89,25 @@ class AICSImage:
             self.shape = self.data.shape
         self.size_t, self.size_c, self.size_z, self.size_y, self.size_x = tuple(self.shape)
 
+    def _load_from_reader(self, **kwargs):
+        load_kwargs = {key: kwargs[key] for key in ("memmap", "tempdir") if key in kwargs}
+        if load_kwargs and not isinstance(self.reader, cziReader.CziReader):
+            raise ValueError("memmap and tempdir are only supported for CZI files!")
+        if kwargs.get("level"):
+            if isinstance(self.reader, tifReader.TifReader):
+                raise ValueError("Pyramid levels are only supported for CZI and OME-TIFF files!")
+            load_kwargs["level"] = kwargs["level"]
+        if isinstance(self.reader, cziReader.CziReader):
+            # the CZI reader decodes directly into a contiguous TCZYX array
+            self.data = self.reader.load(dims=self.dims, **load_kwargs)
+        else:
+            self.data = self.reader.load(**load_kwargs)
+            # TODO remove this transpose call once reader output is changed
+            # this line assumes that all the above readers return TZCYX order, and converts to TCZYX
+            self.data = self.data.transpose(0, 2, 1, 3, 4)
+        self.metadata = self.reader.get_metadata()
+        self.shape = self.data.shape
+
     def is_valid_dimension(self, dimensions):
         if dimensions.strip(self.dims):
             # dims contains more than the standard 5 dims we're used to
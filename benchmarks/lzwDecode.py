@@ -0,0 +1,69 @@
+"""Benchmark decoding of LZW compressed CZI subblocks
+
+Compares the previous decode path (tifffile.decode_lzw followed by a copy into a numpy array)
+with czifile.decode_lzw_array, sequentially and from a thread pool.
+
+Example:
+    python benchmarks/lzwDecode.py --size 2048 --tiles 16 --workers 8
+
+Encoding the test data requires the imagecodecs package.
+"""
+from __future__ import print_function
+
+import argparse
+import timeit
+from multiprocessing.pool import ThreadPool
+
+import numpy as np
+from tifffile.tifffile import decode_lzw
+
+from aicsimage.io import czifile
+
+
+def make_tiles(size, count, seed=0):
+    """Returns LZW encoded 16-bit planes resembling microscopy data: smooth background plus noise"""
+    import imagecodecs
+    rng = np.random.RandomState(seed)
+    y, x = np.mgrid[0:size, 0:size]
+    background = 1000 + 500 * np.sin(y / 50.0) * np.cos(x / 70.0)
+    planes = [(background + rng.poisson(20, (size, size))).astype('<u2') for _ in range(count)]
+    return [imagecodecs.lzw_encode(plane.tobytes()) for plane in planes]
+
+
+def previous_path(data, size):
+    return np.frombuffer(decode_lzw(data), '<u2').copy().reshape(size, size, 1)
+
+
+def new_path(data, size):
+    return czifile.decode_lzw_array(data, '<u2', (size, size, 1))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--size", type=int, default=1024, help="width and height of the planes")
+    parser.add_argument("--tiles", type=int, default=8, help="number of planes")
+    parser.add_argument("--workers", type=int, default=4, help="number of threads for the parallel run")
+    parser.add_argument("--repeat", type=int, default=3, help="number of timing runs, the best is reported")
+    args = parser.parse_args()
+
+    tiles = make_tiles(args.size, args.tiles)
+    megabytes = args.tiles * args.size * args.size * 2 / 1e6
+    assert all(np.array_equal(previous_path(t, args.size), new_path(t, args.size)) for t in tiles)
+    print("{} planes of {}x{} uint16, {:.1f} MB decoded, imagecodecs {}".format(
+        args.tiles, args.size, args.size, megabytes, "used" if czifile._lzw_decode else "not available"))
+
+    pool = ThreadPool(args.workers)
+    runs = [
+        ("tifffile.decode_lzw + copy", lambda: [previous_path(t, args.size) for t in tiles]),
+        ("decode_lzw_array", lambda: [new_path(t, args.size) for t in tiles]),
+        ("decode_lzw_array, {} threads".format(args.workers),
+         lambda: pool.map(lambda t: new_path(t, args.size), tiles)),
+    ]
+    for name, func in runs:
+        seconds = min(timeit.repeat(func, number=1, repeat=args.repeat))
+        print("{:<36} {:8.3f} s {:10.1f} MB/s".format(name, seconds, megabytes / seconds))
+    pool.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""Benchmark OME-TIFF writing with different compression settings
+
+Writes the same 16-bit stack with each setting of OmeTifWriter and reports the file size,
+the compression ratio and the write throughput, sequentially and with a thread pool.
+
+Example:
+    python benchmarks/omeTifCompression.py --size 1024 --planes 32 --workers 8
+
+LZW settings are skipped if the imagecodecs package is not installed.
+"""
+from __future__ import print_function
+
+import argparse
+import os
+import shutil
+import tempfile
+import timeit
+
+import numpy as np
+
+from aicsimage.io import omeTifReader, tifWriter
+from aicsimage.io.omeTifWriter import OmeTifWriter
+
+SETTINGS = [
+    ("none", dict(compression=None)),
+    ("deflate level 1", dict(compression="deflate", compression_level=1)),
+    ("deflate level 1 + predictor", dict(compression="deflate", compression_level=1, predictor=True)),
+    ("deflate level 6 + predictor", dict(compression="deflate", compression_level=6, predictor=True)),
+    ("deflate level 9", dict(compression="deflate", compression_level=9)),
+    ("lzw", dict(compression="lzw")),
+    ("lzw + predictor", dict(compression="lzw", predictor=True)),
+]
+
+
+def make_stack(size, planes, seed=0):
+    """Returns a ZYX uint16 stack resembling microscopy data: smooth background, a few blobs and noise"""
+    rng = np.random.RandomState(seed)
+    y, x = np.mgrid[0:size, 0:size]
+    background = 400 + 200 * np.sin(y / 80.0) * np.cos(x / 110.0)
+    blobs = np.zeros((size, size))
+    for cy, cx in rng.randint(0, size, (20, 2)):
+        blobs += 3000 * np.exp(-((y - cy) ** 2 + (x - cx) ** 2) / (2 * 15.0 ** 2))
+    return np.stack([(background + blobs * (0.5 + 0.5 * np.cos(z / 5.0)) + rng.poisson(30, (size, size)))
+                     .astype(np.uint16) for z in range(planes)])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--size", type=int, default=1024, help="width and height of the planes")
+    parser.add_argument("--planes", type=int, default=16, help="number of z planes")
+    parser.add_argument("--workers", type=int, default=4, help="number of threads for the parallel runs")
+    parser.add_argument("--repeat", type=int, default=3, help="number of timing runs, the best is reported")
+    args = parser.parse_args()
+
+    data = make_stack(args.size, args.planes)
+    megabytes = data.nbytes / 1e6
+    print("{} planes of {}x{} uint16, {:.1f} MB".format(args.planes, args.size, args.size, megabytes))
+    print("{:<30} {:>10} {:>7} {:>12} {:>12}".format("setting", "size MB", "ratio", "MB/s", "MB/s {} thr".format(
+        args.workers)))
+
+    tempdir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tempdir, "benchmark.ome.tif")
+        for name, options in SETTINGS:
+            if options["compression"] == "lzw" and tifWriter._lzw_encode is None:
+                continue
+            speeds = []
+            for workers in (None, args.workers):
+                def write():
+                    OmeTifWriter(path, overwrite_file=True, max_workers=workers, **options).save(data)
+                speeds.append(megabytes / min(timeit.repeat(write, number=1, repeat=args.repeat)))
+            with omeTifReader.OmeTifReader(path) as reader:
+                assert np.array_equal(reader.load()[0, :, 0], data)
+            size = os.path.getsize(path) / 1e6
+            print("{:<30} {:10.2f} {:7.2f} {:12.1f} {:12.1f}".format(name, size, megabytes / size, *speeds))
+    finally:
+        shutil.rmtree(tempdir)
+
+
+if __name__ == "__main__":
+    main()
@@ -24,6 +24,9 @@ setup(name='aicsimage',
             'scikit-image>=0.13.0',
             'tifffile>=0.12.1'
       ],
+      extras_require={
+            'codecs': ['imagecodecs'],
+      },
       test_suite='test.test_suite',
       zip_safe=False,
       )
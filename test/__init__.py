@@ -0,0 +1,9 @@
+import os
+import unittest
+
+
+def test_suite():
+    """Collects all tests of the package, see test_suite in setup.py"""
+    return unittest.TestLoader().discover(os.path.dirname(__file__), pattern="test*.py",
+                                          top_level_dir=os.path.dirname(os.path.dirname(__file__)))
+test_suite.__test__ = False
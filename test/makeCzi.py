@@ -0,0 +1,140 @@
+"""Writes small synthetic CZI files for the tests
+
+Only the parts of the format read by czifile are written: the file header, the subblocks with their directory
+entries, the subblock directory, a metadata segment with the pixel sizes and optional attachments.
+"""
+import struct
+import uuid
+
+import numpy as np
+
+from aicsimage.io import czifile
+
+METADATA = ('<ImageDocument><Metadata><Scaling><Items>'
+            '<Distance Id="X"><Value>1e-07</Value></Distance>'
+            '<Distance Id="Y"><Value>1e-07</Value></Distance>'
+            '<Distance Id="Z"><Value>5e-07</Value></Distance>'
+            '</Items></Scaling></Metadata></ImageDocument>')
+
+
+def _segment(sid, data):
+    return struct.pack('<16sqq', sid.ljust(16, b'\0'), len(data), len(data)) + data
+
+
+def _directory_entry(pixel_type, file_position, compression, pyramid, dims):
+    entry = struct.pack('<2siqiiBB4si', b'DV', pixel_type, file_position, 0, compression, pyramid, 0, b'\0' * 4,
+                        len(dims))
+    # the dimension entries are stored with the fastest varying dimension first
+    for dim in reversed(dims):
+        name, start, size = dim[:3]
+        stored_size = dim[3] if len(dim) > 3 else size
+        entry += struct.pack('<4siifi', name.ljust(4, b'\0'), start, size, float(start), stored_size)
+    return entry
+
+
+def write_czi(path, subblocks, metadata=METADATA, attachments=(), directory_order=None):
+    """Writes a CZI file
+
+    :param path: The path of the file
+    :param subblocks: list of (dims, data) or (dims, data, options) in the order they are stored in the file.
+                      dims is a list of (name, start, size) or (name, start, size, stored_size) of the subblock in
+                      the order of the file's axes, e.g. [(b'C', 1, 1), (b'Z', 0, 1), (b'Y', 0, 16), (b'X', 0, 20)].
+                      data is a YX array at the stored size, or a YXS array with 3 uint8 samples per pixel for
+                      Bgr24 images. options can set the "compression" code with the compressed "raw" bytes
+                      of data, and the "pyramid" type of the subblock.
+    :param metadata: The metadata XML
+    :param attachments: list of (content file type, name, data bytes), e.g. (b'CZTIMS', b'TimeStamps', data)
+    :param directory_order: The indices of the subblocks in the order of the subblock directory,
+                            None for the order in the file
+    """
+    header_size = 32 + 512
+    body = bytearray()
+    entries = []
+    for subblock in subblocks:
+        dims, data = subblock[:2]
+        options = subblock[2] if len(subblock) > 2 else {}
+        data = np.ascontiguousarray(data)
+        dtype = '<' + data.dtype.str[1:] if data.ndim == 2 else '<{}{}'.format(data.shape[2], data.dtype.str[1:])
+        entry = _directory_entry(czifile.PIXEL_TYPE_CODE[dtype], header_size + len(body),
+                                 options.get("compression", 0), options.get("pyramid", 0), dims)
+        item = b'<METADATA/>'
+        raw = options.get("raw", data.tobytes())
+        segment_data = struct.pack('<iiq', len(item), 0, len(raw)) + entry
+        segment_data += b'\0' * max(240 - len(entry), 0) + item + raw
+        body += _segment(b'ZISRAWSUBBLOCK', segment_data)
+        entries.append(entry)
+    if directory_order is not None:
+        entries = [entries[i] for i in directory_order]
+
+    metadata_position = header_size + len(body)
+    metadata = metadata.encode('utf-8')
+    body += _segment(b'ZISRAWMETADATA', struct.pack('<ii', len(metadata), 0) + b'\0' * 248 + metadata)
+
+    attachment_entries = []
+    for content_file_type, name, data in attachments:
+        entry = struct.pack('<2s10sqi16s8s80s', b'A1', b'\0' * 10, header_size + len(body), 0, uuid.uuid4().bytes,
+                            content_file_type, name)
+        body += _segment(b'ZISRAWATTACH', struct.pack('<i', len(data)) + b'\0' * 12 + entry + b'\0' * 112 + data)
+        attachment_entries.append(entry)
+    attachment_directory_position = 0
+    if attachment_entries:
+        attachment_directory_position = header_size + len(body)
+        body += _segment(b'ZISRAWATTDIR', struct.pack('<i', len(attachment_entries)) + b'\0' * 252 +
+                         b''.join(attachment_entries))
+
+    directory_position = header_size + len(body)
+    body += _segment(b'ZISRAWDIRECTORY', struct.pack('<i', len(entries)) + b'\0' * 124 + b''.join(entries))
+
+    file_guid = uuid.uuid4().bytes
+    header = struct.pack('<iiii16s16siqqiq', 1, 0, 0, 0, file_guid, file_guid, 0, directory_position,
+                         metadata_position, 0, attachment_directory_position)
+    with open(path, 'wb') as fh:
+        fh.write(_segment(b'ZISRAWFILE', header.ljust(512, b'\0')))
+        fh.write(bytes(body))
+
+
+def write_timelapse(path, size_t=3, size_z=4, size_c=2, size_y=16, size_x=20, dtype=np.uint16, seed=0, **kwargs):
+    """Writes a CZI file with one subblock per plane, stored by T, then C, then Z
+
+    :param kwargs: Passed to write_czi()
+    :return: The image as a TZCYX array
+    """
+    data = np.random.RandomState(seed).randint(0, 250, (size_t, size_z, size_c, size_y, size_x)).astype(dtype)
+    subblocks = [([(b'B', 0, 1), (b'T', t, 1), (b'C', c, 1), (b'Z', z, 1), (b'Y', 0, size_y), (b'X', 0, size_x)],
+                  data[t, z, c]) for t in range(size_t) for c in range(size_c) for z in range(size_z)]
+    write_czi(path, subblocks, **kwargs)
+    return data
+
+
+def write_mosaic(path, size_s=1, size_z=2, size_c=2, tiles_y=2, tiles_x=3, tile_y=10, tile_x=12, order="plane",
+                 seed=0, **kwargs):
+    """Writes a CZI file with a mosaic of tiles per plane
+
+    Scene s is placed at x = 1000 * s on the canvas of all scenes.
+
+    :param order: The order of the subblocks in the file: "plane" stores all tiles of a plane together,
+                  "tile" stores each tile for all planes together, and "shuffle" stores them in random order.
+                  The subblock directory lists them by plane in all cases.
+    :param kwargs: Passed to write_czi()
+    :return: The image as a SZCYX array of the scenes
+    """
+    rng = np.random.RandomState(seed)
+    data = rng.randint(0, 60000, (size_s, size_z, size_c, tiles_y * tile_y, tiles_x * tile_x)).astype(np.uint16)
+    subblocks = []
+    for s in range(size_s):
+        for c in range(size_c):
+            for z in range(size_z):
+                for m in range(tiles_y * tiles_x):
+                    iy, ix = divmod(m, tiles_x)
+                    y, x = iy * tile_y, ix * tile_x
+                    dims = [(b'B', 0, 1), (b'S', s, 1), (b'C', c, 1), (b'Z', z, 1), (b'Y', y, tile_y),
+                            (b'X', x + 1000 * s, tile_x), (b'M', m, 1)]
+                    subblocks.append((dims, data[s, z, c, y:y + tile_y, x:x + tile_x]))
+    file_order = list(range(len(subblocks)))
+    if order == "tile":
+        file_order.sort(key=lambda i: (i % (tiles_y * tiles_x), i))
+    elif order == "shuffle":
+        rng.shuffle(file_order)
+    directory_order = [file_order.index(i) for i in range(len(subblocks))]
+    write_czi(path, [subblocks[i] for i in file_order], directory_order=directory_order, **kwargs)
+    return data
@@ -0,0 +1,290 @@
+import gc
+import os
+import shutil
+import tempfile
+import unittest
+
+try:
+    import imagecodecs
+except ImportError:
+    imagecodecs = None
+
+import numpy as np
+
+from aicsimage.io import czifile
+from aicsimage.io.cziReader import CziReader
+from .makeCzi import write_czi, write_mosaic, write_timelapse
+
+
+class TestCziReader(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def write_bgr24(self, size_c=2, size_z=3, size_y=8, size_x=10):
+        """Writes a CZI file with Bgr24 pixels, 3 samples per pixel, and returns its CZYXS data"""
+        data = np.random.RandomState(0).randint(0, 256, (size_c, size_z, size_y, size_x, 3)).astype(np.uint8)
+        subblocks = [([(b'B', 0, 1), (b'C', c, 1), (b'Z', z, 1), (b'Y', 0, size_y), (b'X', 0, size_x)], data[c, z])
+                     for c in range(size_c) for z in range(size_z)]
+        path = os.path.join(self.tempdir, "bgr24.czi")
+        write_czi(path, subblocks)
+        return path, data
+
+    def test_load_roi_multi_sample(self):
+        path, data = self.write_bgr24()
+        with CziReader(path) as reader:
+            image = reader.load()
+            self.assertEqual(image.shape, (1, 3, 2, 8, 10))
+            self.assertTrue(np.array_equal(image[0], data[..., 0].transpose(1, 0, 2, 3)))
+            self.assertTrue(np.array_equal(reader.load_roi((0, 8), (0, 10)), image))
+            self.assertTrue(np.array_equal(reader.load_roi((2, 7), (3, 9)), image[..., 2:7, 3:9]))
+            self.assertTrue(np.array_equal(reader.load_roi((1, 4), (0, 5), z=(1, 3), c=1),
+                                           image[:, 1:3, 1:2, 1:4, 0:5]))
+
+    def test_sizes_with_scenes(self):
+        data = np.random.RandomState(0).randint(0, 60000, (2, 3, 4, 8, 10)).astype(np.uint16)
+        # the second scene is placed to the right of the first on the canvas of all scenes
+        subblocks = [([(b'B', 0, 1), (b'S', s, 1), (b'C', c, 1), (b'Z', z, 1), (b'Y', 0, 8), (b'X', s * 10, 10)],
+                      data[s, c, z]) for s in range(2) for c in range(3) for z in range(4)]
+        path = os.path.join(self.tempdir, "scenes.czi")
+        write_czi(path, subblocks)
+        with CziReader(path) as reader:
+            self.assertEqual(reader.size_s(), 2)
+            self.assertEqual((reader.size_t(), reader.size_z(), reader.size_c()), (1, 4, 3))
+            self.assertEqual((reader.size_y(), reader.size_x()), (8, 20))
+            for s in range(2):
+                image = reader.load(scene=s)
+                self.assertEqual(image.shape[:3], (reader.size_t(), reader.size_z(), reader.size_c()))
+                self.assertTrue(np.array_equal(image[0], data[s].transpose(1, 0, 2, 3)))
+
+    def test_find_subblocks(self):
+        path = os.path.join(self.tempdir, "mosaic.czi")
+        data = write_mosaic(path, size_s=2, order="shuffle")
+        with CziReader(path) as reader:
+            entries = reader.find_subblocks(z=1, c=0, s=1)
+            self.assertEqual(sorted(entry.mosaic_index for entry in entries), list(range(6)))
+            for entry in entries:
+                iy, ix = divmod(entry.mosaic_index, 3)
+                tile = entry.data_segment().data().reshape(10, 12)
+                self.assertTrue(np.array_equal(tile, data[1, 1, 0, iy * 10:(iy + 1) * 10, ix * 12:(ix + 1) * 12]))
+            self.assertEqual([entry.mosaic_index for entry in reader.find_subblocks(z=1, c=0, s=1, m=4)], [4])
+            self.assertEqual(reader.find_subblocks(z=2), [])
+
+    def test_load_slice(self):
+        path = os.path.join(self.tempdir, "timelapse.czi")
+        data = write_timelapse(path)
+        with CziReader(path) as reader:
+            for t, z, c in [(0, 0, 0), (2, 3, 1), (1, 2, 0)]:
+                self.assertTrue(np.array_equal(reader.load_slice(z=z, c=c, t=t), data[t, z, c]))
+            self.assertIsNone(reader.load_slice(z=4))
+
+    def test_lazy(self):
+        path = os.path.join(self.tempdir, "mosaic.czi")
+        write_mosaic(path, size_z=3, size_c=2, order="shuffle")
+        with CziReader(path) as reader:
+            image = reader.load()
+            lazy = reader.lazy()
+            self.assertEqual(lazy.shape, image.shape)
+            self.assertEqual(lazy.dtype, image.dtype)
+            # chunks along Y and X follow the mosaic tiles
+            self.assertEqual(lazy.chunk_boundaries("Y"), [0, 10, 20])
+            self.assertEqual(lazy.chunk_boundaries("X"), [0, 12, 24, 36])
+            self.assertTrue(np.array_equal(np.asarray(lazy), image))
+            for key in [(0, 1, 0), (0, slice(0, 2), 1, slice(5, 15), slice(10, 30)), (Ellipsis, 3, slice(None, None, 5)),
+                        (0, [2, 0], slice(None), slice(None, None, -3)), (-1, -1, -1, -1, -1)]:
+                self.assertTrue(np.array_equal(lazy[key], image[key]), key)
+            with self.assertRaises(IndexError):
+                lazy[0, 3]
+
+    def test_load_max_workers(self):
+        path = os.path.join(self.tempdir, "mosaic.czi")
+        write_mosaic(path, size_s=2, size_z=3, order="tile")
+        with CziReader(path) as reader:
+            serial = reader.load()
+            for max_workers in (1, 2, 4):
+                self.assertTrue(np.array_equal(reader.load(max_workers=max_workers), serial))
+            self.assertTrue(np.array_equal(reader.czi.asarray(max_workers=3), reader.czi.asarray()))
+
+    def test_load_memmap(self):
+        path = os.path.join(self.tempdir, "timelapse.czi")
+        data = write_timelapse(path)
+        memmap_dir = os.path.join(self.tempdir, "memmap")
+        os.mkdir(memmap_dir)
+        with CziReader(path) as reader:
+            image = reader.load(memmap=True, tempdir=memmap_dir, max_workers=2)
+            self.assertIsInstance(image, np.memmap)
+            self.assertTrue(np.array_equal(image, data))
+            self.assertEqual(len(os.listdir(memmap_dir)), 1)
+            # the temporary file is removed with the array
+            del image
+            gc.collect()
+            self.assertEqual(os.listdir(memmap_dir), [])
+
+            kept = os.path.join(memmap_dir, "image.bin")
+            image = reader.load(memmap=kept)
+            self.assertTrue(np.array_equal(image, data))
+            del image
+            gc.collect()
+            self.assertEqual(os.listdir(memmap_dir), ["image.bin"])
+            self.assertEqual(os.path.getsize(kept), data.nbytes)
+
+    def test_mmap_mode(self):
+        path = os.path.join(self.tempdir, "timelapse.czi")
+        data = write_timelapse(path)
+        with CziReader(path) as reader:
+            self.assertTrue(np.array_equal(reader.load(mmap_mode="r"), data))
+            plane = reader.load_slice(z=2, c=1, t=1, mmap_mode="r")
+            self.assertTrue(np.array_equal(plane, data[1, 2, 1]))
+            # the plane is a read-only view of the file
+            self.assertFalse(plane.flags.writeable)
+            plane = reader.load_slice(z=2, c=1, t=1, mmap_mode="c")
+            plane[:] = 0
+            self.assertTrue(np.array_equal(reader.load_slice(z=2, c=1, t=1), data[1, 2, 1]))
+            del plane
+
+    @unittest.skipIf(imagecodecs is None, "requires imagecodecs")
+    def test_jpegxr_and_jpeg(self):
+        data = np.random.RandomState(0).randint(0, 60000, (2, 16, 20)).astype(np.uint16)
+        # lossless JPEG-XR for channel 0, lossy 8-bit JPEG for channel 1
+        jpeg = (data[1] >> 8).astype(np.uint8)
+        dims = [[(b'B', 0, 1), (b'C', c, 1), (b'Y', 0, 16), (b'X', 0, 20)] for c in range(2)]
+        subblocks = [(dims[0], data[0], dict(compression=4, raw=imagecodecs.jpegxr_encode(data[0], level=1.0))),
+                     (dims[1], jpeg, dict(compression=1, raw=imagecodecs.jpeg8_encode(jpeg, level=95)))]
+        path = os.path.join(self.tempdir, "jpeg.czi")
+        write_czi(path, subblocks)
+        with CziReader(path) as reader:
+            self.assertTrue(np.array_equal(reader.load_slice(c=0), data[0]))
+            self.assertTrue(np.array_equal(reader.load_slice(c=1), imagecodecs.jpeg8_decode(subblocks[1][2]["raw"])))
+            self.assertTrue(np.array_equal(reader.load(max_workers=2)[0, 0, 0], data[0]))
+
+            decompress = czifile.DECOMPRESS.pop(4)
+            try:
+                with self.assertRaises(ValueError):
+                    reader.load_slice(c=0)
+            finally:
+                czifile.DECOMPRESS[4] = decompress
+
+    def test_load_roi_scenes(self):
+        path = os.path.join(self.tempdir, "mosaic.czi")
+        data = write_mosaic(path, size_s=2, order="shuffle")
+        with CziReader(path) as reader:
+            for s in range(2):
+                # the region is relative to the scene's bounding box
+                image = reader.load_roi((5, 17), (7, 30), scene=s)
+                self.assertTrue(np.array_equal(image[0], data[s, :, :, 5:17, 7:30]))
+                image = reader.load_roi((3, 9), (0, 36), z=1, c=(0, 2), scene=s, max_workers=3)
+                self.assertTrue(np.array_equal(image[0], data[s, 1:2, :, 3:9]))
+            self.assertTrue(np.array_equal(reader.load_roi((0, 20), (0, 36)), reader.load(scene=0)))
+            self.assertRaises(ValueError, reader.load_roi, (0, 20), (0, 36), scene=2)
+
+    def test_load_roi_clipped(self):
+        path = os.path.join(self.tempdir, "mosaic.czi")
+        data = write_mosaic(path, size_s=2)
+        with CziReader(path) as reader:
+            # the parts of the region outside the scene are clipped
+            image = reader.load_roi((-5, 12), (30, 100), scene=1)
+            self.assertEqual(image.shape, (1, 2, 2, 12, 6))
+            self.assertTrue(np.array_equal(image[0], data[1, :, :, :12, 30:]))
+            self.assertEqual(reader.load_roi((25, 30), (0, 10)).shape, (1, 2, 2, 0, 10))
+
+    def test_pyramid_levels(self):
+        data = np.random.RandomState(0).randint(0, 1000, (2, 32, 48)).astype(np.uint16)
+        subblocks = []
+        for c in range(2):
+            for m in range(4):
+                y, x = divmod(m, 2)
+                dims = [(b'B', 0, 1), (b'C', c, 1), (b'Y', y * 16, 16), (b'X', x * 24, 24), (b'M', m, 1)]
+                subblocks.append((dims, data[c, y * 16:y * 16 + 16, x * 24:x * 24 + 24]))
+            # downsampled subblocks covering the whole plane at a 2x and 4x smaller stored size
+            for pyramid, factor in ((1, 2), (2, 4)):
+                dims = [(b'B', 0, 1), (b'C', c, 1), (b'Y', 0, 32, 32 // factor), (b'X', 0, 48, 48 // factor)]
+                subblocks.append((dims, data[c, ::factor, ::factor], {"pyramid": pyramid}))
+        path = os.path.join(self.tempdir, "pyramid.czi")
+        write_czi(path, subblocks)
+        with CziReader(path) as reader:
+            self.assertEqual(reader.pyramid_levels(), [1, 2, 4])
+            self.assertTrue(np.array_equal(reader.load()[0, 0], data))
+            for level, factor in ((1, 2), (2, 4)):
+                self.assertTrue(np.array_equal(reader.load(level=level)[0, 0], data[:, ::factor, ::factor]))
+                self.assertTrue(np.array_equal(reader.load_slice(c=1, level=level), data[1, ::factor, ::factor]))
+            czi = reader.czi.pyramid_level(1)
+            self.assertEqual(czi.pixel_sizes[:2], tuple(2 * size for size in reader.czi.pixel_sizes[:2]))
+            self.assertIs(czi.pyramid_level(0), reader.czi)
+            self.assertRaises(ValueError, reader.load, level=3)
+
+    def test_map_scenes(self):
+        path = os.path.join(self.tempdir, "mosaic.czi")
+        data = write_mosaic(path, size_s=3, size_z=3, order="shuffle")
+        with CziReader(path) as reader:
+            self.assertEqual(reader.scenes(), [0, 1, 2])
+            for s in reader.scenes():
+                lazy = reader.lazy(scene=s)
+                self.assertEqual(lazy.shape, (1,) + data.shape[1:])
+                self.assertTrue(np.array_equal(np.asarray(lazy)[0], data[s]))
+                self.assertTrue(np.array_equal(lazy[0, 1, 1, 3:15, 5:30], data[s, 1, 1, 3:15, 5:30]))
+            results = reader.map_scenes(lambda s, image: np.array_equal(np.asarray(image)[0], data[s]), max_workers=3)
+            self.assertEqual(results, [True] * 3)
+            self.assertEqual(reader.map_scenes(lambda s, image: (s, image.shape), scenes=[2]),
+                             [(2, (1,) + data.shape[1:])])
+            self.assertRaises(ValueError, reader.lazy, scene=3)
+
+        # a file without scene dimension has a single scene
+        path = os.path.join(self.tempdir, "timelapse.czi")
+        data = write_timelapse(path)
+        with CziReader(path) as reader:
+            self.assertEqual(reader.scenes(), [0])
+            self.assertTrue(np.array_equal(reader.load(scene=0), data))
+
+    def test_load_out_dims(self):
+        path = os.path.join(self.tempdir, "timelapse.czi")
+        data = write_timelapse(path, size_t=2, size_z=4, size_c=3)
+        with CziReader(path) as reader:
+            image = reader.load(dims="TCZYX", max_workers=2)
+            self.assertTrue(image.flags.c_contiguous)
+            self.assertTrue(np.array_equal(image, data.transpose(0, 2, 1, 3, 4)))
+            out = np.full(image.shape, 7, image.dtype)
+            self.assertIs(reader.load(out=out, dims="TCZYX"), out)
+            self.assertTrue(np.array_equal(out, image))
+            image = reader.load(memmap=True, tempdir=self.tempdir, dims="CZTYX")
+            self.assertTrue(np.array_equal(image, data.transpose(2, 1, 0, 3, 4)))
+            del image
+            self.assertRaises(ValueError, reader.load, out=np.zeros((1, 2), data.dtype))
+            self.assertRaises(ValueError, reader.load, out=out, memmap=True)
+            self.assertRaises(ValueError, reader.load, dims="TZCY")
+
+        path = os.path.join(self.tempdir, "mosaic.czi")
+        data = write_mosaic(path, size_s=2, size_z=3)
+        with CziReader(path) as reader:
+            image = reader.load(scene=1, dims="CZYXT")
+            self.assertEqual(image.shape, (2, 3, 20, 36, 1))
+            self.assertTrue(np.array_equal(image[..., 0], data[1].transpose(1, 0, 2, 3)))
+
+    @unittest.skipIf(imagecodecs is None, "requires imagecodecs")
+    def test_lzw(self):
+        data = np.random.RandomState(2).randint(0, 60000, (2, 3, 2, 16, 20)).astype(np.uint16)
+        subblocks = [([(b'B', 0, 1), (b'T', t, 1), (b'C', c, 1), (b'Z', z, 1), (b'Y', 0, 16), (b'X', 0, 20)],
+                      data[t, z, c], dict(compression=2, raw=imagecodecs.lzw_encode(data[t, z, c].tobytes())))
+                     for t in range(2) for c in range(2) for z in range(3)]
+        path = os.path.join(self.tempdir, "lzw.czi")
+        write_czi(path, subblocks)
+        lzw_decode = czifile._lzw_decode
+        with CziReader(path) as reader:
+            try:
+                # decoded by imagecodecs, and by tifffile without it
+                for czifile._lzw_decode in (lzw_decode, None):
+                    self.assertTrue(np.array_equal(reader.load(max_workers=3), data))
+                    self.assertTrue(np.array_equal(reader.load_slice(z=1, c=1, t=1), data[1, 1, 1]))
+                    # data missing from a truncated stream are zero
+                    raw = imagecodecs.lzw_encode(data[0, 0, 0, :8].tobytes())
+                    image = czifile.decode_lzw_array(raw, np.uint16, (16, 20))
+                    self.assertTrue(np.array_equal(image[:8], data[0, 0, 0, :8]))
+                    self.assertFalse(image[8:].any())
+            finally:
+                czifile._lzw_decode = lzw_decode
+
+
+if __name__ == '__main__':
+    unittest.main()
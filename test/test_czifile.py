@@ -0,0 +1,237 @@
+import io
+import os
+import shutil
+import struct
+import tempfile
+import time
+import tracemalloc
+import unittest
+import warnings
+from multiprocessing.pool import ThreadPool
+
+import numpy as np
+
+from aicsimage.io import czifile
+from .makeCzi import write_czi, write_mosaic, write_timelapse
+
+
+class TestCziFile(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tempdir, "image.czi")
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def open_cached(self, cache):
+        """Opens the file with a sidecar index in cache and returns it with whether the index was up to date"""
+        czi = czifile.CziFile(self.path, cache=cache)
+        # the shape is only derived from the subblock directory if the sidecar index was missing or stale
+        return czi, "filtered_directory_array" not in czi.__dict__
+
+    def test_index_cache(self):
+        data = write_timelapse(self.path)
+        cache = os.path.join(self.tempdir, "cache")
+        with czifile.CziFile(self.path) as czi:
+            expected = czi.shape, czi.start, czi.axes, czi.dtype, czi.pixel_sizes
+
+        czi, hit = self.open_cached(cache)
+        with czi:
+            self.assertFalse(hit)
+        self.assertEqual(len(os.listdir(cache)), 1)
+
+        czi, hit = self.open_cached(cache)
+        with czi:
+            self.assertTrue(hit)
+            self.assertEqual((czi.shape, czi.start, czi.axes, czi.dtype, czi.pixel_sizes), expected)
+            self.assertTrue(np.array_equal(czi.asarray()[0, :, :, :, :, :, 0].transpose(0, 2, 1, 3, 4), data))
+
+        # a changed modification time invalidates the index
+        stat = os.stat(self.path)
+        os.utime(self.path, (stat.st_atime, stat.st_mtime + 10))
+        czi, hit = self.open_cached(cache)
+        czi.close()
+        self.assertFalse(hit)
+        czi, hit = self.open_cached(cache)
+        czi.close()
+        self.assertTrue(hit)
+        # the stale index was replaced
+        self.assertEqual(len(os.listdir(cache)), 1)
+
+        # so does a changed size with the same modification time
+        stat = os.stat(self.path)
+        with open(self.path, "ab") as fh:
+            fh.write(b"\0" * 32)
+        os.utime(self.path, (stat.st_atime, stat.st_mtime))
+        czi, hit = self.open_cached(cache)
+        czi.close()
+        self.assertFalse(hit)
+
+    def test_index_cache_not_writable(self):
+        data = write_timelapse(self.path)
+        # a file where the cache directory should be can not hold the index
+        cache = os.path.join(self.tempdir, "cache")
+        open(cache, "w").close()
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter("always")
+            czi, hit = self.open_cached(cache)
+        with czi:
+            self.assertFalse(hit)
+            self.assertTrue(np.array_equal(czi.asarray()[0, :, :, :, :, :, 0].transpose(0, 2, 1, 3, 4), data))
+        self.assertTrue(any("failed to write sidecar index" in str(w.message) for w in caught))
+        self.assertTrue(os.path.isfile(cache))
+
+    def test_directory_array(self):
+        write_mosaic(self.path, size_s=2, order="shuffle")
+        with czifile.CziFile(self.path) as czi:
+            records = czi.directory_array
+            # the records parsed from the directory segment at once match the entries of the subblock segments
+            segments = list(czi.segments(czifile.SubBlockSegment.SID))
+            expected = czifile.directory_array([segment.directory_entry for segment in segments])
+            order = np.argsort(records['file_position'])
+            self.assertEqual(records.dtype, expected.dtype)
+            self.assertTrue(np.array_equal(records[order], expected))
+            entries = czi.subblock_directory
+            self.assertEqual(len(entries), len(segments))
+            self.assertEqual([entry.file_position for entry in entries], records['file_position'].tolist())
+            self.assertEqual(czi.axes, b'BSCZYX0')
+            self.assertEqual(czi.shape, (1, 2, 2, 2, 20, 1036, 1))
+            self.assertEqual(czi.dtype, np.uint16)
+
+    def test_asarray_memmap_memory(self):
+        # each plane is only complete with the last tile of the file
+        data = write_mosaic(self.path, size_z=4, size_c=2, tiles_y=4, tiles_x=4, tile_y=128, tile_x=128,
+                            order="tile")
+        read_size = czifile.COALESCED_READ_SIZE
+        czifile.COALESCED_READ_SIZE = 2**16
+        try:
+            with czifile.CziFile(self.path) as czi:
+                # parse the subblock directory before measuring
+                czi.filtered_directory_array
+                for max_workers in (None, 2):
+                    tracemalloc.start()
+                    try:
+                        image = czi.asarray(memmap=True, tempdir=self.tempdir, max_workers=max_workers)
+                        peak = tracemalloc.get_traced_memory()[1]
+                    finally:
+                        tracemalloc.stop()
+                    self.assertTrue(np.array_equal(image[0, 0, :, :, :, :, 0].transpose(1, 0, 2, 3), data[0]))
+                    # tiles are written into the memmap as they are decoded instead of being kept per plane
+                    self.assertLess(peak, image.nbytes // 4)
+                    del image
+        finally:
+            czifile.COALESCED_READ_SIZE = read_size
+
+    def test_asarray_overlapping_tiles(self):
+        # three overlapping tiles of a plane, stored in the reverse of their mosaic order
+        tiles = [np.full((10, 10), m + 1, np.uint16) for m in range(3)]
+        dims = [[(b'B', 0, 1), (b'Y', 3 * m, 10), (b'X', 4 * m, 10), (b'M', m, 1)] for m in range(3)]
+        write_czi(self.path, [(dims[m], tiles[m]) for m in (2, 1, 0)], directory_order=[2, 1, 0])
+        expected = np.zeros((16, 18), np.uint16)
+        for m in range(3):
+            expected[3 * m:3 * m + 10, 4 * m:4 * m + 10] = m + 1
+        with czifile.CziFile(self.path) as czi:
+            # the tile with the highest mosaic index is on top, regardless of the order of the reads
+            for max_workers in (None, 3):
+                self.assertTrue(np.array_equal(czi.asarray(max_workers=max_workers)[0, :, :, 0], expected))
+                self.assertTrue(np.array_equal(czi.read_region(((2, 15), (1, 17)), max_workers=max_workers)[0, :, :, 0],
+                                               expected[2:15, 1:17]))
+
+    def test_read_subblocks_backpressure(self):
+        write_timelapse(self.path, size_t=4, size_z=8)
+        read_size = czifile.COALESCED_READ_SIZE
+        try:
+            with czifile.CziFile(self.path) as czi:
+                # one read per subblock
+                czifile.COALESCED_READ_SIZE = int(np.diff(czi.filtered_directory_array['file_position']).max())
+                reads = []
+                reader = czi._reader
+                czi._reader = _CountingReader(reader, reads)
+                subblocks = czi._read_subblocks(np.arange(len(czi.filtered_directory_array)), max_workers=2)
+                next(subblocks)
+                time.sleep(0.2)
+                # the threads do not read ahead of the consumer by more than two reads each
+                self.assertLessEqual(len(reads), 4)
+                self.assertEqual(len(list(subblocks)), len(czi.filtered_directory_array) - 1)
+                subblocks.close()
+        finally:
+            czifile.COALESCED_READ_SIZE = read_size
+
+    def test_concurrent_reads(self):
+        data = write_mosaic(self.path, size_s=2, size_z=5, size_c=3, order="shuffle")
+
+        def read(czi, i):
+            s, z, c = i % 2, i % 5, i % 3
+            x = 1000 * s
+            plane = czi.read_plane(S=s, C=c, Z=z)[:, x:x + 36, 0]
+            region = czi.read_region(((2, 15), (x + 3, x + 30)), S=s, Z=z, C=c)[0, 0, 0, 0, :, :, 0]
+            return (np.array_equal(plane, data[s, z, c]) and np.array_equal(region, data[s, z, c, 2:15, 3:30]) and
+                    czi.metadata is not None)
+
+        with open(self.path, "rb") as fh:
+            stream = io.BytesIO(fh.read())
+        # files are read with os.pread, streams without file descriptor under a lock
+        for source in (self.path, stream):
+            with czifile.CziFile(source) as czi:
+                pool = ThreadPool(16)
+                try:
+                    results = pool.map(lambda i: read(czi, i), range(200))
+                finally:
+                    pool.terminate()
+                self.assertTrue(all(results))
+
+    def test_attachments(self):
+        time_stamps = np.arange(5) * 1.5
+        focus_positions = np.array([0.1, 0.2, 0.3])
+        events = b''
+        for time, event_type, description in ((1.0, 0, b'start'), (2.5, 4, b'trigger')):
+            events += struct.pack('<idii', 20 + len(description), time, event_type, len(description)) + description
+        intensity = np.arange(6, dtype='<i2')
+        component = struct.pack('<iii', 12 + intensity.nbytes, 1, intensity.nbytes) + intensity.tobytes()
+        lookup_table = struct.pack('<i80si', 88 + len(component), b'lut1', 1) + component
+        attachments = [
+            (b'CZTIMS', b'TimeStamps', struct.pack('<ii', 8 + time_stamps.nbytes, 5) + time_stamps.tobytes()),
+            (b'CZFOC', b'FocusPositions', struct.pack('<ii', 8 + focus_positions.nbytes, 3) +
+             focus_positions.tobytes()),
+            (b'CZEVL', b'EventList', struct.pack('<ii', 8 + len(events), 2) + events),
+            (b'CZLUT', b'LookupTables', struct.pack('<ii', 8 + len(lookup_table), 1) + lookup_table)]
+        write_timelapse(self.path, attachments=attachments)
+        with czifile.CziFile(self.path) as czi:
+            self.assertEqual(sorted(czi.attachment_index), [b'CZEVL', b'CZFOC', b'CZLUT', b'CZTIMS'])
+            self.assertTrue(np.array_equal(czi.time_stamps, time_stamps))
+            self.assertTrue(np.array_equal(czi.focus_positions, focus_positions))
+            self.assertTrue(np.array_equal(czi.event_list.times, [1.0, 2.5]))
+            self.assertTrue(np.array_equal(czi.event_list.event_types, [0, 4]))
+            self.assertEqual([event.description for event in czi.event_list], ['start', 'trigger'])
+            self.assertEqual(czi.lookup_tables[0].identifier, 'lut1')
+            self.assertTrue(np.array_equal(czi.lookup_tables[0][0].intensity, intensity))
+            # the content is read once
+            self.assertIs(czi.attachment_data(b'CZTIMS'), czi.attachment_data(b'CZTIMS'))
+            self.assertIsNone(czi.attachment_data(b'CZEXP'))
+            self.assertEqual([type(attachment.data()).__name__ for attachment in czi.attachments()],
+                             ['TimeStamps', 'FocusPositions', 'EventList', 'LookupTables'])
+
+        write_timelapse(self.path)
+        with czifile.CziFile(self.path) as czi:
+            self.assertEqual(czi.attachment_index, {})
+            self.assertIsNone(czi.time_stamps)
+
+
+class _CountingReader(object):
+    """Records the reads of a czifile.PositionalReader"""
+
+    def __init__(self, reader, reads):
+        self._reader = reader
+        self.reads = reads
+
+    def read(self, size=-1):
+        self.reads.append(size)
+        return self._reader.read(size)
+
+    def __getattr__(self, name):
+        return getattr(self._reader, name)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+import os
+import shutil
+import tempfile
+import unittest
+import uuid
+import warnings
+from xml.etree import ElementTree
+
+import numpy as np
+import tifffile
+
+from aicsimage.io import omexml
+from aicsimage.io.omeTifReader import OmeTifReader
+from aicsimage.io.omeTifWriter import OmeTifWriter
+
+
+class TestOmeTifReader(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tempdir, "image.ome.tif")
+        self.data = np.random.RandomState(0).randint(0, 60000, (2, 3, 2, 8, 10)).astype(np.uint16)
+        with OmeTifWriter(self.path) as writer:
+            writer.save(self.data)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def write_with_uuids(self, path, tiffdatas, root_uuid=True):
+        """Rewrites the image to path with TiffData elements of (FirstT, PlaneCount, UUID, FileName)
+
+        :param root_uuid: Whether the OME element keeps its UUID attribute
+        """
+        with OmeTifReader(self.path) as reader:
+            ome = reader.omeMetadata
+        pixels = ome.image().Pixels
+        for tiffdata in pixels.TiffDatas():
+            pixels.node.remove(tiffdata.node)
+        for first_t, plane_count, text, file_name in tiffdatas:
+            node = ElementTree.SubElement(pixels.node, omexml.qn(ome.ns['ome'], "TiffData"),
+                                          FirstT=str(first_t), IFD=str(first_t * 6), PlaneCount=str(plane_count))
+            element = ElementTree.SubElement(node, omexml.qn(ome.ns['ome'], "UUID"), FileName=file_name)
+            element.text = text
+        if not root_uuid:
+            del ome.dom.attrib['UUID']
+        tifffile.imsave(path, self.data.reshape((-1,) + self.data.shape[3:]), description=str(ome))
+        return ome.uuidStr
+
+    def read(self, path):
+        """Returns the TZCYX image in path and the messages of the warnings raised while reading it"""
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter("always")
+            with OmeTifReader(path) as reader:
+                image = reader.load()
+        return image, [str(w.message) for w in caught]
+
+    def test_renamed_file(self):
+        with OmeTifReader(self.path) as reader:
+            root_uuid = reader.omeMetadata.uuidStr
+        path = os.path.join(self.tempdir, "renamed.ome.tif")
+        # the TiffData refers to this file by its UUID, under the name it was written with
+        self.write_with_uuids(path, [(0, 12, root_uuid, "original.ome.tif")])
+        image, messages = self.read(path)
+        self.assertTrue(np.array_equal(image, self.data))
+        self.assertEqual(messages, [])
+
+    def test_single_file_without_uuid(self):
+        path = os.path.join(self.tempdir, "renamed.ome.tif")
+        # the UUIDs can not be matched without the UUID of the OME element, but all TiffData name one file
+        self.write_with_uuids(path, [(0, 6, "urn:uuid:{}".format(uuid.uuid4()), "original.ome.tif"),
+                                     (1, 6, "urn:uuid:{}".format(uuid.uuid4()), "original.ome.tif")],
+                              root_uuid=False)
+        image, messages = self.read(path)
+        self.assertTrue(np.array_equal(image, self.data))
+        self.assertEqual(messages, [])
+
+    def test_planes_in_other_file(self):
+        with OmeTifReader(self.path) as reader:
+            root_uuid = reader.omeMetadata.uuidStr
+        path = os.path.join(self.tempdir, "part.ome.tif")
+        # the second time point is stored in another file of a multi-file set
+        self.write_with_uuids(path, [(0, 6, root_uuid, "part.ome.tif"),
+                                     (1, 6, "urn:uuid:{}".format(uuid.uuid4()), "other.ome.tif")])
+        image, messages = self.read(path)
+        self.assertTrue(np.array_equal(image[0], self.data[0]))
+        self.assertFalse(image[1].any())
+        self.assertEqual(len(messages), 1)
+        self.assertIn("6 of 12 planes are not stored", messages[0])
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            with OmeTifReader(path) as reader:
+                self.assertRaises(ValueError, reader.load_slice, t=1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,169 @@
+import os
+import shutil
+import tempfile
+import unittest
+import warnings
+
+try:
+    import imagecodecs
+except ImportError:
+    imagecodecs = None
+
+import numpy as np
+
+from aicsimage.io.omeTifReader import OmeTifReader
+from aicsimage.io.omeTifWriter import OmeTifWriter
+
+
+class TestOmeTifWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tempdir, "image.ome.tif")
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_begin_close_without_planes(self):
+        writer = OmeTifWriter(self.path)
+        writer.begin((2, 3, 4, 8, 10), np.uint16)
+        writer.close()
+        # an aborted stream does not leave a file without any image behind
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_begin_close_with_planes(self):
+        data = np.random.RandomState(0).randint(0, 60000, (3, 4, 8, 10)).astype(np.uint16)
+        with OmeTifWriter(self.path) as writer:
+            writer.begin((2,) + data.shape, data.dtype)
+            writer.save_stack(data)
+        with OmeTifReader(self.path) as reader:
+            self.assertTrue(np.array_equal(reader.load(t=0)[0], data))
+
+    def test_truncated_stream(self):
+        data = np.random.RandomState(0).randint(0, 60000, (2, 3, 2, 8, 10)).astype(np.uint16)
+        with OmeTifWriter(self.path) as writer:
+            writer.begin(data.shape, data.dtype, channel_names=["DNA", "Membrane"])
+            writer.save_stack(data[0])
+            writer.save_slice(data[1, 0, 0])
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter("always")
+            with OmeTifReader(self.path) as reader:
+                # the OME-XML written at close describes the declared image and the planes in the file
+                pixels = reader.omeMetadata.image().Pixels
+                self.assertEqual((pixels.SizeT, pixels.SizeZ, pixels.SizeC), (2, 3, 2))
+                self.assertEqual(reader.omeMetadata.image().Pixels.Channel(1).Name, "Membrane")
+                self.assertEqual(len(reader.tif.pages), 7)
+                self.assertEqual(np.count_nonzero(reader.plane_index >= 0), 7)
+                image = reader.load()
+        self.assertTrue(np.array_equal(image[0], data[0]))
+        self.assertTrue(np.array_equal(image[1, 0, 0], data[1, 0, 0]))
+        # the planes that were never written read as zeros, with a warning
+        self.assertEqual(np.count_nonzero(image[1].reshape(6, -1).any(axis=1)), 1)
+        self.assertTrue(any("5 of 12 planes" in str(w.message) for w in caught))
+
+    def assert_round_trip(self, data, **kwargs):
+        """Writes data with the OmeTifWriter options in kwargs and checks that it is read back unchanged
+
+        :return: The first page of the written file
+        """
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        with OmeTifWriter(self.path, **kwargs) as writer:
+            writer.save(data)
+        with OmeTifReader(self.path) as reader:
+            self.assertTrue(np.array_equal(reader.load(), data), kwargs)
+            return reader.tif.pages[0]
+
+    def test_compression(self):
+        data = np.random.RandomState(0).randint(0, 4000, (2, 3, 2, 30, 40)).astype(np.uint16)
+        for compression, code in ((None, 1), ("deflate", 8)):
+            for predictor in (False, True) if compression else (False,):
+                for max_workers in (None, 3):
+                    page = self.assert_round_trip(data, compression=compression, compression_level=1,
+                                                  predictor=predictor, max_workers=max_workers)
+                    self.assertEqual(page.tags['compression'].value, code)
+                    self.assertEqual(page.tags['predictor'].value if 'predictor' in page.tags else 1,
+                                     2 if predictor else 1)
+        self.assertRaises(ValueError, OmeTifWriter(self.path, overwrite_file=True, predictor=True).save,
+                          data.astype(np.float32))
+
+    @unittest.skipIf(imagecodecs is None, "requires imagecodecs")
+    def test_lzw(self):
+        data = np.random.RandomState(0).randint(0, 4000, (1, 3, 2, 30, 40)).astype(np.uint16)
+        for predictor in (False, True):
+            page = self.assert_round_trip(data, compression="lzw", predictor=predictor, max_workers=2)
+            self.assertEqual(page.tags['compression'].value, 5)
+
+    def test_tiles(self):
+        # the planes are not a multiple of the tile size, so the last row and column of tiles are partial
+        data = np.random.RandomState(0).randint(0, 60000, (1, 2, 2, 40, 70)).astype(np.uint16)
+        for compression in (None, "deflate"):
+            page = self.assert_round_trip(data, compression=compression, tile_size=(16, 32), max_workers=2)
+            self.assertTrue(page.is_tiled)
+            self.assertEqual((page.tags['tile_length'].value, page.tags['tile_width'].value), (16, 32))
+            with OmeTifReader(self.path) as reader:
+                self.assertTrue(np.array_equal(reader.load_roi((10, 37), (30, 65), z=1), data[:, 1:2, :, 10:37, 30:65]))
+                self.assertTrue(np.array_equal(reader.lazy()[0, :, 1, 33:, 60:], data[0, :, 1, 33:, 60:]))
+        self.assertRaises(ValueError, OmeTifWriter(self.path, overwrite_file=True, tile_size=20).save, data)
+
+    def test_load_roi_clipped(self):
+        data = np.random.RandomState(0).randint(0, 60000, (1, 2, 2, 20, 36)).astype(np.uint16)
+        self.assert_round_trip(data, tile_size=16)
+        with OmeTifReader(self.path) as reader:
+            # the parts of the region outside the image are clipped
+            image = reader.load_roi((-5, 12), (30, 100))
+            self.assertEqual(image.shape, (1, 2, 2, 12, 6))
+            self.assertTrue(np.array_equal(image, data[:, :, :, :12, 30:]))
+            self.assertEqual(reader.load_roi((25, 30), (0, 10)).shape, (1, 2, 2, 0, 10))
+
+    def test_pyramid(self):
+        data = np.random.RandomState(0).randint(0, 60000, (1, 2, 2, 45, 70)).astype(np.uint16)
+        with OmeTifWriter(self.path, tile_size=16, pyramid_levels=2, pyramid_downsample="nearest") as writer:
+            writer.save(data)
+        with OmeTifReader(self.path) as reader:
+            self.assertEqual(len(reader.tif.pages), 4)
+            self.assertEqual(reader.pyramid_levels(), [1, 2, 4])
+            self.assertTrue(np.array_equal(reader.load(), data))
+            for level, factor in ((1, 2), (2, 4)):
+                expected = data[..., ::factor, ::factor]
+                self.assertTrue(np.array_equal(reader.load(level=level), expected))
+                self.assertTrue(np.array_equal(reader.load_slice(z=1, c=1, level=level), expected[0, 1, 1]))
+                self.assertTrue(np.array_equal(reader.load_roi((3, 9), (2, 14), c=0, level=level),
+                                               expected[:, :, :1, 3:9, 2:14]))
+                self.assertTrue(np.array_equal(reader.lazy(level=level)[0, 1], expected[0, 1]))
+
+        # the mean of 2x2 blocks, with the last row repeated for the odd height
+        os.remove(self.path)
+        with OmeTifWriter(self.path, pyramid_levels=1, max_workers=2) as writer:
+            writer.save(data)
+        padded = np.concatenate([data, data[..., -1:, :]], axis=3).astype(np.int64)
+        expected = (padded.reshape(1, 2, 2, 23, 2, 35, 2).sum(axis=(4, 6)) + 2) // 4
+        with OmeTifReader(self.path) as reader:
+            self.assertTrue(np.array_equal(reader.load(level=1), expected))
+
+    def test_bigtiff(self):
+        data = np.random.RandomState(0).randint(0, 60000, (2, 2, 2, 40, 50)).astype(np.uint16)
+        self.assert_round_trip(data)
+        with OmeTifReader(self.path) as reader:
+            self.assertFalse(reader.tif.is_bigtiff)
+        for kwargs in ({}, dict(tile_size=16, pyramid_levels=2, max_workers=2)):
+            self.assert_round_trip(data, bigtiff=True, **kwargs)
+            with OmeTifReader(self.path) as reader:
+                self.assertTrue(reader.tif.is_bigtiff)
+                if kwargs:
+                    # the SubIFDs of the levels are stored with 64 bit offsets
+                    self.assertEqual(reader.pyramid_levels(), [1, 2, 4])
+                    self.assertEqual(reader.load(level=2).shape, (2, 2, 2, 10, 13))
+
+        # the format is chosen from the uncompressed size of the declared shape, up front
+        os.remove(self.path)
+        for bigtiff, expected in ((None, True), (False, False)):
+            writer = OmeTifWriter(self.path, bigtiff=bigtiff)
+            writer.begin((1, 1100, 1, 2048, 1024), np.uint16)
+            self.assertEqual(writer._tif.bigtiff, expected)
+            writer.close()
+            self.assertFalse(os.path.exists(self.path))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,160 @@
+import io
+import os
+import re
+import shutil
+import tempfile
+import threading
+import unittest
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+import numpy as np
+
+from aicsimage.io import CziReader, RangeFile
+from .makeCzi import write_mosaic
+
+
+class _RangeServer(ThreadingMixIn, HTTPServer):
+    """Serves the bytes of data at any path, with support for range requests"""
+    daemon_threads = True
+
+    def __init__(self, data):
+        HTTPServer.__init__(self, ("127.0.0.1", 0), _RangeHandler)
+        self.data = data
+        self.ranges = []
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:{}/image.czi".format(self.server_address[1])
+
+
+class _RangeHandler(BaseHTTPRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(self.server.data)))
+        self.end_headers()
+
+    def do_GET(self):
+        begin, end = (int(i) for i in re.match(r"bytes=(\d+)-(\d+)", self.headers["Range"]).groups())
+        data = self.server.data[begin:end + 1]
+        self.server.ranges.append((begin, end + 1))
+        self.send_response(206)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class TestRangeFile(unittest.TestCase):
+
+    def setUp(self):
+        self.data = bytes(bytearray(np.random.RandomState(0).randint(0, 256, 1000).astype(np.uint8)))
+        self.ranges = []
+
+    def read_range(self, offset, size):
+        self.ranges.append((offset, offset + size))
+        return self.data[offset:offset + size]
+
+    def test_read_across_blocks(self):
+        source = RangeFile(self.read_range, len(self.data), block_size=100, cache_size=1000)
+        self.assertEqual(source.read_at(50, 400), self.data[50:450])
+        # the adjacent missing blocks are fetched with one request
+        self.assertEqual(self.ranges, [(0, 500)])
+        self.assertEqual((source.requests, source.hits, source.misses), (1, 0, 5))
+        self.assertEqual(source.read_at(420, 200), self.data[420:620])
+        self.assertEqual(self.ranges[1:], [(500, 700)])
+        self.assertEqual((source.requests, source.hits, source.misses), (2, 1, 7))
+        self.assertEqual(source.read_at(990, 100), self.data[990:])
+        self.assertEqual(source.read_at(1000, 10), b"")
+        # reads larger than half the cache bypass it
+        self.assertEqual(source.read_at(0), self.data)
+        self.assertEqual(self.ranges[-1], (0, 1000))
+
+    def test_lru_eviction(self):
+        source = RangeFile(self.read_range, len(self.data), block_size=100, cache_size=300)
+        source.read_at(0, 10)
+        source.read_at(100, 10)
+        source.read_at(200, 10)
+        self.assertEqual(source._cached_bytes, 300)
+        # block 0 becomes the most recently used, so block 1 is evicted for block 3
+        source.read_at(0, 10)
+        source.read_at(300, 10)
+        self.assertEqual(source._cached_bytes, 300)
+        self.assertEqual(list(source._blocks), [2, 0, 3])
+        del self.ranges[:]
+        self.assertEqual(source.read_at(100, 150), self.data[100:250])
+        self.assertEqual(self.ranges, [(100, 200)])
+        self.assertLessEqual(source._cached_bytes, 300)
+        source.clear_cache()
+        self.assertEqual(source._cached_bytes, 0)
+
+    def test_seek_tell(self):
+        with RangeFile(self.read_range, len(self.data), block_size=64) as source:
+            self.assertEqual(source.read(10), self.data[:10])
+            self.assertEqual(source.tell(), 10)
+            self.assertEqual(source.seek(-20, os.SEEK_END), 980)
+            self.assertEqual(source.read(), self.data[980:])
+            self.assertEqual(source.tell(), 1000)
+            source.seek(100)
+            self.assertEqual(source.seek(-30, os.SEEK_CUR), 70)
+            self.assertEqual(source.read(100), self.data[70:170])
+            # positional reads do not move the file position
+            self.assertEqual(source.read_at(500, 5), self.data[500:505])
+            self.assertEqual(source.tell(), 170)
+            self.assertRaises(ValueError, source.seek, 0, 3)
+            self.assertRaises(ValueError, source.read_at, -1, 5)
+        self.assertTrue(source.closed)
+        self.assertRaises(ValueError, source.read, 1)
+
+    def test_from_fileobj(self):
+        stream = io.BytesIO(self.data)
+        source = RangeFile.from_fileobj(stream, block_size=128)
+        self.assertEqual(source.size, len(self.data))
+        self.assertEqual(source.read_at(100, 300), self.data[100:400])
+        source.seek(900)
+        self.assertEqual(source.read(), self.data[900:])
+
+
+class TestRangeFileUrl(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        path = os.path.join(self.tempdir, "image.czi")
+        self.image = write_mosaic(path, size_s=2, size_z=3, order="shuffle")
+        with open(path, "rb") as fh:
+            self.server = _RangeServer(fh.read())
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.tempdir)
+
+    def test_from_url(self):
+        source = RangeFile.from_url(self.server.url, block_size=256)
+        self.assertEqual(source.size, len(self.server.data))
+        self.assertEqual(source.name, self.server.url)
+        self.assertEqual(source.read_at(1000, 600), self.server.data[1000:1600])
+        self.assertEqual(self.server.ranges, [(768, 1792)])
+
+    def test_czi_reader(self):
+        source = RangeFile.from_url(self.server.url, block_size=4096)
+        with CziReader(source) as reader:
+            self.assertTrue(np.array_equal(reader.load(scene=1)[0], self.image[1]))
+            self.assertTrue(np.array_equal(reader.load_slice(z=2, c=1)[:, :36], self.image[0, 2, 1]))
+        # the many small reads of the file are served by a few block sized requests
+        self.assertLess(source.requests, len(self.server.data) // 4096 + 10)
+
+
+if __name__ == '__main__':
+    unittest.main()